@@ -0,0 +1,242 @@
+'''Benchmarks for the PYFS hot paths.
+
+Run with python -m benchmarks.bench_pyfs, every result is printed as one JSON
+object per line and can be written to a file with --output. Passing a
+previous output file with --compare exits with status 1 when any benchmark
+got slower by more than --threshold.
+'''
+import argparse
+import io
+import json
+import logging
+import platform
+import sys
+import tempfile
+import time
+
+from pyfs import PYFS
+
+BENCHMARKS = {}
+
+def benchmark(name):
+    '''Register func(fs, scale) which prepares the filesystem and returns the timed callable.
+
+    The callable returns the number of operations it did and the bytes it moved.
+    '''
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+def _make_dirs(inode, count, prefix='dir'):
+    for idx in range(count):
+        inode.make_dir(f'{prefix}{idx}')
+
+@benchmark('make_dir_large_dir')
+def make_dir_large_dir(fs, scale):
+    count = 2000 * scale
+    def run():
+        _make_dirs(fs.root_inode, count)
+        return count, 0
+    return run
+
+@benchmark('make_file_large_dir')
+def make_file_large_dir(fs, scale):
+    count = 2000 * scale
+    def run():
+        for idx in range(count):
+            fs.root_inode.make_file(f'file{idx}')
+        return count, 0
+    return run
+
+@benchmark('find_entry_large_dir')
+def find_entry_large_dir(fs, scale):
+    count = 2000 * scale
+    _make_dirs(fs.root_inode, count)
+    names = [f'dir{idx}' for idx in range(count)]
+    def run():
+        for name in names:
+            fs.root_inode.find_entry(name)
+        return count, 0
+    return run
+
+def _deep_tree(fs, depth):
+    inode = fs.root_inode
+    for idx in range(depth):
+        inode.make_dir(f'level{idx}')
+        inode = fs.read_inode(inode.find_entry(f'level{idx}').addr)
+    return '/' + '/'.join(f'level{idx}' for idx in range(depth))
+
+@benchmark('resolve_deep_cold')
+def resolve_deep_cold(fs, scale):
+    path = _deep_tree(fs, 32)
+    count = 500 * scale
+    def run():
+        for _ in range(count):
+            fs.dentries.clear()
+            fs.resolve(path)
+        return count, 0
+    return run
+
+@benchmark('resolve_deep_cached')
+def resolve_deep_cached(fs, scale):
+    path = _deep_tree(fs, 32)
+    count = 5000 * scale
+    def run():
+        for _ in range(count):
+            fs.resolve(path)
+        return count, 0
+    return run
+
+@benchmark('ls_long_chain')
+def ls_long_chain(fs, scale):
+    _make_dirs(fs.root_inode, 2000 * scale)
+    count = 50
+    def run():
+        for _ in range(count):
+            fs.root_inode.ls()
+        return count, 0
+    return run
+
+@benchmark('save_all_dirty')
+def save_all_dirty(fs, scale):
+    count = 2000 * scale
+    # keep every dirty inode cached so none of them are written by eviction
+    fs.loaded_inodes.max_entries = None
+    for _ in range(count):
+        fs.create_inode().dirty = True
+    def run():
+        fs.save_all()
+        return count, count * fs.block_size
+    return run
+
+@benchmark('small_file_write_read')
+def small_file_write_read(fs, scale):
+    count = 500 * scale
+    payload = b'x' * 1024
+    def run():
+        for idx in range(count):
+            with fs.open(f'/small{idx}', 'wb') as f:
+                f.write(payload)
+        for idx in range(count):
+            with fs.open(f'/small{idx}', 'rb') as f:
+                f.read()
+        return count * 2, count * len(payload) * 2
+    return run
+
+@benchmark('large_file_write_read')
+def large_file_write_read(fs, scale):
+    payload = bytes(range(256)) * 4096 * 8 * scale
+    def run():
+        with fs.open('/large', 'wb') as f:
+            for idx in range(0, len(payload), 1 << 20):
+                f.write(payload[idx:idx + (1 << 20)])
+        with fs.open('/large', 'rb') as f:
+            while f.read(1 << 20):
+                pass
+        return 2, len(payload) * 2
+    return run
+
+def _open_backend(backend):
+    if backend == 'bytesio':
+        return io.BytesIO()
+    return tempfile.TemporaryFile()
+
+def run_benchmark(name, backend, scale=1, repeat=3, **fs_options) -> dict:
+    '''Run one benchmark repeat times on a fresh filesystem each time and report the fastest run'''
+    best = None
+    for _ in range(repeat):
+        with _open_backend(backend) as dev:
+            fs = PYFS(dev, **fs_options)
+            fs.create_fs()
+            run = BENCHMARKS[name](fs, scale)
+
+            start = time.perf_counter()
+            ops, moved = run()
+            fs.sync()
+            elapsed = time.perf_counter() - start
+
+        if best is None or elapsed < best[0]:
+            best = (elapsed, ops, moved)
+
+    elapsed, ops, moved = best
+    return {'name': name,
+            'backend': backend,
+            'scale': scale,
+            'options': fs_options,
+            'ops': ops,
+            'seconds': elapsed,
+            'ops_per_sec': ops / elapsed if elapsed else None,
+            'bytes_per_sec': moved / elapsed if elapsed and moved else None,
+            'python': platform.python_version(),
+           }
+
+def _result_key(result) -> tuple:
+    '''What a result is compared on, runs with different filesystem options are different benchmarks'''
+    options = tuple(sorted(result.get('options', {}).items()))
+    return (result['name'], result['backend'], result['scale'], options)
+
+def compare(results, baseline, threshold: float) -> list:
+    '''Return (name, backend, old seconds, new seconds) for every result slower than baseline by more than threshold.
+
+    Results without a baseline entry of the same name, backend, scale and
+    options are skipped.
+    '''
+    old = {_result_key(a): a['seconds'] for a in baseline}
+
+    regressions = []
+    for result in results:
+        key = _result_key(result)
+        if key not in old:
+            print(f'NO BASELINE {result["name"]} [{result["backend"]}], skipped', file=sys.stderr)
+            continue
+        if result['seconds'] > old[key] * (1 + threshold):
+            regressions.append((result['name'], result['backend'], old[key], result['seconds']))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark PYFS hot paths')
+    parser.add_argument('names', nargs='*', help=f'benchmarks to run, all by default: {", ".join(BENCHMARKS)}')
+    parser.add_argument('--backend', choices=('bytesio', 'disk', 'all'), default='all')
+    parser.add_argument('--scale', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--write-back', action='store_true')
+    parser.add_argument('--journal', action='store_true')
+    parser.add_argument('--extent-files', action='store_true')
+    parser.add_argument('--output', help='write the results as a JSON list')
+    parser.add_argument('--compare', help='JSON list from an earlier run to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown against --compare, 0.2 is 20%%')
+    args = parser.parse_args(argv)
+
+    names = args.names or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f'Unknown benchmarks: {", ".join(unknown)}')
+
+    backends = ('bytesio', 'disk') if args.backend == 'all' else (args.backend,)
+    options = {'write_back': args.write_back, 'journal': args.journal, 'extent_files': args.extent_files}
+
+    results = []
+    for backend in backends:
+        for name in names:
+            result = run_benchmark(name, backend, args.scale, args.repeat, **options)
+            print(json.dumps(result), flush=True)
+            results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for name, backend, old, new in regressions:
+            print(f'REGRESSION {name} [{backend}]: {old:.4f}s -> {new:.4f}s', file=sys.stderr)
+        return 1 if regressions else 0
+
+    return 0
+
+if __name__ == '__main__':
+    # the benchmarks time the filesystem, not its debug logging
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(main())
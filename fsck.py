@@ -0,0 +1,30 @@
+import argparse
+import logging
+import sys
+
+from pyfs.fsck import fsck
+
+logging.basicConfig(filename="pyfs.log", level=logging.INFO)
+
+def main():
+    parser = argparse.ArgumentParser(description='Check a PYFS image that is not mounted')
+    parser.add_argument('image')
+    parser.add_argument('--workers', '-j', type=int, default=None, help='number of scanning processes, defaults to the cpu count')
+
+    args = parser.parse_args()
+    report = fsck(args.image, workers=args.workers)
+
+    print(f'{report.blocks} blocks, {report.directories} directories, {report.files} files')
+    for error in report.errors:
+        print('error:', error)
+    for addr, first, second in report.cross_links:
+        print(f'cross-linked: block {addr} used by {first} and {second}')
+    for what, addr in report.cycles:
+        print(f'cycle: {what} loops back to block {addr}')
+    if report.orphans:
+        print(f'orphans: {len(report.orphans)} allocated blocks are unreachable', report.orphans[:20])
+
+    sys.exit(0 if report.clean else 1)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
+import json
 import logging
 import pyfs.pyfs
 import pyfs.inode
+import pyfs.errors
 import shlex
 
 from functools import partial
@@ -12,11 +14,13 @@ ALIAS = (('ll', 'ls -l'),)
 cwd = PurePosixPath('/')
 fs = None
 current_inode = None
+default_block_size = None
 
-def set_up_interactive(file_system: 'pyfs.pyfs.PYFS'):
-    global fs
+def set_up_interactive(file_system: 'pyfs.pyfs.PYFS', block_size: int = None):
+    global fs, default_block_size
     
     fs = file_system
+    default_block_size = block_size
     loadfs()
 
     commands = COMMANDS
@@ -57,25 +61,70 @@ def chkfs():
     print(f'Filesystem is {"good" if fs.check_fs() else "bad"}')
 
 @register_func
-def mkfs():
+def stats():
+    global fs
+    print(json.dumps(fs.stats(), indent=2))
+
+@register_func
+def mkfs(block_size=None):
     global fs
     if not fs.check_fs():
-        fs.create_fs()
+        block_size = int(block_size or default_block_size or fs.block_size)
+        try:
+            fs.create_fs(block_size)
+        except ValueError as e:
+            print(e)
+
+@register_func
+def trim():
+    global fs
+    print(f'Released {fs.trim()} free blocks')
+
+def writable_cwd():
+    '''Resolve the current directory again for a change, copying it out of any snapshot it is shared with'''
+    global current_inode
+    current_inode = fs.resolve(cwd, write=True)
+    return current_inode
+
+@register_func
+def snapshot(name):
+    global fs
+    fs.snapshot(name)
+
+@register_func
+def clone(src, dst):
+    global fs
+    fs.clone(cwd / src, cwd / dst)
+
+@register_func
+def compact(recursive=None):
+    global fs
+    print(f'Freed {fs.compact(cwd, recursive=recursive == "-r")} blocks')
 
 @register_func
 def mkdir(name):
     global fs, current_inode
-    current_inode.make_dir(name)
+    writable_cwd().make_dir(name)
 
 @register_func
 def touch(name):
     global fs, current_inode
-    current_inode.make_file(name)
+    writable_cwd().make_file(name)
+
+@register_func
+def rm(name):
+    global fs, current_inode
+    try:
+        writable_cwd()
+        current_inode.unlink(name)
+    except pyfs.errors.InodeError as e:
+        print(f'Can\'t remove {name}: {type(e).__name__}')
 
 @register_func
 def nano(name):
     global fs, current_inode
     content = input()
+    writable_cwd()
     file_inode = current_inode.find_entry(name)
 
     if file_inode is None:
@@ -83,7 +132,7 @@ def nano(name):
         current_inode.make_file(name)
         file_inode = current_inode.find_entry(name)
 
-    file_inode = fs.read_inode(file_inode.addr)
+    file_inode = fs.resolve(cwd / name, write=True)
     file_inode.data = content.encode('utf-8')
 
 
@@ -109,31 +158,26 @@ def pwd():
 @register_func
 def cd(path: str):
     global cwd, fs, current_inode
-    old_cwd = cwd
-    old_current_inode = current_inode
-    path = PurePosixPath(path)
-    cwd = cwd / path
-
-    logging.debug(cwd.parts)
 
     build_path = []
-    current_inode = fs.root_inode
-    if len(cwd.parts) > 1:
-        for dirs in cwd.parts[1:]:
-            if dirs == '.':
-                continue
-            elif dirs == '..':
-                if current_inode.parent_inode_addr != 0:
-                    current_inode = fs.read_inode(current_inode.parent_inode_addr)
-                    build_path = build_path[:-1]
-            else:
-                tmp = current_inode.find_entry(dirs)
-
-                if tmp is None:
-                    print(f'Can\'t find directory {dirs}')
-                    cd(old_cwd)
-                    return
-                
-                current_inode = fs.read_inode(tmp.addr)
-                build_path.append(dirs)
-        cwd = PurePosixPath('/' + '/'.join(build_path))
+    for dirs in (cwd / path).parts[1:]:
+        if dirs == '.':
+            continue
+        elif dirs == '..':
+            build_path = build_path[:-1]
+        else:
+            build_path.append(dirs)
+    new_cwd = PurePosixPath('/' + '/'.join(build_path))
+
+    try:
+        inode = fs.resolve(new_cwd)
+    except (FileNotFoundError, NotADirectoryError):
+        print(f'Can\'t find directory {path}')
+        return
+
+    if not inode.is_dir:
+        print(f'{path} is not a directory')
+        return
+
+    cwd = new_cwd
+    current_inode = inode
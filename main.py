@@ -1,4 +1,5 @@
 import argparse
+import json
 from io import IncrementalNewlineDecoder
 import logging
 import os
@@ -6,13 +7,10 @@ import code
 import shlex
 
 from pyfs.pyfs import PYFS
+from pyfs.constants import DEFAULT_BLOCK_SIZE, KB, MB, GB
 from pyfs.inode import InodeEntryExists, Inode
 from interactive_utils import set_up_interactive
 
-#set up logging levels for all the different loggers
-logging.basicConfig(filename="pyfs.log", level=logging.DEBUG)
-logging.getLogger('pyfs').setLevel(logging.DEBUG)
-#logging.getLogger('pyfs.inode').setLevel(logging.INFO)
 
 def touchopen(filename, *args, **kwargs):
     # Open the file in R/W and create if it doesn't exist. *Don't* pass O_TRUNC
@@ -21,22 +19,42 @@ def touchopen(filename, *args, **kwargs):
     # Encapsulate the low-level file descriptor in a python file object
     return os.fdopen(fd, *args, **kwargs)
 
+def byte_size(value: str) -> int:
+    # accepts a byte count or a K/M/G suffixed size such as 64K
+    units = {'K': KB, 'M': MB, 'G': GB}
+    value = value.strip().upper()
+    try:
+        if value[-1:] in units:
+            return int(value[:-1]) * units[value[-1]]
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid size: {value}') from None
+
 def main():
     parser = argparse.ArgumentParser()
 
     parser.add_argument('--interactive', '-i', action='store_true')
+    parser.add_argument('--log-level', default='WARNING', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'))
+    parser.add_argument('--stats', action='store_true', help='print I/O and cache statistics on exit')
+    parser.add_argument('--block-size', type=byte_size, default=DEFAULT_BLOCK_SIZE,
+                        help='block size of a newly created filesystem, 4K to 1M (default 4K)')
+    parser.add_argument('--size', type=byte_size, help='grow a newly created image to this size up front, as a sparse file')
+    parser.add_argument('--preallocate', action='store_true', help='reserve the disk space of --size instead of leaving it sparse')
     
     parser.add_argument("file")
     
     args = parser.parse_args()
 
+    #set up logging levels for all the different loggers
+    logging.basicConfig(filename="pyfs.log", level=args.log_level)
+
     filename = args.file
     with touchopen(filename, "w+b") as f:
         logging.debug('filestream is %s', f)
         fs = PYFS(f)
 
         if args.interactive:
-            commands = set_up_interactive(fs)
+            commands = set_up_interactive(fs, args.block_size)
 
             try:
                 while (entered := input('>> ')) != 'exit':
@@ -56,10 +74,15 @@ def main():
             
             print('Exiting Shell')
             fs.save_all()
+            if args.stats:
+                print(json.dumps(fs.stats(), indent=2))
             return
 
         if not fs.check_fs():
-            fs.create_fs()
+            try:
+                fs.create_fs(args.block_size, args.size // args.block_size if args.size else None, args.preallocate)
+            except ValueError as e:
+                parser.error(str(e))
 
         #set_up_test_directories(fs)
         
@@ -70,6 +93,9 @@ def main():
             
             for b in a.ls():
                 print('  ', b)
+
+        if args.stats:
+            print(json.dumps(fs.stats(), indent=2))
         
 
 if __name__ == "__main__":
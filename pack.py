@@ -0,0 +1,37 @@
+import argparse
+import logging
+
+from pyfs.pyfs import PYFS
+from pyfs.pack import pack, unpack
+from pyfs.constants import DEFAULT_BLOCK_SIZE
+
+logging.basicConfig(filename="pyfs.log", level=logging.INFO)
+
+def main():
+    parser = argparse.ArgumentParser(description='Copy a host directory tree into a new PYFS image or back out of one')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    pack_parser = commands.add_parser('pack', help='Build a new image from a host directory')
+    pack_parser.add_argument('hostdir')
+    pack_parser.add_argument('image')
+    pack_parser.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE, help='block size in bytes, 4096 to 1048576')
+
+    unpack_parser = commands.add_parser('unpack', help='Copy the contents of an image into a host directory')
+    unpack_parser.add_argument('image')
+    unpack_parser.add_argument('hostdir')
+
+    args = parser.parse_args()
+
+    if args.command == 'pack':
+        with open(args.image, 'w+b') as f:
+            pack(args.hostdir, f, block_size=args.block_size)
+        return
+
+    with open(args.image, 'rb') as f:
+        fs = PYFS(f, read_only=True)
+        if not fs.check_fs():
+            parser.error(f'{args.image} is not a PYFS image')
+        unpack(fs, args.hostdir)
+
+if __name__ == "__main__":
+    main()
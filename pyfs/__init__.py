@@ -1,4 +1,11 @@
-from .pyfs import PYFS
+from .pyfs import PYFS, StatResult
 from .inode_entry import InodeEntry
 from .inode import Inode
+from .file import PYFSFile
+from .cache import BlockCache
+from .allocator import BlockAllocator
+from .dentry_cache import DentryCache
+from .journal import Journal
+from .async_pyfs import AsyncPYFS
+from .shared_index import SharedPathIndex
 from .errors import *
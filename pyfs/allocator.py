@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import logging
+import re
+import pyfs #pylint: disable=unused-import
+
+from .errors import OutOfInodeError
+from .constants import INODE_META_SIZE, MAX_BLOCKS
+
+logger = logging.getLogger("pyfs.allocator")
+
+# any byte of the bitmap that still has a free block in it
+FREE_BYTE = re.compile(b'[^\xff]')
+# runs of free blocks in the bitmap written out as a string of bits
+FREE_RUN = re.compile('0+')
+
+class BlockAllocator:
+    '''Free-space bitmap allocator.
+
+    One bit per block, set for allocated blocks. The bitmap is kept in memory
+    and stored in the payload of a chain of bitmap inodes, the first of which
+    is referenced from the root block. Blocks at or past end_page are free and
+    allocating them grows the image.
+    '''
+    def __init__(self, fs: 'pyfs.PYFS'):
+        self.fs = fs
+
+        self.bitmap = bytearray()
+        self.end_page = 0
+        self.bitmap_addrs = []
+
+        self._dirty = set()
+        self._root_dirty = False
+
+    @property
+    def bits_per_block(self) -> int:
+        return (self.fs.block_size - INODE_META_SIZE) * 8
+
+    def is_allocated(self, addr: int) -> bool:
+        if addr >= self.end_page:
+            return False
+        return bool(self.bitmap[addr >> 3] & (0x80 >> (addr & 7)))
+
+    def _set_bit(self, addr: int, value: bool) -> None:
+        if value:
+            self.bitmap[addr >> 3] |= 0x80 >> (addr & 7)
+        else:
+            self.bitmap[addr >> 3] &= ~(0x80 >> (addr & 7)) & 0xff
+
+    def _set(self, addr: int, count: int, value: bool) -> None:
+        end = addr + count
+        cur = addr
+        while cur < end and cur & 7:
+            self._set_bit(cur, value)
+            cur += 1
+
+        # whole bytes of the run are filled in one go
+        full = (end - cur) >> 3
+        if full:
+            self.bitmap[cur >> 3:(cur >> 3) + full] = (b'\xff' if value else b'\x00') * full
+            cur += full << 3
+
+        while cur < end:
+            self._set_bit(cur, value)
+            cur += 1
+
+        bits = self.bits_per_block
+        self._dirty.update(range(addr // bits, (addr + count - 1) // bits + 1))
+
+    def format(self, used: int) -> None:
+        '''Start an empty bitmap with the first used blocks allocated.
+
+        The first bitmap block is only written once something is allocated, an
+        image without one is loaded by marking every existing block as used.
+        '''
+        logger.info('Creating free space bitmap')
+        self._unpin()
+        self.bitmap = bytearray()
+        self.end_page = 0
+        self.bitmap_addrs = []
+        self._dirty = set()
+
+        self._extend(used)
+        self.fs.root_block.end_page = self.end_page
+        self._root_dirty = False
+
+    def _unpin(self) -> None:
+        for addr in self.bitmap_addrs:
+            self.fs.loaded_inodes.unpin(addr)
+
+    def load(self) -> None:
+        root = self.fs.root_block
+        self._unpin()
+        self.bitmap = bytearray()
+        self.bitmap_addrs = []
+        self._dirty = set()
+
+        if root.bitmap_addr == 0:
+            # image from before the bitmap existed, everything in it is in use
+            used = self.fs.device_blocks()
+            logger.info('No free space bitmap, marking %s blocks as used', used)
+            self.end_page = 0
+            self._extend(used)
+            self.sync()
+            return
+
+        addr = root.bitmap_addr
+        while addr != 0:
+            inode = self.fs.read_inode(addr)
+            self.fs.loaded_inodes.pin(addr)
+            self.bitmap_addrs.append(addr)
+            self.bitmap += inode.read_data(0, inode.data_size)
+            addr = inode.next_inode_addr
+
+        self.end_page = root.end_page
+        self._resize()
+        logger.info('Loaded free space bitmap for %s blocks', self.end_page)
+
+    def _resize(self) -> None:
+        size = (self.end_page + 7) // 8
+        if len(self.bitmap) < size:
+            self.bitmap += bytes(size - len(self.bitmap))
+
+    def _extend(self, count: int) -> int:
+        addr = self.end_page
+        if addr + count > MAX_BLOCKS:
+            raise OutOfInodeError('Filesystem is out of addressable blocks')
+
+        self.end_page += count
+        self._root_dirty = True
+        self._resize()
+        self._set(addr, count, True)
+        return addr
+
+    def _add_bitmap_block(self) -> None:
+        addr = self.end_page
+        self.end_page += 1
+        self._resize()
+        self._set(addr, 1, True)
+
+        # bitmap blocks are written on every sync so keep them cached
+        inode = self.fs.init_inode(addr)
+        self.fs.loaded_inodes.pin(addr)
+        inode.contains_data = True
+        inode.is_bitmap = True
+
+        if self.bitmap_addrs:
+            prev = self.fs.read_inode(self.bitmap_addrs[-1])
+            inode.parent_inode_addr = prev.addr
+            prev.next_inode_addr = addr
+            prev.save()
+
+        self.bitmap_addrs.append(addr)
+        self._dirty.add(len(self.bitmap_addrs) - 1)
+        self._root_dirty = True
+
+    def _find_run(self, count: int, start: int, end: int) -> int:
+        pos = start
+        while pos + count <= end:
+            if self.is_allocated(pos):
+                if pos & 7 == 0:
+                    # skip over bytes with no free blocks in them
+                    match = FREE_BYTE.search(self.bitmap, pos >> 3, (end + 7) >> 3)
+                    if match is None:
+                        return None
+                    pos = max(match.start() << 3, pos + 1)
+                else:
+                    pos += 1
+                continue
+
+            run = 1
+            while run < count and not self.is_allocated(pos + run):
+                run += 1
+
+            if run == count:
+                return pos
+            pos += run + 1
+
+        return None
+
+    def allocate(self, count: int = 1, near: int = None) -> int:
+        '''Allocate a run of count contiguous blocks, returning the first address.
+
+        The search starts at near (usually the parent inode) so related blocks
+        stay close together, then wraps around before growing the image.
+        '''
+        with self.fs.lock:
+            start = 0 if near is None else min(near, self.end_page)
+
+            addr = self._find_run(count, start, self.end_page)
+            if addr is None and start > 0:
+                addr = self._find_run(count, 0, min(start + count - 1, self.end_page))
+
+            if addr is None:
+                addr = self._extend(count)
+            else:
+                self._set(addr, count, True)
+
+        return addr
+
+    def free(self, addr: int, count: int = 1) -> None:
+        with self.fs.lock:
+            for cur in range(addr, addr + count):
+                if cur < 2 or cur in self.bitmap_addrs or not self.is_allocated(cur):
+                    raise ValueError(f'Block {cur} can not be freed')
+            self._set(addr, count, False)
+
+    def free_runs(self) -> 'list[tuple[int, int]]':
+        '''(first block, number of blocks) of every run of free blocks below end_page'''
+        if not self.end_page:
+            return []
+        bits = format(int.from_bytes(self.bitmap, 'big'), f'0{len(self.bitmap) * 8}b')[:self.end_page]
+        return [(match.start(), match.end() - match.start()) for match in FREE_RUN.finditer(bits)]
+
+    def free_count(self) -> int:
+        used = sum(bin(byte).count('1') for byte in self.bitmap)
+        return self.end_page - used
+
+    def sync(self) -> None:
+        with self.fs.lock:
+            while len(self.bitmap_addrs) * self.bits_per_block < self.end_page:
+                self._add_bitmap_block()
+
+            cap = self.bits_per_block // 8
+            for index in sorted(self._dirty):
+                inode = self.fs.read_inode(self.bitmap_addrs[index])
+                inode.write_data(0, self.bitmap[index*cap:(index+1)*cap])
+                inode.save()
+            self._dirty = set()
+
+            root = self.fs.root_block
+            if self._root_dirty or root.end_page != self.end_page:
+                root.end_page = self.end_page
+                root.bitmap_addr = self.bitmap_addrs[0]
+                root.save()
+                self._root_dirty = False
+
+    def __repr__(self) -> str:
+        return f"BlockAllocator end_page: {self.end_page} bitmap blocks: {self.bitmap_addrs}"
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+import logging
+from pathlib import PurePosixPath
+
+from .pyfs import PYFS
+from .inode import Inode
+from .inode_entry import InodeEntry
+
+logger = logging.getLogger("pyfs.async")
+
+class AsyncPYFS:
+    '''asyncio front-end for a PYFS.
+
+    All filesystem work runs on an executor so block I/O never blocks the event
+    loop. The default executor has a single worker, which serialises access to
+    the PYFS; pass a wider executor only for a thread safe PYFS. Concurrent
+    requests for the same inode or path share one in-flight call, and results
+    are the same cached Inode objects the sync API hands out.
+    '''
+    def __init__(self, fs: PYFS, executor: Executor = None):
+        self.fs = fs
+
+        self._own_executor = executor is None
+        self.executor = executor if executor is not None else ThreadPoolExecutor(max_workers=1, thread_name_prefix='pyfs')
+
+        self._inflight = {}
+
+    async def _call(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    async def _single_flight(self, key, func, *args):
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._call(func, *args))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            logger.debug('Joining in-flight request %s', key)
+
+        return await asyncio.shield(future)
+
+    async def read_inode(self, addr: int) -> Inode:
+        return await self._single_flight(('inode', addr), self.fs.read_inode, addr)
+
+    async def resolve(self, path) -> Inode:
+        path = PurePosixPath('/', path)
+        return await self._single_flight(('resolve', path), self.fs.resolve, path)
+
+    async def stat(self, path):
+        return await self._call(self.fs.stat, path)
+
+    async def ls(self, path='/', show_hidden=False) -> 'list[InodeEntry]':
+        inode = await self.resolve(path)
+        return await self._call(inode.ls, show_hidden=show_hidden)
+
+    async def mkdir(self, path) -> Inode:
+        path = PurePosixPath('/', path)
+        # resolved for writing, which copies any directory on the way shared with a snapshot
+        parent = await self._call(self.fs.resolve, path.parent, write=True)
+        await self._call(parent.make_dir, path.name)
+        return await self.resolve(path)
+
+    def _read(self, path, size: int, offset: int) -> bytes:
+        with self.fs.open(path, 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+
+    async def read(self, path, size: int = -1, offset: int = 0) -> bytes:
+        return await self._call(self._read, path, size, offset)
+
+    def _write(self, path, data, offset: int) -> int:
+        mode = 'wb' if offset is None else 'r+b'
+        try:
+            f = self.fs.open(path, mode)
+        except FileNotFoundError:
+            f = self.fs.open(path, 'wb')
+
+        with f:
+            if offset is not None:
+                f.seek(offset)
+            return f.write(data)
+
+    async def write(self, path, data, offset: int = None) -> int:
+        '''Replace the contents of a file, or write at offset without truncating when given'''
+        return await self._call(self._write, path, data, offset)
+
+    async def save_all(self) -> None:
+        await self._call(self.fs.save_all)
+
+    async def close(self) -> None:
+        await self.save_all()
+        if self._own_executor:
+            self.executor.shutdown(wait=True)
+
+    async def __aenter__(self) -> AsyncPYFS:
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+from collections import Counter, OrderedDict
+import logging
+import weakref
+
+from .inode import Inode
+
+logger = logging.getLogger("pyfs.cache")
+
+class BlockCache:
+    '''LRU cache of loaded Inodes with write-back eviction.
+
+    The cache is bounded by number of entries and/or total bytes of block data,
+    either limit can be None to disable it. Dirty Inodes are saved before they
+    are dropped and pinned addresses are never evicted.
+
+    Every Inode put in the cache is also kept in a weak identity map, so an
+    evicted Inode a caller still holds is handed out again instead of a
+    second object for the same block whose changes would overwrite its own.
+    '''
+    def __init__(self, max_entries: int = None, max_bytes: int = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._inodes = OrderedDict()
+        self._live = weakref.WeakValueDictionary()
+        self.pinned = Counter()
+        self.size_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, addr: int) -> Inode:
+        inode = self.live(addr)
+        if inode is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return inode
+
+    def live(self, addr: int) -> Inode:
+        '''The Inode of addr if it is cached or still referenced anywhere, without counting a hit or miss'''
+        inode = self._inodes.get(addr)
+        if inode is not None:
+            self._inodes.move_to_end(addr)
+            return inode
+
+        inode = self._live.get(addr)
+        if inode is not None:
+            self.put(inode)
+        return inode
+
+    def put(self, inode: Inode) -> Inode:
+        old = self._inodes.pop(inode.addr, None)
+        if old is not None:
+            self.size_bytes -= old.fs.block_size
+
+        self._inodes[inode.addr] = inode
+        self._live[inode.addr] = inode
+        self.size_bytes += inode.fs.block_size
+        self._evict(keep=inode.addr)
+        return inode
+
+    def discard(self, addr: int) -> None:
+        self._live.pop(addr, None)
+        inode = self._inodes.pop(addr, None)
+        if inode is not None:
+            self.size_bytes -= inode.fs.block_size
+
+    def pin(self, addr: int) -> None:
+        self.pinned[addr] += 1
+
+    def unpin(self, addr: int) -> None:
+        self.pinned[addr] -= 1
+        if self.pinned[addr] <= 0:
+            del self.pinned[addr]
+
+    def _over_limit(self) -> bool:
+        if self.max_entries is not None and len(self._inodes) > self.max_entries:
+            return True
+        if self.max_bytes is not None and self.size_bytes > self.max_bytes:
+            return True
+        return False
+
+    def _evict(self, keep: int) -> None:
+        if not self._over_limit():
+            return
+
+        for addr in list(self._inodes):
+            if not self._over_limit():
+                break
+            if addr == keep or addr in self.pinned:
+                continue
+
+            inode = self._inodes.pop(addr)
+            self.size_bytes -= inode.fs.block_size
+            self.evictions += 1
+
+            if inode.dirty:
+                inode.save()
+
+    def stats(self) -> dict:
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._inodes),
+                'bytes': self.size_bytes,
+               }
+
+    def reset_stats(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def items(self):
+        return list(self._inodes.items())
+
+    def values(self):
+        return list(self._inodes.values())
+
+    def clear(self) -> None:
+        self._inodes.clear()
+        self._live.clear()
+        self.size_bytes = 0
+
+    def __contains__(self, addr: int) -> bool:
+        return addr in self._inodes
+
+    def __getitem__(self, addr: int) -> Inode:
+        return self._inodes[addr]
+
+    def __len__(self) -> int:
+        return len(self._inodes)
+
+    def __repr__(self) -> str:
+        return f"BlockCache entries: {len(self._inodes)} bytes: {self.size_bytes} hits: {self.hits} misses: {self.misses} evictions: {self.evictions}"
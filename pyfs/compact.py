@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import logging
+import pyfs #pylint: disable=unused-import
+
+from .constants import INODE_META_SIZE
+
+logger = logging.getLogger("pyfs.compact")
+
+def _packed(blocks: 'list[pyfs.Inode]', live: int) -> bool:
+    '''Whether the live entries already fill the chain front to back and the continuation blocks are one run'''
+    used = [not entry.free for block in blocks for entry in block.children]
+    if not all(used[:live]) or any(used[live:]):
+        return False
+    addrs = [block.addr for block in blocks[1:]]
+    return addrs == list(range(addrs[0], addrs[0] + len(addrs))) if addrs else True
+
+def compact_dir(inode: 'pyfs.Inode') -> int:
+    '''Pack the live entries of a directory into the fewest blocks, returning the number of blocks freed.
+
+    The main inode stays where it is, the entry in its parent and the parent
+    pointer of every child point at it. Entries keep their order and are
+    rewritten front to back, the continuation blocks still needed are moved
+    to a run right after the main inode and relinked. Only the layout
+    changes, so a directory shared by a snapshot can be compacted in place.
+    '''
+    if not inode.is_dir:
+        raise NotADirectoryError(f'Inode {inode.addr} is not a directory')
+
+    fs = inode.fs
+    with inode.lock.write(), fs.transaction():
+        blocks = [fs.read_inode(addr) for addr in inode.index.blocks]
+        entries = [entry.data for block in blocks for entry in block.children if not entry.free]
+
+        per_block = len(inode.children)
+        needed = max(-(-len(entries) // per_block), 1)
+        if len(blocks) == needed and _packed(blocks, len(entries)):
+            return 0
+
+        old = [block.addr for block in blocks[1:]]
+        for addr in old:
+            fs.loaded_inodes.discard(addr)
+            fs.allocator.free(addr)
+
+        chain = [inode]
+        if needed > 1:
+            start = fs.allocator.allocate(needed - 1, near=inode.addr + 1)
+            chain += [fs.init_inode(start + idx) for idx in range(needed - 1)]
+
+        for idx, block in enumerate(chain):
+            if idx:
+                block.is_dir = True
+                block.parent_inode_addr = chain[idx-1].addr
+            block.next_inode_addr = chain[idx+1].addr if idx + 1 < len(chain) else 0
+
+            for slot, entry in enumerate(block.children):
+                pos = idx * per_block + slot
+                entry.data = entries[pos] if pos < len(entries) else bytes(INODE_META_SIZE)
+
+            block.dirty = True
+            block.save()
+
+        fs.allocator.sync()
+        inode.invalidate_index()
+        fs.dentries.invalidate_dir(inode.addr)
+
+    logger.info('Compacted directory %s from %s to %s blocks', inode.addr, len(blocks), needed)
+    return len(old) - (needed - 1)
+
+def compact_tree(inode: 'pyfs.Inode') -> int:
+    '''Compact a directory and every directory below it, returning the number of blocks freed'''
+    fs = inode.fs
+    freed = 0
+    queue = [inode.addr]
+    seen = set()
+    while queue:
+        addr = queue.pop()
+        # a subtree shared by clones or snapshots is reached once per entry but compacted once
+        if addr in seen:
+            continue
+        seen.add(addr)
+
+        directory = fs.read_inode(addr)
+        freed += compact_dir(directory)
+        queue += [entry.addr for entry in directory.ls(show_hidden=True) if entry.is_dir and not entry.is_inline]
+    return freed
@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import logging
+import struct
+import zlib
+import pyfs #pylint: disable=unused-import
+
+from .constants import DEFAULT_COMPRESSION_CHUNK
+from .extents import load_table, save_table
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+logger = logging.getLogger("pyfs.compression")
+
+# codec ids stored in the main inode of a compressed file
+CODEC_IDS = {'zlib': 1}
+CODECS = {1: zlib}
+if lzma is not None:
+    CODEC_IDS['lzma'] = 2
+    CODECS[2] = lzma
+
+# first block, number of blocks and stored bytes of a chunk
+CHUNK_STRUCT = struct.Struct('>III')
+# set in the stored bytes of a chunk kept uncompressed because compressing did not save a block
+RAW_CHUNK = 1 << 31
+
+def chunk_shift(block_size: int) -> int:
+    '''log2 of the number of blocks in a chunk, so chunks are DEFAULT_COMPRESSION_CHUNK or one block if bigger'''
+    return max(DEFAULT_COMPRESSION_CHUNK // block_size, 1).bit_length() - 1
+
+class CompressedMap:
+    '''Chunk table of a compressed file.
+
+    The file is cut into fixed size chunks of logical data, each compressed
+    on its own into a run of raw blocks. The table of (first block, blocks,
+    stored bytes) per chunk lives in the payload of the main inode and
+    continues in indirect blocks like an extent map. Chunk N holds offsets
+    N * chunk_size up to the next chunk, a chunk with no blocks is a hole.
+    '''
+    def __init__(self, inode: 'pyfs.Inode'):
+        self.inode = inode
+        self.fs = inode.fs
+
+        if inode.codec not in CODECS:
+            raise ValueError(f'File {inode.addr} uses unknown compression codec {inode.codec}')
+        self.codec = CODECS[inode.codec]
+        self.chunk_size = self.fs.block_size << inode.chunk_shift
+
+        self.chunks = load_table(inode, CHUNK_STRUCT)
+        self.dirty = False
+        # bumped on every change, so handles know a chunk they hold may be stale
+        self.version = 0
+
+    @staticmethod
+    def read_table(block: 'pyfs.Inode') -> 'list[tuple[int, int, int]]':
+        return list(CHUNK_STRUCT.iter_unpack(block.read_data(0, block.data_size)))
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def read(self, idx: int) -> bytes:
+        '''Logical bytes stored for chunk idx, which may be fewer than a whole chunk'''
+        if idx >= len(self.chunks):
+            return b''
+
+        start, blocks, stored = self.chunks[idx]
+        if blocks == 0:
+            return b''
+
+        data = self.fs.read_blocks(start, blocks)
+        if stored & RAW_CHUNK:
+            return data[:stored & ~RAW_CHUNK]
+        return self.codec.decompress(memoryview(data)[:stored])
+
+    def write(self, idx: int, data: bytes) -> None:
+        '''Compress data as the new content of chunk idx, moving it to a new run if it grew'''
+        block_size = self.fs.block_size
+
+        packed = self.codec.compress(data)
+        stored = len(packed)
+        if -(-stored // block_size) >= -(-len(data) // block_size):
+            packed, stored = data, len(data) | RAW_CHUNK
+        blocks = -(-len(packed) // block_size)
+
+        while len(self.chunks) <= idx:
+            self.chunks.append((0, 0, 0))
+
+        start, old_blocks, _ = self.chunks[idx]
+        if old_blocks > blocks:
+            self.fs.allocator.free(start + blocks, old_blocks - blocks)
+        elif old_blocks < blocks:
+            if old_blocks:
+                self.fs.allocator.free(start, old_blocks)
+            near = self._near(idx)
+            start = self.fs.allocator.allocate(blocks, near=near)
+
+        if blocks:
+            self.fs.write_run(start, bytes(packed).ljust(blocks * block_size, b'\0'))
+        else:
+            start = 0
+
+        self.chunks[idx] = (start, blocks, stored)
+        self.dirty = True
+        self.version += 1
+
+    def _near(self, idx: int) -> int:
+        # keep chunks in file order on disk so sequential reads stay sequential
+        for start, blocks, _ in reversed(self.chunks[:idx]):
+            if blocks:
+                return start + blocks
+        return self.inode.addr
+
+    def truncate(self, chunks: int) -> None:
+        '''Free every chunk from chunk chunks onwards'''
+        while len(self.chunks) > chunks:
+            start, blocks, _ = self.chunks.pop()
+            if blocks:
+                self.fs.allocator.free(start, blocks)
+            self.dirty = True
+            self.version += 1
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+
+        save_table(self.inode, CHUNK_STRUCT, self.chunks)
+        self.dirty = False
+
+    def __repr__(self) -> str:
+        return f"CompressedMap inode: {self.inode.addr} chunks: {len(self.chunks)} chunk size: {self.chunk_size}"
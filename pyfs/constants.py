@@ -7,13 +7,42 @@ GB = 1024 * MB
 TB = 1024 * GB
 DEFAULT_BLOCK_SIZE = 4 * KB
 
+# block sizes create_fs accepts, always a power of two
+MIN_BLOCK_SIZE = 4 * KB
+MAX_BLOCK_SIZE = 1 * MB
+
+# logical bytes compressed together in a compressed file
+DEFAULT_COMPRESSION_CHUNK = 128 * KB
+
+# number of Inodes kept in the block cache
+DEFAULT_CACHE_ENTRIES = 1024
+
+# number of path components kept in the dentry cache
+DEFAULT_DENTRY_ENTRIES = 4096
+
+# buffered blocks that trigger a flush in write back mode
+DEFAULT_WRITE_BACK_BLOCKS = 256
+
+# size of the journal region and the number of pending blocks that triggers a group commit
+DEFAULT_JOURNAL_BLOCKS = 256
+DEFAULT_JOURNAL_GROUP_BLOCKS = 128
+
 INODE_META_SIZE = 128
 
+# addresses are 4 bytes
+MAX_BLOCKS = 1 << 32
+
 BYTE_ORDER = 'big'
 
 INODE_ENTRY_FLAGS = {'is_directory' : 1 << 7,
                      'is_hidden' : 1 << 6,
+                     'is_inline' : 1 << 5,
                     }
 
 INODE_FLAGS = {'is_directory' : 1 << 15,
-               'contains_data' : 1 << 14}
+               'contains_data' : 1 << 14,
+               'is_bitmap' : 1 << 13,
+               'has_extents' : 1 << 12,
+               'is_compressed' : 1 << 11,
+               'is_deduped' : 1 << 10,
+               'is_dedup_index' : 1 << 9}
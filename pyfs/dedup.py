@@ -0,0 +1,252 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import struct
+import pyfs #pylint: disable=unused-import
+
+from .constants import INODE_META_SIZE
+from .extents import load_table, save_table
+
+logger = logging.getLogger("pyfs.dedup")
+
+# digest of the block data, addr of the block holding it
+INDEX_STRUCT = struct.Struct('>16sI')
+# addr of the shared data block of each logical block, 0 for a hole
+BLOCK_STRUCT = struct.Struct('>I')
+
+# the ref count field is 2 bytes, a block referenced this often is not shared any further
+MAX_REFS = 0xFFFF
+
+def digest(data) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+class DedupIndex:
+    '''Persistent digest -> block index of the shared data blocks of deduplicated files.
+
+    The index is a flat table of (digest, addr) slots kept in memory and
+    stored in the payload of a chain of index inodes referenced from the root
+    block, like the free space bitmap. A slot with addr 0 is free. Only the
+    index blocks with changed slots are written on sync.
+
+    Identical data is trusted to have identical digests, a 128 bit blake2b
+    collision is not a concern for data that is not adversarial.
+    '''
+    def __init__(self, fs: 'pyfs.PYFS'):
+        self.fs = fs
+        self.block_addrs = []
+        self.reset()
+
+    def reset(self) -> None:
+        self._unpin()
+        self.table = bytearray()
+        self.slots = {}
+        self.block_addrs = []
+        self._free = []
+        self._dirty = set()
+
+    @property
+    def per_block(self) -> int:
+        return (self.fs.block_size - INODE_META_SIZE) // INDEX_STRUCT.size
+
+    def _unpin(self) -> None:
+        for addr in self.block_addrs:
+            self.fs.loaded_inodes.unpin(addr)
+
+    def load(self) -> None:
+        self.reset()
+
+        addr = self.fs.root_block.dedup_addr
+        while addr != 0:
+            inode = self.fs.read_inode(addr)
+            self.fs.loaded_inodes.pin(addr)
+            self.block_addrs.append(addr)
+            self.table += inode.read_data(0, self.per_block * INDEX_STRUCT.size)
+            addr = inode.next_inode_addr
+
+        for slot, (key, addr) in enumerate(INDEX_STRUCT.iter_unpack(self.table)):
+            if addr == 0:
+                self._free.append(slot)
+            else:
+                self.slots[key] = slot
+        self._free.reverse()
+
+        if self.block_addrs:
+            logger.info('Loaded dedup index of %s blocks', len(self.slots))
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def lookup(self, key: bytes) -> int:
+        slot = self.slots.get(key)
+        if slot is None:
+            return None
+        return INDEX_STRUCT.unpack_from(self.table, slot * INDEX_STRUCT.size)[1]
+
+    def _set(self, slot: int, key: bytes, addr: int) -> None:
+        INDEX_STRUCT.pack_into(self.table, slot * INDEX_STRUCT.size, key, addr)
+        self._dirty.add(slot // self.per_block)
+
+    def add(self, key: bytes, addr: int) -> None:
+        slot = self.slots.get(key)
+        if slot is None:
+            if not self._free:
+                start = len(self.table) // INDEX_STRUCT.size
+                self.table += bytes(self.per_block * INDEX_STRUCT.size)
+                self._free = list(range(start + self.per_block - 1, start - 1, -1))
+            slot = self._free.pop()
+            self.slots[key] = slot
+        self._set(slot, key, addr)
+
+    def remove(self, key: bytes, addr: int) -> None:
+        '''Drop key if it still points at addr'''
+        if self.lookup(key) != addr:
+            return
+        slot = self.slots.pop(key)
+        self._set(slot, bytes(16), 0)
+        self._free.append(slot)
+
+    def store(self, data: bytes, near: int = None) -> int:
+        '''Return a shared data block holding data, referencing an existing one when it is already stored'''
+        key = digest(data)
+        with self.fs.lock:
+            addr = self.lookup(key)
+            if addr is not None:
+                block = self.fs.read_inode(addr)
+                if block.ref_count < MAX_REFS:
+                    block.ref_count += 1
+                    block.save()
+                    return addr
+
+            block = self.fs.create_inode(near=near)
+            block.contains_data = True
+            block.is_deduped = True
+            block.write_data(0, data)
+            block.ref_count = 1
+            block.save()
+
+            self.add(key, block.addr)
+            return block.addr
+
+    def share(self, addr: int) -> int:
+        '''Add a reference to a shared data block, returning the block to use in its place'''
+        with self.fs.lock:
+            block = self.fs.read_inode(addr)
+            if block.ref_count < MAX_REFS:
+                block.ref_count += 1
+                block.save()
+                return addr
+            # a full block is stored again, the index then points at the new one
+            return self.store(bytes(block.read_data(0, block.data_size)), near=addr)
+
+    def release(self, addr: int) -> None:
+        '''Drop one reference to a shared data block, freeing it with the last one'''
+        with self.fs.lock:
+            block = self.fs.read_inode(addr)
+            if block.ref_count > 1:
+                block.ref_count -= 1
+                block.save()
+                return
+
+            self.remove(digest(block.read_data(0, block.data_size)), addr)
+            self.fs.loaded_inodes.discard(addr)
+            self.fs.allocator.free(addr)
+
+    def _add_index_block(self) -> None:
+        inode = self.fs.create_inode(near=self.block_addrs[-1] if self.block_addrs else None)
+        self.fs.loaded_inodes.pin(inode.addr)
+        inode.contains_data = True
+        inode.is_dedup_index = True
+
+        if self.block_addrs:
+            prev = self.fs.read_inode(self.block_addrs[-1])
+            inode.parent_inode_addr = prev.addr
+            prev.next_inode_addr = inode.addr
+            prev.save()
+        else:
+            self.fs.root_block.dedup_addr = inode.addr
+            self.fs.root_block.save()
+
+        self.block_addrs.append(inode.addr)
+
+    def sync(self) -> None:
+        with self.fs.lock:
+            size = self.per_block * INDEX_STRUCT.size
+            while len(self.block_addrs) * size < len(self.table):
+                self._add_index_block()
+
+            for index in sorted(self._dirty):
+                inode = self.fs.read_inode(self.block_addrs[index])
+                inode.write_data(0, self.table[index*size:(index+1)*size])
+                inode.save()
+            self._dirty = set()
+
+    def __repr__(self) -> str:
+        return f"DedupIndex blocks: {len(self.slots)} index blocks: {self.block_addrs}"
+
+class DedupMap:
+    '''Block table of a deduplicated file.
+
+    Logical block N holds offsets N * data_capacity up to the next block and
+    is stored in a shared data block found through the dedup index, so every
+    file with the same data in a block points at the same one. Shared blocks
+    are never changed, writing a block stores its new data and releases the
+    old one. The table of block addrs is kept like an extent table.
+    '''
+    def __init__(self, inode: 'pyfs.Inode'):
+        self.inode = inode
+        self.fs = inode.fs
+        self.chunk_size = inode.data_capacity
+
+        self.blocks = [addr for addr, in load_table(inode, BLOCK_STRUCT)]
+        self.dirty = False
+        self.version = 0
+
+    @staticmethod
+    def read_table(block: 'pyfs.Inode') -> 'list[int]':
+        return [addr for addr, in BLOCK_STRUCT.iter_unpack(block.read_data(0, block.data_size))]
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+    def read(self, idx: int) -> bytes:
+        if idx >= len(self.blocks) or self.blocks[idx] == 0:
+            return b''
+        block = self.fs.read_inode(self.blocks[idx])
+        return block.read_data(0, block.data_size)
+
+    def write(self, idx: int, data: bytes) -> None:
+        while len(self.blocks) <= idx:
+            self.blocks.append(0)
+
+        # blocks of zeros are left as holes
+        addr = 0
+        if any(data):
+            near = next((a for a in reversed(self.blocks[:idx]) if a), self.inode.addr)
+            addr = self.fs.dedup.store(bytes(data), near=near)
+
+        old = self.blocks[idx]
+        self.blocks[idx] = addr
+        if old != 0:
+            self.fs.dedup.release(old)
+        self.dirty = True
+        self.version += 1
+
+    def truncate(self, blocks: int) -> None:
+        while len(self.blocks) > blocks:
+            addr = self.blocks.pop()
+            if addr != 0:
+                self.fs.dedup.release(addr)
+            self.dirty = True
+            self.version += 1
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+
+        save_table(self.inode, BLOCK_STRUCT, [(addr,) for addr in self.blocks])
+        self.fs.dedup.sync()
+        self.dirty = False
+
+    def __repr__(self) -> str:
+        return f"DedupMap inode: {self.inode.addr} blocks: {len(self.blocks)}"
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+import logging
+
+logger = logging.getLogger("pyfs.dentry")
+
+# stored for names known not to exist, address 0 is never a valid entry
+NEGATIVE = (0, False)
+# stored for files kept inline in their directory entry, they have no inode address
+INLINE = (0, None)
+
+class DentryCache:
+    '''LRU cache of (parent addr, name) -> (addr, is_dir) lookups.
+
+    Names that were looked up and not found are cached as negative entries.
+    Directories invalidate the name whenever an entry is added or removed.
+    '''
+    def __init__(self, max_entries: int = None):
+        self.max_entries = max_entries
+        self._dentries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, parent: int, name: str):
+        '''Returns (addr, is_dir), NEGATIVE or None when the name is not cached'''
+        key = (parent, name)
+        value = self._dentries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._dentries.move_to_end(key)
+        return value
+
+    def add(self, parent: int, name: str, value) -> None:
+        key = (parent, name)
+        self._dentries[key] = value
+        self._dentries.move_to_end(key)
+
+        if self.max_entries is not None and len(self._dentries) > self.max_entries:
+            self._dentries.popitem(last=False)
+
+    def invalidate(self, parent: int, name: str) -> None:
+        self._dentries.pop((parent, name), None)
+
+    def invalidate_dir(self, parent: int) -> None:
+        for key in [key for key in self._dentries if key[0] == parent]:
+            del self._dentries[key]
+
+    def clear(self) -> None:
+        self._dentries.clear()
+
+    def stats(self) -> dict:
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._dentries),
+               }
+
+    def reset_stats(self) -> None:
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._dentries)
+
+    def __repr__(self) -> str:
+        return f"DentryCache entries: {len(self._dentries)} hits: {self.hits} misses: {self.misses}"
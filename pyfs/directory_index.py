@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import heapq
+import logging
+import pyfs #pylint: disable=unused-import
+
+logger = logging.getLogger("pyfs.inode")
+
+class DirectoryIndex:
+    '''In memory name index of a directory and its continuation blocks.
+
+    Entries are located by (block addr, slot) where slot is the position of the
+    entry in the block's children. Free slots are kept in a heap ordered by
+    their position in the chain, so new entries fill the directory front to
+    back like a linear scan would.
+    '''
+    __slots__ = ('fs', 'blocks', 'positions', 'entries', '_free')
+
+    def __init__(self, fs: 'pyfs.PYFS'):
+        self.fs = fs
+        self.blocks = []
+        self.positions = {}
+        self.entries = {}
+        self._free = []
+
+    @classmethod
+    def build(cls, inode: 'pyfs.Inode') -> DirectoryIndex:
+        index = cls(inode.fs)
+
+        block = inode
+        while True:
+            index.add_block(block)
+            if block.next_inode_addr == 0:
+                break
+            block = inode.fs.read_inode(block.next_inode_addr)
+
+        logger.debug('Indexed %s entries over %s blocks for Inode %s', len(index.entries), len(index.blocks), inode.addr)
+        return index
+
+    def add_block(self, block: 'pyfs.Inode') -> None:
+        position = len(self.blocks)
+        self.blocks.append(block.addr)
+        self.positions[block.addr] = position
+
+        for slot, entry in enumerate(block.children):
+            if entry.free:
+                heapq.heappush(self._free, (position, slot))
+            else:
+                self.entries[entry.name] = (block.addr, slot)
+
+    def entry_at(self, location) -> 'pyfs.InodeEntry':
+        addr, slot = location
+        return self.fs.read_inode(addr).children[slot]
+
+    def get(self, name) -> 'pyfs.InodeEntry':
+        location = self.entries.get(name)
+        if location is None:
+            return None
+        return self.entry_at(location)
+
+    def pop_free(self):
+        if not self._free:
+            return None
+        position, slot = heapq.heappop(self._free)
+        return (self.blocks[position], slot)
+
+    def insert(self, name, location) -> None:
+        self.entries[name] = location
+
+    def remove(self, name) -> None:
+        addr, slot = self.entries.pop(name)
+        heapq.heappush(self._free, (self.positions[addr], slot))
+
+    def __len__(self) -> int:
+        return len(self.entries)
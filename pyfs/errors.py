@@ -7,3 +7,32 @@ class InodeEntryExists(InodeError):
 
 class OutOfInodeError(InodeError):
     pass
+
+class InodeEntryNotFound(InodeError):
+    pass
+
+class DirectoryNotEmpty(InodeError):
+    pass
+
+class ReadOnlyFilesystem(InodeError):
+    pass
+
+class InlineFile(InodeError):
+    '''The path names a file stored inline in its directory entry, which has no inode of its own'''
+    def __init__(self, parent: int, name: str):
+        super().__init__(f'{name} in directory {parent} is stored inline')
+        self.parent = parent
+        self.name = name
+
+class SharedInode(InodeError):
+    '''The inode is shared by a clone or snapshot and is only changed through a private copy'''
+    def __init__(self, addr: int):
+        super().__init__(f'Inode {addr} is shared, resolve its path for writing to get a private copy')
+        self.addr = addr
+
+class TransactionTooLarge(InodeError):
+    '''A transaction changes more blocks than one journal commit can list'''
+    def __init__(self, blocks: int, limit: int):
+        super().__init__(f'Transaction of {blocks} blocks is larger than the journal limit of {limit} blocks')
+        self.blocks = blocks
+        self.limit = limit
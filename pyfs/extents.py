@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+from bisect import bisect_right
+import logging
+import struct
+import pyfs #pylint: disable=unused-import
+
+logger = logging.getLogger("pyfs.extents")
+
+# first block and number of blocks of a run
+EXTENT_STRUCT = struct.Struct('>II')
+
+def load_table(inode: 'pyfs.Inode', table_struct: struct.Struct) -> list:
+    '''Read the table of a file's main inode and every indirect block chained from it'''
+    table = []
+    block = inode
+    while True:
+        table += table_struct.iter_unpack(block.read_data(0, block.data_size))
+        if block.next_inode_addr == 0:
+            return table
+        block = inode.fs.read_inode(block.next_inode_addr)
+
+def save_table(inode: 'pyfs.Inode', table_struct: struct.Struct, table: list) -> None:
+    '''Store table in the main inode, adding indirect blocks as needed and freeing any left over'''
+    fs = inode.fs
+    per_block = inode.data_capacity // table_struct.size
+    tables = [table[idx:idx+per_block] for idx in range(0, len(table), per_block)] or [[]]
+
+    block = inode
+    for idx, part in enumerate(tables):
+        if idx:
+            if block.next_inode_addr == 0:
+                logger.debug('File %s adding indirect table block', inode.addr)
+                tmp = fs.create_inode(near=block.addr)
+                tmp.flags = inode.flags
+                tmp.parent_inode_addr = block.addr
+                block.next_inode_addr = tmp.addr
+                block.save()
+            block = fs.read_inode(block.next_inode_addr)
+
+        data = b''.join(table_struct.pack(*entry) for entry in part)
+        block.write_data(0, data)
+        block.data_size = len(data)
+        block.save()
+
+    # indirect blocks no longer needed, the blocks they listed were already freed
+    addr = block.next_inode_addr
+    if addr != 0:
+        block.next_inode_addr = 0
+        block.save()
+    while addr != 0:
+        next_addr = fs.read_inode(addr).next_inode_addr
+        fs.loaded_inodes.discard(addr)
+        fs.allocator.free(addr)
+        addr = next_addr
+
+    fs.allocator.sync()
+
+class ExtentMap:
+    '''Logical to physical block map of an extent based file.
+
+    The table of (start block, length) runs lives in the payload of the
+    file's main inode and continues in indirect extent blocks linked through
+    next_inode_addr. Data blocks hold nothing but file data, so logical block
+    N is found with a binary search over the run ends and a run of blocks can
+    be read or written with a single I/O.
+    '''
+    def __init__(self, inode: 'pyfs.Inode'):
+        self.inode = inode
+        self.fs = inode.fs
+
+        self.extents = []
+        self.ends = []
+        self.dirty = False
+
+        for start, length in load_table(inode, EXTENT_STRUCT):
+            self.extents.append((start, length))
+            self.ends.append(len(self) + length)
+
+    @staticmethod
+    def read_table(block: 'pyfs.Inode') -> 'list[tuple[int, int]]':
+        return list(EXTENT_STRUCT.iter_unpack(block.read_data(0, block.data_size)))
+
+    def __len__(self) -> int:
+        return self.ends[-1] if self.ends else 0
+
+    def lookup(self, logical: int) -> 'tuple[int, int]':
+        '''Return the physical block of logical block and how many blocks of the run follow it, including itself'''
+        idx = bisect_right(self.ends, logical)
+        if idx == len(self.ends):
+            raise EOFError(f'File {self.inode.addr} has no block {logical}')
+
+        offset = logical - (self.ends[idx-1] if idx else 0)
+        start, length = self.extents[idx]
+        return start + offset, length - offset
+
+    def grow(self, count: int) -> None:
+        '''Add count blocks to the end of the file, extending the last run when the allocator allows'''
+        near = sum(self.extents[-1]) if self.extents else self.inode.addr
+        addr = self.fs.allocator.allocate(count, near=near)
+
+        if self.extents and addr == near:
+            start, length = self.extents[-1]
+            self.extents[-1] = (start, length + count)
+            self.ends[-1] += count
+        else:
+            self.extents.append((addr, count))
+            self.ends.append(len(self) + count)
+
+        self.dirty = True
+
+    def truncate(self, blocks: int) -> None:
+        '''Free every block from logical block blocks onwards'''
+        while len(self) > blocks:
+            start, length = self.extents[-1]
+            keep = max(blocks - (self.ends[-1] - length), 0)
+            self.fs.allocator.free(start + keep, length - keep)
+
+            if keep:
+                self.extents[-1] = (start, keep)
+                self.ends[-1] -= length - keep
+            else:
+                self.extents.pop()
+                self.ends.pop()
+
+            self.dirty = True
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+
+        save_table(self.inode, EXTENT_STRUCT, self.extents)
+        self.dirty = False
+
+    def __repr__(self) -> str:
+        return f"ExtentMap inode: {self.inode.addr} extents: {len(self.extents)} blocks: {len(self)}"
@@ -0,0 +1,505 @@
+from __future__ import annotations
+
+import io
+import logging
+import pyfs #pylint: disable=unused-import
+
+from .inode import Inode
+
+logger = logging.getLogger("pyfs.file")
+
+class PYFSFile(io.RawIOBase): #pylint: disable=too-many-instance-attributes
+    '''File-like access to a file stored as a chain of data inodes.
+
+    The file's main inode holds the first chunk of data and every following
+    data inode is linked through next_inode_addr. All blocks but the last are
+    kept full, so offset X always lives in block X // data_capacity.
+
+    Files with an extent map instead keep their data in raw blocks listed by
+    the map, so offset X is in logical block X // block_size.
+
+    Compressed files keep offset X in chunk X // chunk_size. The chunk being
+    worked on is held decompressed and only compressed again when the file
+    moves on to another chunk or is flushed. Deduplicated files work the same
+    way with chunks of one shared data block.
+
+    A file shared by a clone or snapshot can not be written, it has to be
+    opened through PYFS.open, which writes to a private copy.
+
+    Inline files have no inode, they are opened with inode None and the
+    directory and name of their entry. Their data is rewritten in the entry
+    as a whole and moved to a new inode once it no longer fits.
+    '''
+    MODES = ('rb', 'wb', 'ab', 'r+b')
+
+    def __init__(self, inode: Inode, mode: str = 'rb', parent: Inode = None, name: str = None):
+        super().__init__()
+        if inode is None and (parent is None or name is None):
+            raise ValueError('An inline file needs the directory and name of its entry')
+        if inode is not None and inode.is_dir:
+            raise IsADirectoryError(f'Inode {inode.addr} is a directory')
+        if mode not in self.MODES:
+            raise ValueError(f'Invalid mode: {mode}')
+
+        self.inode = None
+        self.fs = parent.fs if inode is None else inode.fs
+        self.mode = mode
+        self.parent = parent
+        self.name = name
+
+        self._pos = 0
+        self.extents = None
+        self.chunks = None
+        if inode is not None:
+            self._attach(inode)
+
+        if mode == 'wb':
+            self.truncate(0)
+        elif mode == 'ab':
+            self._pos = self.size
+
+    def _attach(self, inode: Inode) -> None:
+        self.inode = inode
+        self._block = inode
+        self._block_index = 0
+
+        self.extents = inode.block_map if inode.has_extents else None
+        self.chunks = inode.block_map if inode.is_compressed or inode.is_deduped else None
+        if self.chunks is not None:
+            self._chunk = self.chunks.chunk_size
+        else:
+            self._chunk = self.fs.block_size if self.extents is not None else inode.data_capacity
+
+        # decompressed chunk of a compressed file
+        self._chunk_index = None
+        self._chunk_data = None
+        self._chunk_dirty = False
+        self._chunk_version = None
+
+        # keep the main inode in the cache so it is not re-read while open
+        with self.fs.lock:
+            self.fs.loaded_inodes.pin(inode.addr)
+
+    def _inline_entry(self):
+        '''Entry of an inline file, or None once the file was moved to an inode of its own'''
+        if self.inode is not None:
+            return None
+
+        entry = self.parent.find_entry(self.name)
+        if entry is None:
+            raise FileNotFoundError(f'{self.name} was removed from directory {self.parent.addr}')
+        if entry.is_inline:
+            return entry
+
+        # promoted through another handle
+        self._attach(self.fs.read_inode(entry.addr))
+        return None
+
+    @property
+    def size(self) -> int:
+        entry = self._inline_entry()
+        if entry is not None:
+            return len(entry.inline_data)
+        return self.inode.file_size
+
+    def readable(self) -> bool:
+        return self.mode in ('rb', 'r+b')
+
+    def writable(self) -> bool:
+        return self.mode in ('wb', 'ab', 'r+b')
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError(f'Invalid whence: {whence}')
+
+        if pos < 0:
+            raise ValueError(f'Negative seek position {pos}')
+
+        self._pos = pos
+        return self._pos
+
+    def _leave_block(self):
+        if self._block.dirty and self._block is not self.inode:
+            self._block.save()
+
+    def _seek_block(self, index: int, create: bool = False) -> Inode:
+        if index == self._block_index:
+            return self._block
+
+        self._leave_block()
+
+        if index < self._block_index:
+            self._block = self.inode
+            self._block_index = 0
+
+        while self._block_index < index:
+            block = self._block
+            if block.next_inode_addr == 0:
+                if not create:
+                    raise EOFError(f'File {self.inode.addr} has no block {index}')
+
+                tmp = self.fs.create_inode(near=block.addr)
+                tmp.contains_data = True
+                tmp.parent_inode_addr = block.addr
+                block.next_inode_addr = tmp.addr
+                block.save()
+
+            self._block = self.fs.read_inode(block.next_inode_addr)
+            self._block_index += 1
+
+        return self._block
+
+    def readinto(self, buffer) -> int:
+        if not self.readable():
+            raise io.UnsupportedOperation('File not open for reading')
+
+        if self.inode is None:
+            with self.parent.lock.read():
+                entry = self._inline_entry()
+                if entry is not None:
+                    data = entry.inline_data[self._pos:self._pos+len(buffer)]
+                    memoryview(buffer).cast('B')[:len(data)] = data
+                    self._pos += len(data)
+                    return len(data)
+
+        if self._chunk_dirty:
+            # a chunk changed through this file is stored before anything is read under the read lock
+            self.flush()
+
+        with self.inode.lock.read():
+            view = memoryview(buffer).cast('B')
+            count = min(len(view), max(self.size - self._pos, 0))
+            if self.extents is not None:
+                return self._readinto_extents(view, count)
+            if self.chunks is not None:
+                return self._readinto_chunks(view, count)
+
+            capacity = self.inode.data_capacity
+
+            done = 0
+            while done < count:
+                index, offset = divmod(self._pos, capacity)
+                chunk = min(count - done, capacity - offset)
+                view[done:done+chunk] = self._seek_block(index).read_data(offset, chunk)
+
+                done += chunk
+                self._pos += chunk
+
+            return done
+
+    def _readinto_extents(self, view, count: int) -> int:
+        block_size = self.fs.block_size
+
+        done = 0
+        while done < count:
+            logical, offset = divmod(self._pos, block_size)
+            physical, run = self.extents.lookup(logical)
+
+            # the rest of the request that lies in this run is read in one go
+            blocks = min(run, -(-(offset + count - done) // block_size))
+            chunk = min(count - done, blocks * block_size - offset)
+            view[done:done+chunk] = memoryview(self.fs.read_blocks(physical, blocks))[offset:offset+chunk]
+
+            done += chunk
+            self._pos += chunk
+
+        return done
+
+    def _load_chunk(self, index: int) -> bytearray:
+        # the map is shared, a clean chunk is read again once another handle changed the file
+        if index != self._chunk_index or (not self._chunk_dirty and self._chunk_version != self.chunks.version):
+            self._store_chunk()
+            self._chunk_data = bytearray(self.chunks.read(index))
+            self._chunk_index = index
+            self._chunk_version = self.chunks.version
+        return self._chunk_data
+
+    def _store_chunk(self) -> None:
+        if self._chunk_dirty:
+            self.chunks.write(self._chunk_index, self._chunk_data)
+            self._chunk_dirty = False
+            self._chunk_version = self.chunks.version
+
+    def _readinto_chunks(self, view, count: int) -> int:
+        chunk_size = self.chunks.chunk_size
+
+        done = 0
+        while done < count:
+            index, offset = divmod(self._pos, chunk_size)
+            chunk = min(count - done, chunk_size - offset)
+            data = self._load_chunk(index)
+
+            # a hole or the unwritten tail of a chunk reads as zeros
+            have = max(min(len(data) - offset, chunk), 0)
+            view[done:done+have] = memoryview(data)[offset:offset+have]
+            view[done+have:done+chunk] = bytes(chunk - have)
+
+            done += chunk
+            self._pos += chunk
+
+        return done
+
+    def write(self, data) -> int:
+        if not self.writable():
+            raise io.UnsupportedOperation('File not open for writing')
+
+        if self.inode is None:
+            with self.parent.lock.write():
+                entry = self._inline_entry()
+                if entry is not None:
+                    content = bytearray(entry.inline_data)
+                    if self.mode == 'ab':
+                        self._pos = len(content)
+
+                    view = memoryview(data).cast('B')
+                    content[len(content):self._pos] = bytes(max(self._pos - len(content), 0))
+                    content[self._pos:self._pos+len(view)] = view
+                    self._set_inline(entry, content)
+                    self._pos += len(view)
+                    return len(view)
+
+        with self.inode.lock.write():
+            self.inode.check_private()
+            if self.mode == 'ab':
+                self._pos = self.size
+
+            if self._pos > self.size:
+                end = self._pos
+                self._fill_to(end)
+                self._pos = end
+
+            return self._write_all(memoryview(data).cast('B'))
+
+    def _write_all(self, view) -> int:
+        if not self.fs.journal.active:
+            with self.fs.transaction():
+                return self._write(view)
+
+        # each piece is committed with the metadata it changed, so no single write outgrows the journal
+        step = self._transaction_bytes()
+        done = 0
+        while done < len(view):
+            with self.fs.transaction():
+                done += self._write(view[done:done+step])
+                self._save()
+        return done
+
+    def _transaction_bytes(self) -> int:
+        # half of a commit is left for the allocator, block table and inode blocks that go with the data
+        blocks = max(self.fs.journal.capacity // 2, 1)
+        return max(blocks * self.fs.block_size // self._chunk, 1) * self._chunk
+
+    def _set_inline(self, entry, content: bytes) -> None:
+        if len(content) <= entry.inline_capacity:
+            self.parent.write_inline(self.name, bytes(content))
+            return
+
+        logger.debug('Moving inline file %s of directory %s to an inode', self.name, self.parent.addr)
+        pos = self._pos
+        self._attach(self.parent.promote_inline(self.name))
+        with self.inode.lock.write():
+            self._pos = 0
+            self._write_all(memoryview(content).cast('B'))
+        self._pos = pos
+
+    def _fill_to(self, end: int):
+        # fill the hole with zeros so every block before the last one stays full
+        self._pos = self.size
+        while self._pos < end:
+            with self.fs.transaction():
+                self._write(bytes(min(end - self._pos, self._chunk)))
+
+    def _write(self, data) -> int:
+        view = memoryview(data).cast('B')
+        if self.extents is not None:
+            return self._write_extents(view)
+        if self.chunks is not None:
+            return self._write_chunks(view)
+
+        capacity = self.inode.data_capacity
+
+        done = 0
+        while done < len(view):
+            index, offset = divmod(self._pos, capacity)
+            chunk = min(len(view) - done, capacity - offset)
+            self._seek_block(index, create=True).write_data(offset, view[done:done+chunk])
+
+            done += chunk
+            self._pos += chunk
+
+        if self._pos > self.size:
+            self.inode.file_size = self._pos
+
+        return done
+
+    def _block_base(self, logical: int, physical: int) -> bytes:
+        # a partly written block keeps its bytes below the file size, anything
+        # past it may be left over from a truncate or an earlier owner
+        block_size = self.fs.block_size
+        valid = min(max(self.size - logical * block_size, 0), block_size)
+        if valid == 0:
+            return bytes(block_size)
+        return bytes(self.fs.read_block(physical)[:valid]) + bytes(block_size - valid)
+
+    def _write_extents(self, view) -> int:
+        block_size = self.fs.block_size
+
+        needed = -(-(self._pos + len(view)) // block_size)
+        if needed > len(self.extents):
+            self.extents.grow(needed - len(self.extents))
+
+        done = 0
+        while done < len(view):
+            logical, offset = divmod(self._pos, block_size)
+            physical, run = self.extents.lookup(logical)
+
+            blocks = min(run, -(-(offset + len(view) - done) // block_size))
+            chunk = min(len(view) - done, blocks * block_size - offset)
+            end = offset + chunk
+
+            if offset == 0 and end % block_size == 0:
+                self.fs.write_run(physical, view[done:done+chunk])
+            else:
+                buffer = bytearray(blocks * block_size)
+                if offset:
+                    buffer[:block_size] = self._block_base(logical, physical)
+                if end % block_size and (blocks > 1 or offset == 0):
+                    buffer[-block_size:] = self._block_base(logical + blocks - 1, physical + blocks - 1)
+                buffer[offset:end] = view[done:done+chunk]
+                self.fs.write_run(physical, buffer)
+
+            done += chunk
+            self._pos += chunk
+
+        if self._pos > self.size:
+            self.inode.file_size = self._pos
+        self.extents.save()
+
+        return done
+
+    def _write_chunks(self, view) -> int:
+        chunk_size = self.chunks.chunk_size
+
+        done = 0
+        while done < len(view):
+            index, offset = divmod(self._pos, chunk_size)
+            chunk = min(len(view) - done, chunk_size - offset)
+            data = self._load_chunk(index)
+
+            if len(data) < offset:
+                data.extend(bytes(offset - len(data)))
+            data[offset:offset+chunk] = view[done:done+chunk]
+            self._chunk_dirty = True
+
+            done += chunk
+            self._pos += chunk
+
+        if self._pos > self.size:
+            self.inode.file_size = self._pos
+
+        return done
+
+    def truncate(self, size: int = None) -> int:
+        if not self.writable():
+            raise io.UnsupportedOperation('File not open for writing')
+
+        if self.inode is None:
+            with self.parent.lock.write():
+                entry = self._inline_entry()
+                if entry is not None:
+                    size = self._pos if size is None else size
+                    content = entry.inline_data[:size]
+                    self._set_inline(entry, content + bytes(size - len(content)))
+                    return size
+
+        with self.inode.lock.write():
+            self.inode.check_private()
+            return self._truncate(size)
+
+    def _truncate(self, size: int = None) -> int:
+        if size is None:
+            size = self._pos
+        if size > self.size:
+            pos = self._pos
+            self._fill_to(size)
+            self._pos = pos
+            return size
+
+        if self.extents is not None:
+            self.extents.truncate(-(-size // self.fs.block_size))
+            self.extents.save()
+            self.inode.file_size = size
+            return size
+
+        if self.chunks is not None:
+            chunk_size = self.chunks.chunk_size
+            keep = -(-size // chunk_size)
+            if self._chunk_index is not None and self._chunk_index >= keep:
+                self._chunk_index = None
+                self._chunk_dirty = False
+            self.chunks.truncate(keep)
+            if size % chunk_size:
+                del self._load_chunk(keep - 1)[size % chunk_size:]
+                self._chunk_dirty = True
+            self.chunks.save()
+            self.inode.file_size = size
+            return size
+
+        capacity = self.inode.data_capacity
+        index = max(size - 1, 0) // capacity
+        block = self._seek_block(index)
+        block.data_size = size - index * capacity
+        if block.next_inode_addr != 0:
+            self.fs.free_inode_chain(block.next_inode_addr)
+            block.next_inode_addr = 0
+
+        self.inode.contains_data = True
+        self.inode.file_size = size
+        return size
+
+    def flush(self):
+        if self.closed:
+            return
+        if self.inode is None:
+            # inline data is written straight to the directory entry
+            super().flush()
+            return
+        with self.inode.lock.write(), self.fs.transaction():
+            self._save()
+        super().flush()
+
+    def _save(self) -> None:
+        '''Write the blocks changed through this file that are still only held in memory'''
+        if self.chunks is not None:
+            self._store_chunk()
+            self.chunks.save()
+        self._leave_block()
+        if self.inode.dirty:
+            self.inode.save()
+
+    def close(self):
+        if not self.closed:
+            try:
+                self.flush()
+            finally:
+                if self.inode is not None:
+                    with self.fs.lock:
+                        self.fs.loaded_inodes.unpin(self.inode.addr)
+        super().close()
+
+    def __repr__(self) -> str:
+        if self.inode is None:
+            return f"PYFSFile inline: {self.name} in {self.parent.addr} mode: {self.mode} pos: {self._pos}"
+        return f"PYFSFile inode: {self.inode.addr} mode: {self.mode} pos: {self._pos}"
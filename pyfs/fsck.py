@@ -0,0 +1,361 @@
+from __future__ import annotations
+
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import os
+import struct
+from typing import NamedTuple
+
+from .constants import INODE_META_SIZE, INODE_ENTRY_FLAGS, INODE_FLAGS
+from .extents import EXTENT_STRUCT
+from .compression import CHUNK_STRUCT
+from .dedup import BLOCK_STRUCT, INDEX_STRUCT
+from .inode_entry import HEADER_STRUCT as ENTRY_STRUCT, NAME_OFFSET, NAME_SIZE
+from .root_node import decode_block_size
+
+logger = logging.getLogger("pyfs.fsck")
+
+# flags, parent, next, ref count, data size, file size, data size high half
+INODE_HEADER = struct.Struct('>HIIHHQH')
+# block size, end page, bitmap, journal start, journal blocks, dedup index
+ROOT_HEADER = struct.Struct('>H2xIIIII')
+
+DEFAULT_CHUNK_BLOCKS = 1024
+
+class BlockRecord(NamedTuple):
+    flags: int
+    parent: int
+    next: int
+    ref_count: int
+    data_size: int
+    file_size: int
+    payload: object
+
+    @property
+    def is_dir(self) -> bool:
+        return bool(self.flags & INODE_FLAGS['is_directory'])
+
+    @property
+    def contains_data(self) -> bool:
+        return bool(self.flags & INODE_FLAGS['contains_data'])
+
+    @property
+    def is_bitmap(self) -> bool:
+        return bool(self.flags & INODE_FLAGS['is_bitmap'])
+
+    @property
+    def has_extents(self) -> bool:
+        return bool(self.flags & INODE_FLAGS['has_extents'])
+
+    @property
+    def is_compressed(self) -> bool:
+        return bool(self.flags & INODE_FLAGS['is_compressed'])
+
+    @property
+    def is_deduped(self) -> bool:
+        return bool(self.flags & INODE_FLAGS['is_deduped'])
+
+    @property
+    def is_dedup_index(self) -> bool:
+        return bool(self.flags & INODE_FLAGS['is_dedup_index'])
+
+class FsckReport(NamedTuple):
+    blocks: int
+    directories: int
+    files: int
+    errors: list
+    orphans: list
+    cross_links: list
+    cycles: list
+
+    @property
+    def clean(self) -> bool:
+        return not (self.errors or self.orphans or self.cross_links or self.cycles)
+
+def _parse_block(block: memoryview, block_size: int) -> BlockRecord:
+    flags, parent, next_addr, ref_count, size, file_size, size_high = INODE_HEADER.unpack_from(block, 0)
+    size |= size_high << 16
+
+    payload = None
+    if flags & INODE_FLAGS['is_directory']:
+        payload = []
+        for offset in range(INODE_META_SIZE, block_size, INODE_META_SIZE):
+            entry_flags, _, addr = ENTRY_STRUCT.unpack_from(block, offset)
+            if addr != 0 or entry_flags & INODE_ENTRY_FLAGS['is_inline']:
+                # an inline entry keeps its data after the name and points nowhere
+                name = bytes(block[offset+NAME_OFFSET:offset+NAME_OFFSET+NAME_SIZE]).split(b'\0', 1)[0]
+                payload.append((name.decode('utf-8', 'replace'), addr, bool(entry_flags & INODE_ENTRY_FLAGS['is_directory'])))
+    elif flags & INODE_FLAGS['has_extents']:
+        size = min(size, block_size - INODE_META_SIZE)
+        payload = list(EXTENT_STRUCT.iter_unpack(block[INODE_META_SIZE:INODE_META_SIZE + size - size % EXTENT_STRUCT.size]))
+    elif flags & INODE_FLAGS['is_compressed']:
+        # only where each chunk is stored matters here, not its size
+        size = min(size, block_size - INODE_META_SIZE)
+        table = block[INODE_META_SIZE:INODE_META_SIZE + size - size % CHUNK_STRUCT.size]
+        payload = [(start, blocks) for start, blocks, _ in CHUNK_STRUCT.iter_unpack(table)]
+    elif flags & INODE_FLAGS['is_deduped']:
+        # block tables of deduplicated files, a shared data block is only read as one when a file points at it
+        size = min(size, block_size - INODE_META_SIZE)
+        payload = [addr for addr, in BLOCK_STRUCT.iter_unpack(block[INODE_META_SIZE:INODE_META_SIZE + size - size % BLOCK_STRUCT.size])]
+    elif flags & INODE_FLAGS['is_dedup_index']:
+        size = min(size, block_size - INODE_META_SIZE)
+        payload = [addr for _, addr in INDEX_STRUCT.iter_unpack(block[INODE_META_SIZE:INODE_META_SIZE + size - size % INDEX_STRUCT.size]) if addr]
+    elif flags & INODE_FLAGS['is_bitmap']:
+        payload = bytes(block[INODE_META_SIZE:INODE_META_SIZE + size])
+
+    return BlockRecord(flags, parent, next_addr, ref_count, size, file_size, payload)
+
+def scan_range(path: str, block_size: int, start: int, end: int, chunk_blocks: int = DEFAULT_CHUNK_BLOCKS) -> dict:
+    '''Read blocks start to end in large sequential chunks and parse the header of every one that has one'''
+    records = {}
+    with open(path, 'rb') as f:
+        f.seek(start * block_size)
+        addr = start
+        while addr < end:
+            data = memoryview(f.read(min(chunk_blocks, end - addr) * block_size))
+            if not data:
+                break
+
+            for offset in range(0, len(data) - block_size + 1, block_size):
+                block = data[offset:offset+block_size]
+                # blocks with an empty header are free or raw data, nothing points through them
+                if any(block[:INODE_HEADER.size]):
+                    records[addr] = _parse_block(block, block_size)
+                addr += 1
+
+    return records
+
+class _Checker:
+    def __init__(self, records: dict, end_page: int):
+        self.records = records
+        self.end_page = end_page
+
+        self.owner = {}
+        self.refs = Counter()
+        self.shared = Counter()
+        self.errors = []
+        self.cross_links = []
+        self.cycles = []
+        self.directories = 0
+        self.files = 0
+
+    def claim(self, addr: int, what: str) -> bool:
+        if not 0 <= addr < self.end_page:
+            self.errors.append(f'{what} points outside the image at block {addr}')
+            return False
+        if addr in self.owner:
+            self.cross_links.append((addr, self.owner[addr], what))
+            return False
+
+        self.owner[addr] = what
+        return True
+
+    def claim_run(self, start: int, count: int, what: str) -> None:
+        for addr in range(start, start + count):
+            self.claim(addr, what)
+
+    def record(self, addr: int) -> BlockRecord:
+        return self.records.get(addr) or BlockRecord(0, 0, 0, 0, 0, 0, None)
+
+    def chain(self, addr: int, what: str) -> 'list[tuple[int, BlockRecord]]':
+        '''Claim and return every block linked from addr through next, stopping at cycles and cross links'''
+        blocks = []
+        seen = set()
+        prev = None
+        while addr != 0:
+            if addr in seen:
+                self.cycles.append((what, addr))
+                break
+            seen.add(addr)
+            if not self.claim(addr, what):
+                break
+
+            record = self.record(addr)
+            if prev is not None and record.parent != prev:
+                self.errors.append(f'{what} block {addr} has parent {record.parent}, expected {prev}')
+
+            blocks.append((addr, record))
+            prev = addr
+            addr = record.next
+
+        return blocks
+
+    def check_parent(self, record: BlockRecord, parent: int, what: str) -> None:
+        # a shared inode has several parents and one left by its other references has parent 0
+        if record.parent != parent and record.ref_count <= 1 and record.parent != 0:
+            self.errors.append(f'{what} has parent {record.parent}, expected {parent}')
+
+    def check_dir(self, addr: int, parent: int, path: str) -> 'list[tuple]':
+        self.directories += 1
+        record = self.record(addr)
+        self.check_parent(record, parent, f'Directory {path}')
+
+        children = []
+        for block_addr, block in self.chain(addr, path):
+            if not block.is_dir:
+                self.errors.append(f'Directory {path} block {block_addr} is not a directory block')
+                continue
+            for name, child, is_dir in block.payload:
+                children.append((f'{path.rstrip("/")}/{name}', child, is_dir))
+        return children
+
+    def check_file(self, addr: int, parent: int, path: str) -> None:
+        self.files += 1
+        record = self.record(addr)
+        self.check_parent(record, parent, f'File {path}')
+
+        blocks = self.chain(addr, path)
+        if record.has_extents or record.is_compressed:
+            self.check_runs(record, blocks, path)
+        elif record.is_deduped:
+            self.check_dedup_table(blocks, path)
+        else:
+            for block_addr, block in blocks[1:]:
+                if not block.contains_data or block.is_dir:
+                    self.errors.append(f'File {path} block {block_addr} is not a data block')
+
+    def check_runs(self, record: BlockRecord, blocks: 'list[tuple[int, BlockRecord]]', path: str) -> None:
+        '''Claim the data runs listed in the block table of an extent or compressed file'''
+        for block_addr, block in blocks:
+            if (block.has_extents, block.is_compressed) != (record.has_extents, record.is_compressed):
+                self.errors.append(f'File {path} block {block_addr} is not a block table of its kind')
+                continue
+            for start, length in block.payload:
+                self.claim_run(start, length, path)
+
+    def check_dedup_table(self, blocks: 'list[tuple[int, BlockRecord]]', path: str) -> None:
+        '''Count the references to the data blocks listed in the block table of a deduplicated file'''
+        for block_addr, block in blocks:
+            if not block.is_deduped:
+                self.errors.append(f'File {path} block {block_addr} is not a dedup block table')
+                continue
+            for data_addr in block.payload:
+                if data_addr == 0:
+                    continue
+                # shared data blocks belong to the first file found using them
+                self.shared[data_addr] += 1
+                if self.shared[data_addr] == 1:
+                    self.claim(data_addr, path)
+
+    def check_entry(self, path: str, addr: int, is_dir: bool, parent: int) -> bool:
+        '''Check the inode a directory entry points at, returning whether it is a directory still to be walked'''
+        if addr == 0 and not is_dir:
+            self.files += 1
+            return False
+        if not 2 <= addr < self.end_page:
+            self.errors.append(f'Entry {path} points outside the image at block {addr}')
+            return False
+
+        self.refs[addr] += 1
+        if self.refs[addr] > 1:
+            # the inode of a clone or snapshot is checked once, through its first entry
+            if self.refs[addr] > self.record(addr).ref_count:
+                self.cross_links.append((addr, self.owner.get(addr), path))
+            return False
+
+        record = self.record(addr)
+        if record.is_dir != is_dir:
+            self.errors.append(f'Entry {path} directory flag does not match inode {addr}')
+        if not record.is_dir:
+            self.check_file(addr, parent, path)
+        return record.is_dir
+
+    def walk(self) -> None:
+        queue = [('/', 1, 0)]
+        self.refs[1] = 1
+        while queue:
+            path, addr, parent = queue.pop()
+            for child_path, child, is_dir in self.check_dir(addr, parent, path):
+                if self.check_entry(child_path, child, is_dir, addr):
+                    queue.append((child_path, child, addr))
+
+        self.check_ref_counts()
+
+    def check_ref_counts(self) -> None:
+        for addr, count in self.refs.items():
+            ref_count = self.record(addr).ref_count
+            # a ref count of 0 is an inode written before ref counts were kept
+            if ref_count not in (0, count):
+                self.errors.append(f'Inode {addr} has ref count {ref_count} but {count} references')
+
+        for addr, count in self.shared.items():
+            record = self.record(addr)
+            if not record.is_deduped:
+                self.errors.append(f'Shared data block {addr} is not a dedup block')
+            elif record.ref_count != count:
+                self.errors.append(f'Shared data block {addr} has ref count {record.ref_count} but {count} references')
+
+    def read_bitmap(self, bitmap_addr: int) -> bytearray:
+        bitmap = bytearray()
+        for _, block in self.chain(bitmap_addr, 'free space bitmap'):
+            if not block.is_bitmap:
+                self.errors.append('Free space bitmap chain contains a block that is not a bitmap block')
+                continue
+            bitmap += block.payload
+        return bitmap
+
+    def check_dedup_index(self, dedup_addr: int) -> None:
+        for _, block in self.chain(dedup_addr, 'dedup index'):
+            if not block.is_dedup_index:
+                self.errors.append('Dedup index chain contains a block that is not an index block')
+                continue
+            for addr in block.payload:
+                if addr not in self.shared:
+                    self.errors.append(f'Dedup index points at block {addr} that no file uses')
+
+    def check_bitmap(self, bitmap: bytearray) -> list:
+        '''Compare the free space bitmap with the blocks found in use, returning the orphaned blocks'''
+        orphans = []
+        bitmap = bitmap.ljust((self.end_page + 7) // 8, b'\0')
+        for addr in range(self.end_page):
+            used = bitmap[addr >> 3] >> (7 - (addr & 7)) & 1
+            if used and addr not in self.owner:
+                orphans.append(addr)
+            elif not used and addr in self.owner:
+                self.errors.append(f'Block {addr} used by {self.owner[addr]} is marked free')
+        return orphans
+
+def _scan(path: str, block_size: int, end_page: int, workers: int, chunk_blocks: int) -> dict:
+    '''Split the image into one range per worker, scan them and merge the block records'''
+    step = max(-(-end_page // workers), 1)
+    ranges = [(start, min(start + step, end_page)) for start in range(0, end_page, step)]
+    logger.info('Checking %s blocks of %s in %s ranges', end_page, path, len(ranges))
+
+    records = {}
+    if workers == 1:
+        for start, end in ranges:
+            records.update(scan_range(path, block_size, start, end, chunk_blocks))
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(scan_range, path, block_size, start, end, chunk_blocks) for start, end in ranges]
+            for future in futures:
+                records.update(future.result())
+    return records
+
+def fsck(path: str, workers: int = None, chunk_blocks: int = DEFAULT_CHUNK_BLOCKS) -> FsckReport:
+    '''Check an image that is not mounted, scanning it across a pool of worker processes'''
+    with open(path, 'rb') as f:
+        root = f.read(ROOT_HEADER.size)
+        device_size = os.fstat(f.fileno()).st_size
+
+    block_size, end_page, bitmap_addr, journal_addr, journal_blocks, dedup_addr = ROOT_HEADER.unpack(root)
+    block_size = decode_block_size(block_size)
+    if block_size < INODE_META_SIZE * 2:
+        return FsckReport(0, 0, 0, [f'Block size is not valid: {block_size}'], [], [], [])
+    if bitmap_addr == 0:
+        # images from before the bitmap treat every block as used
+        end_page = device_size // block_size
+
+    checker = _Checker(_scan(path, block_size, end_page, workers or os.cpu_count() or 1, chunk_blocks), end_page)
+    checker.claim(0, 'root block')
+    bitmap = checker.read_bitmap(bitmap_addr)
+    if journal_addr:
+        checker.claim_run(journal_addr, journal_blocks, 'journal')
+
+    checker.walk()
+    checker.check_dedup_index(dedup_addr)
+    orphans = checker.check_bitmap(bitmap) if bitmap_addr != 0 else []
+
+    return FsckReport(end_page, checker.directories, checker.files,
+                      checker.errors, orphans, checker.cross_links, checker.cycles)
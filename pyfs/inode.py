@@ -3,25 +3,36 @@ from __future__ import annotations
 import logging
 import pyfs #pylint: disable=unused-import
 
-from .errors import InodeEntryExists
-from .inode_entry import InodeEntry
+from .errors import InodeEntryExists, InodeEntryNotFound, DirectoryNotEmpty, SharedInode
+from .inode_entry import InodeEntry, inline_capacity
+from .directory_index import DirectoryIndex
 from .constants import INODE_META_SIZE, INODE_FLAGS
 from .node import Node
+from .compression import CODEC_IDS, CompressedMap, chunk_shift
+from .extents import ExtentMap
+from .dedup import DedupMap
 
 logger = logging.getLogger("pyfs.inode")
 
-class Inode(Node):
+class Inode(Node): #pylint: disable=too-many-instance-attributes,too-many-public-methods
     def __init__(self, addr: int, data: bytes, fs: 'pyfs.PYFS'):
         super().__init__(addr, data, fs)
         self.meta_flag_locs = INODE_FLAGS
+        self._index = None
+        self._block_map = None
+
+        # readers of the directory entries or file data take the read side,
+        # anything changing them the write side. The lock belongs to the block,
+        # not this object, so threads holding different objects still exclude
+        # each other
+        self.lock = fs.inode_lock(addr)
 
     @property
     def children(self) -> 'list[InodeEntry]':
         if self.is_dir and self._children is not None:
             return self._children
         elif self.is_dir:
-            self._children = [InodeEntry(self._data[i:i+INODE_META_SIZE]) for i in range(INODE_META_SIZE, len(self._data), INODE_META_SIZE)]
-            logger.debug("files in inode: %s", len([a for a in self._children if not a.free]))
+            self._children = [InodeEntry(self._data, i) for i in range(INODE_META_SIZE, len(self._data), INODE_META_SIZE)]
             return self._children
         else:
             return []
@@ -42,14 +53,52 @@ class Inode(Node):
     def contains_data(self, value: bool):
         self.set_flags('contains_data', value)
 
+    @property
+    def is_bitmap(self) -> bool:
+        return self.get_flag('is_bitmap')
+
+    @is_bitmap.setter
+    def is_bitmap(self, value: bool):
+        self.set_flags('is_bitmap', value)
+
+    @property
+    def has_extents(self) -> bool:
+        return self.get_flag('has_extents')
+
+    @has_extents.setter
+    def has_extents(self, value: bool):
+        self.set_flags('has_extents', value)
+
+    @property
+    def is_compressed(self) -> bool:
+        return self.get_flag('is_compressed')
+
+    @is_compressed.setter
+    def is_compressed(self, value: bool):
+        self.set_flags('is_compressed', value)
+
+    @property
+    def is_deduped(self) -> bool:
+        return self.get_flag('is_deduped')
+
+    @is_deduped.setter
+    def is_deduped(self, value: bool):
+        self.set_flags('is_deduped', value)
+
+    @property
+    def is_dedup_index(self) -> bool:
+        return self.get_flag('is_dedup_index')
+
+    @is_dedup_index.setter
+    def is_dedup_index(self, value: bool):
+        self.set_flags('is_dedup_index', value)
+
     @property
     def parent_inode_addr(self) -> int:
         return self.get_meta_bytes(2, 4)
 
     @parent_inode_addr.setter
     def parent_inode_addr(self, value: int):
-        logger.debug('Inode %s parent_inode_addr set to %s', self.addr, value)
-
         self.set_meta_bytes(value, 2, 4)
 
     @property
@@ -58,19 +107,66 @@ class Inode(Node):
 
     @next_inode_addr.setter
     def next_inode_addr(self, value: int):
-        logger.debug('Inode %s next_inode_addr set to %s', self.addr, value)
-
         self.set_meta_bytes(value, 6, 4)
 
+    @property
+    def ref_count(self) -> int:
+        return self.get_meta_bytes(10, 2)
+
+    @ref_count.setter
+    def ref_count(self, value: int):
+        self.set_meta_bytes(value, 10, 2)
+
+    @property
+    def shared(self) -> bool:
+        '''Whether more than one directory entry references the inode, a ref count of 0 is a single one'''
+        return self.ref_count > 1
+
+    def check_private(self) -> None:
+        if self.shared:
+            raise SharedInode(self.addr)
+
     @property
     def data_size(self) -> int:
-        return self.get_meta_bytes(12, 2)
+        # the high half lives after file size so blocks over 64 KB can be filled
+        return self.get_meta_bytes(22, 2) << 16 | self.get_meta_bytes(12, 2)
 
     @data_size.setter
     def data_size(self, value):
-        logger.debug('Inode %s data_size set to %s', self.addr, value)
+        self.set_meta_bytes(value & 0xFFFF, 12, 2)
+        self.set_meta_bytes(value >> 16, 22, 2)
+
+    @property
+    def file_size(self) -> int:
+        size = self.get_meta_bytes(14, 8)
+        # images from before file_size was kept hold 0 here, their files are a single block of data_size bytes
+        if size == 0 and self.next_inode_addr == 0 and not (self.is_dir or self.has_extents or self.is_compressed or self.is_deduped):
+            return self.data_size
+        return size
+
+    @file_size.setter
+    def file_size(self, value: int):
+        self.set_meta_bytes(value, 14, 8)
+
+    @property
+    def codec(self) -> int:
+        return self.get_meta_bytes(24, 1)
 
-        self.set_meta_bytes(value, 12, 2)
+    @codec.setter
+    def codec(self, value: int):
+        self.set_meta_bytes(value, 24, 1)
+
+    @property
+    def chunk_shift(self) -> int:
+        return self.get_meta_bytes(25, 1)
+
+    @chunk_shift.setter
+    def chunk_shift(self, value: int):
+        self.set_meta_bytes(value, 25, 1)
+
+    @property
+    def data_capacity(self) -> int:
+        return self.fs.block_size - INODE_META_SIZE
 
     @property
     def full_inode_data(self) -> bytes:
@@ -79,94 +175,310 @@ class Inode(Node):
     @property
     def data(self) -> bytes:
         if self.is_dir:
-            tmp = bytes()
-
-            for child in self.children:
-                # inode_logger.debug(child.data)
-                tmp += child.data
-
-            return tmp
+            return bytes(self._data[INODE_META_SIZE:])
         else:
-            return self._data[INODE_META_SIZE:INODE_META_SIZE+self.data_size]
+            return bytes(self._data[INODE_META_SIZE:INODE_META_SIZE+self.data_size])
 
     @data.setter
     def data(self, value : bytes):
         if not self.is_dir:
+            if self.has_extents or self.is_compressed or self.is_deduped:
+                raise RuntimeError('Inode holds a block map, write through PYFS.open')
             if len(value) > self.fs.block_size - INODE_META_SIZE:
                 raise RuntimeError('Data is too big to fit in single Inode')
             self.dirty = True
             self.contains_data = True
             self.data_size = len(value)
-            self._data = self._data[:INODE_META_SIZE] + value + self._data[INODE_META_SIZE+len(value):]
+            self.file_size = len(value)
+            self._write_bytes(INODE_META_SIZE, value)
         else:
             raise RuntimeError('Inode is a directory')
 
+    def read_data(self, offset: int, size: int) -> bytes:
+        start = INODE_META_SIZE + offset
+        return self._data[start:start+size]
+
+    def write_data(self, offset: int, value: bytes):
+        if self.is_dir:
+            raise RuntimeError('Inode is a directory')
+        if offset + len(value) > self.data_capacity:
+            raise RuntimeError('Data is too big to fit in single Inode')
+
+        self.dirty = True
+        self.contains_data = True
+        self.data_size = max(self.data_size, offset + len(value))
+
+        self._write_bytes(INODE_META_SIZE + offset, value)
+
     def ls(self, show_hidden=False) -> 'list[InodeEntry]':
-        logger.debug('Inode %s has children %s', self.addr, [a.addr for a in self.children])
+        with self.lock.read():
+            entries = [a for a in self.children if not a.free and (not a.is_hidden or show_hidden)]
+            next_addr = self.next_inode_addr
 
         next_inode_ls = []
-        if self.next_inode_addr != 0:
-            logger.debug('Inode %s loading Inode %s for extra entries', self.addr, self.next_inode_addr)
-            next_inode_ls = self.fs.read_inode(self.next_inode_addr).ls(show_hidden=show_hidden)
+        if next_addr != 0:
+            next_inode_ls = self.fs.read_inode(next_addr).ls(show_hidden=show_hidden)
+
+        return entries + next_inode_ls
 
-        return [a for a in self.children if not a.free and (not a.is_hidden or show_hidden)] + next_inode_ls
+    @property
+    def index(self) -> DirectoryIndex:
+        if self._index is None:
+            with self.fs.lock:
+                if self._index is None:
+                    self._index = DirectoryIndex.build(self)
+        return self._index
+
+    @property
+    def block_map(self) -> 'ExtentMap | CompressedMap | DedupMap':
+        '''Block table of an extent, compressed or deduplicated file, loaded once and shared by every handle open on the file'''
+        if self._block_map is None and (self.has_extents or self.is_compressed or self.is_deduped):
+            with self.fs.lock:
+                if self._block_map is None:
+                    if self.has_extents:
+                        self._block_map = ExtentMap(self)
+                    elif self.is_compressed:
+                        self._block_map = CompressedMap(self)
+                    else:
+                        self._block_map = DedupMap(self)
+        return self._block_map
+
+    def invalidate_index(self):
+        self._index = None
 
     def find_entry(self, name) -> InodeEntry:
-        for entry in self.ls():
-            if entry.name == name:
-                logger.debug('Matched %s to %s', entry, name)
-                return entry
-        return None
+        if not self.is_dir:
+            return None
 
-    def add_inode_entry(self, name, child: 'Inode'):
-        logger.debug("Inode %s Adding Inode Entry...", self.addr)
-        self.dirty = True
-        for entry in self.children:
-            if entry.free:
-                logger.debug('Inode %s added entry for Inode %s', self.addr, child.addr)
-                entry.addr = child.addr
-                entry.is_dir = child.is_dir
-                entry.name = name
-                break
-        else:
-            if self.next_inode_addr == 0:
-                logger.info('Inode %s Adding Inode to store extra entries', self.addr)
-                tmp = self.fs.create_inode()
-                tmp.is_dir = True
-                tmp.parent_inode_addr = self.addr
-                self.next_inode_addr = tmp.addr
+        with self.lock.read():
+            entry = self.index.get(name)
+        if entry is None or entry.is_hidden:
+            return None
 
-            self.fs.read_inode(self.next_inode_addr).add_inode_entry(name, child)
+        return entry
 
-        self.save()
+    def add_inode_entry(self, name, child: 'Inode'):
+        with self.lock.write():
+            self._add_inode_entry(name, child)
+
+    def _add_inode_entry(self, name, child: 'Inode'):
+        block, entry = self._claim_entry(name)
+        entry.addr = child.addr
+        entry.is_dir = child.is_dir
+        entry.name = name
+
+        block.dirty = True
+        block.save()
+
+    def _claim_entry(self, name) -> 'tuple[Inode, InodeEntry]':
+        '''Reserve a free slot for name, adding a continuation block when all are used'''
+        self.check_private()
+        index = self.index
+
+        location = index.pop_free()
+        if location is None:
+            last = self.fs.read_inode(index.blocks[-1])
+
+            logger.info('Inode %s Adding Inode to store extra entries', last.addr)
+            tmp = self.fs.create_inode(near=last.addr)
+            tmp.is_dir = True
+            tmp.parent_inode_addr = last.addr
+            last.next_inode_addr = tmp.addr
+            last.save()
+
+            index.add_block(tmp)
+            location = index.pop_free()
+
+        block = self.fs.read_inode(location[0])
+        entry = index.entry_at(location)
+        entry.data = bytes(INODE_META_SIZE)
+
+        index.insert(name, location)
+        self.fs.dentries.invalidate(self.addr, name)
+        return block, entry
+
+    def link(self, name, child: 'Inode'):
+        '''Add an entry for an existing inode, which is shared by both entries until one side changes it'''
+        with self.lock.write():
+            self.check_if_exists(name)
+            with self.fs.transaction():
+                child.ref_count = max(child.ref_count, 1) + 1
+                child.save()
+                self._add_inode_entry(name, child)
+
+    def repoint_entry(self, name, addr: int):
+        '''Point the entry for name at another inode of the same kind'''
+        with self.lock.write():
+            self.check_private()
+            location = self.index.entries.get(name)
+            if location is None:
+                raise InodeEntryNotFound()
+
+            block = self.fs.read_inode(location[0])
+            self.index.entry_at(location).addr = addr
+            self.fs.dentries.invalidate(self.addr, name)
+
+            block.dirty = True
+            block.save()
 
     def check_if_exists(self, name):
-        for child in self.ls():
-            if name == child.name:
-                logger.info('Inode %s name %s already exists', self.addr, name)
-                raise InodeEntryExists()
+        with self.lock.read():
+            exists = name in self.index.entries
+        if exists:
+            logger.info('Inode %s name %s already exists', self.addr, name)
+            raise InodeEntryExists()
 
     def create_child_inode(self, name, is_dir):
-        self.check_if_exists(name)
-        tmp = self.fs.create_inode()
-        tmp.is_dir = is_dir
-        tmp.parent_inode_addr = self.addr
-        tmp.save()
+        # the check and the new entry happen under one write lock so two
+        # threads can not both add the same name
+        with self.lock.write():
+            self.check_if_exists(name)
+            with self.fs.transaction():
+                tmp = self.fs.create_inode(near=self.addr)
+                tmp.is_dir = is_dir
+                if not is_dir:
+                    tmp.init_file()
+                tmp.parent_inode_addr = self.addr
+                tmp.save()
 
-        self.dirty = True
-        self.add_inode_entry(name, tmp)
+                self.dirty = True
+                self.add_inode_entry(name, tmp)
+
+    def init_file(self) -> None:
+        '''Give a new file inode the layout the filesystem creates files with'''
+        if self.fs.compression is not None:
+            self.contains_data = True
+            self.is_compressed = True
+            self.codec = CODEC_IDS[self.fs.compression]
+            self.chunk_shift = chunk_shift(self.fs.block_size)
+        elif self.fs.dedup_files:
+            self.contains_data = True
+            self.is_deduped = True
+        elif self.fs.extent_files:
+            self.contains_data = True
+            self.has_extents = True
 
     def make_dir(self, name):
-        logger.info("Inode %s Creating directory: %s", self.addr, name)
         self.create_child_inode(name, True)
 
     def make_file(self, name):
-        logger.info("Inode %s Creating file: %s", self.addr, name)
-        self.create_child_inode(name, False)
+        # a name too long to leave room for the length byte gets an inode of its own
+        if self.fs.inline_files and inline_capacity(name) >= 0:
+            self.create_inline_entry(name)
+        else:
+            self.create_child_inode(name, False)
+
+    def create_inline_entry(self, name, data: bytes = b''):
+        '''Add an empty file stored in the directory entry itself instead of its own inode'''
+        if len(data) > inline_capacity(name):
+            raise ValueError(f'Inline data of {name} must fit in {inline_capacity(name)} bytes')
+
+        with self.lock.write():
+            self.check_if_exists(name)
+            with self.fs.transaction():
+                block, entry = self._claim_entry(name)
+                entry.is_inline = True
+                entry.name = name
+                entry.inline_data = data
+
+                block.dirty = True
+                block.save()
+
+    def _inline_entry(self, name) -> 'tuple[Inode, InodeEntry]':
+        self.check_private()
+        location = self.index.entries.get(name)
+        if location is None:
+            raise InodeEntryNotFound()
+
+        entry = self.index.entry_at(location)
+        if not entry.is_inline:
+            raise ValueError(f'{name} is not stored inline')
+        return self.fs.read_inode(location[0]), entry
+
+    def write_inline(self, name, data: bytes):
+        '''Replace the data of an inline file, raising ValueError when it does not fit'''
+        with self.lock.write():
+            block, entry = self._inline_entry(name)
+            entry.inline_data = data
+
+            block.dirty = True
+            block.save()
+
+    def promote_inline(self, name) -> 'Inode':
+        '''Move an inline file into a new empty inode of its own.
+
+        The entry is pointed at the new inode and its inline data dropped, the
+        caller is expected to write the data out through the returned inode.
+        '''
+        with self.lock.write(), self.fs.transaction():
+            block, entry = self._inline_entry(name)
+
+            tmp = self.fs.create_inode(near=self.addr)
+            tmp.init_file()
+            tmp.parent_inode_addr = self.addr
+            tmp.save()
+
+            entry.data = bytes(INODE_META_SIZE)
+            entry.addr = tmp.addr
+            entry.name = name
+            self.fs.dentries.invalidate(self.addr, name)
+
+            block.dirty = True
+            block.save()
+            return tmp
+
+    def remove_entry(self, name) -> int:
+        with self.lock.write():
+            return self._remove_entry(name)
+
+    def _remove_entry(self, name) -> int:
+        self.check_private()
+        index = self.index
+        location = index.entries.get(name)
+        if location is None:
+            raise InodeEntryNotFound()
+
+        block = self.fs.read_inode(location[0])
+        entry = index.entry_at(location)
+
+        addr = entry.addr
+        entry.data = bytes(INODE_META_SIZE)
+        index.remove(name)
+        self.fs.dentries.invalidate(self.addr, name)
+
+        block.dirty = True
+        block.save()
+        return addr
+
+    def unlink(self, name):
+        with self.lock.write():
+            entry = self.find_entry(name)
+            if entry is None:
+                raise InodeEntryNotFound()
+
+            if entry.is_inline:
+                self.remove_entry(name)
+                return
+
+            child = self.fs.read_inode(entry.addr)
+            if child.shared:
+                # only this reference goes away, the inode lives on for the others
+                with self.fs.transaction():
+                    self.remove_entry(name)
+                    child.ref_count -= 1
+                    if child.parent_inode_addr == self.addr:
+                        child.parent_inode_addr = 0
+                    child.save()
+                return
+
+            if child.is_dir and child.ls(show_hidden=True):
+                raise DirectoryNotEmpty()
+
+            with self.fs.transaction():
+                self.remove_entry(name)
+                self.fs.free_inode_chain(child.addr)
 
     def save(self):
-        logger.debug("Saving Inode %s", self.addr)
-        logger.debug("Inode %s dirty bit is set to %s", self.addr, self.dirty)
         self.fs.write_inode(self)
         self.dirty = False
 
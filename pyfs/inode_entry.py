@@ -1,34 +1,66 @@
 from __future__ import annotations
 
 import logging
+import struct
 
-from .constants import BYTE_ORDER, INODE_ENTRY_FLAGS
+from .constants import INODE_ENTRY_FLAGS, INODE_META_SIZE
 
 logger = logging.getLogger("pyfs.inode")
 
+NAME_SIZE = 122
+
+# flags, permissions, page address
+HEADER_STRUCT = struct.Struct('>BBI')
+FLAGS_STRUCT = struct.Struct('>B')
+ADDR_STRUCT = struct.Struct('>I')
+NAME_STRUCT = struct.Struct(f'{NAME_SIZE}s')
+
+NAME_OFFSET = HEADER_STRUCT.size
+
+def inline_capacity(name: str) -> int:
+    '''Bytes of inline data an entry called name can hold, negative when the name leaves no room'''
+    return NAME_SIZE - len(name.encode('utf-8')) - 2
+
 class InodeEntry:
-    def __init__(self, data: bytes):
-        self._data = data
-    
+    '''View of a 128 byte entry at offset of a block buffer.
+
+    Entries of a loaded Inode share its block so edits land directly in the
+    parent's buffer. The decoded name is cached until the entry is changed.
+
+    An inline entry is a file with no inode, its address is 0 and its data
+    follows the name in the name field as a null byte, one length byte and
+    the data itself.
+    '''
+    __slots__ = ('_buffer', '_offset', '_name')
+
+    def __init__(self, buffer, offset: int = 0):
+        if not isinstance(buffer, (bytearray, memoryview)):
+            buffer = bytearray(buffer)
+
+        self._buffer = buffer
+        self._offset = offset
+        self._name = None
+
     @property
     def data(self) -> bytes:
-        return self._data
-    
+        return bytes(self._buffer[self._offset:self._offset+INODE_META_SIZE])
+
     @data.setter
     def data(self, value: bytes):
-        self._data = value
+        self._buffer[self._offset:self._offset+INODE_META_SIZE] = value
+        self._name = None
 
     @property
     def flags(self) -> int:
-        return int.from_bytes(self._data[:1], byteorder=BYTE_ORDER)
-    
+        return FLAGS_STRUCT.unpack_from(self._buffer, self._offset)[0]
+
     @flags.setter
     def flags(self, value: int):
-        self._data = value.to_bytes(1, byteorder=BYTE_ORDER) + self._data[1:]
+        FLAGS_STRUCT.pack_into(self._buffer, self._offset, value)
 
     def get_bit_flag(self, field) -> bool:
         return self.flags & INODE_ENTRY_FLAGS[field]
-    
+
     def set_bit_flag(self, field, value: bool):
         if value:
             self.flags = self.flags | INODE_ENTRY_FLAGS[field]
@@ -42,7 +74,7 @@ class InodeEntry:
     @is_dir.setter
     def is_dir(self, value: bool):
         self.set_bit_flag('is_directory', value)
-    
+
     @property
     def is_hidden(self) -> bool:
         return self.get_bit_flag('is_hidden')
@@ -51,39 +83,69 @@ class InodeEntry:
     def is_hidden(self, value: bool):
         self.set_bit_flag('is_hidden', value)
 
+    @property
+    def is_inline(self) -> bool:
+        return self.get_bit_flag('is_inline')
+
+    @is_inline.setter
+    def is_inline(self, value: bool):
+        self.set_bit_flag('is_inline', value)
+
+    @property
+    def inline_capacity(self) -> int:
+        return inline_capacity(self.name)
+
+    @property
+    def inline_data(self) -> bytes:
+        start = self._offset + NAME_OFFSET + len(self.name.encode('utf-8')) + 1
+        return bytes(self._buffer[start+1:start+1+self._buffer[start]])
+
+    @inline_data.setter
+    def inline_data(self, value: bytes):
+        if len(value) > self.inline_capacity:
+            raise ValueError(f'Inline data must fit in {self.inline_capacity} bytes')
+
+        start = self._offset + NAME_OFFSET + len(self.name.encode('utf-8')) + 1
+        end = self._offset + NAME_OFFSET + NAME_SIZE
+        self._buffer[start:end] = bytes([len(value)]) + bytes(value) + bytes(end - start - len(value) - 1)
+
     @property
     def permissions(self) -> int:
-        return int.from_bytes(self._data[1:2], byteorder=BYTE_ORDER)
-    
+        return FLAGS_STRUCT.unpack_from(self._buffer, self._offset + 1)[0]
+
     @permissions.setter
     def permissions(self, value: int):
-        self._data = self._data[:1] + value.to_bytes(1, byteorder=BYTE_ORDER) + self._data[2:6]
+        FLAGS_STRUCT.pack_into(self._buffer, self._offset + 1, value)
 
     @property
     def addr(self) -> int:
-        return int.from_bytes(self._data[2:6], byteorder=BYTE_ORDER)
-    
+        return ADDR_STRUCT.unpack_from(self._buffer, self._offset + 2)[0]
+
     @addr.setter
     def addr(self, value: int):
-        self._data = self._data[:2] + value.to_bytes(4, byteorder=BYTE_ORDER) + self._data[6:]
+        ADDR_STRUCT.pack_into(self._buffer, self._offset + 2, value)
 
     @property
     def name(self) -> str:
-        return self._data[6:].decode('utf-8').rstrip('\0')
-    
+        if self._name is None:
+            name = NAME_STRUCT.unpack_from(self._buffer, self._offset + NAME_OFFSET)[0]
+            self._name = name.split(b'\0', 1)[0].decode('utf-8')
+        return self._name
+
     @name.setter
     def name(self, value: str):
-        value = value.encode('utf-8')
+        encoded = value.encode('utf-8')
 
-        if len(value) > 122:
+        if len(encoded) > NAME_SIZE:
             raise ValueError('Name must be able to be encoded in under 122 bytes')
-        
-        value = value + bytes(122 - len(value))
-        self._data = self._data[:6] + value
+
+        # struct pads the name with null bytes
+        NAME_STRUCT.pack_into(self._buffer, self._offset + NAME_OFFSET, encoded)
+        self._name = value.rstrip('\0')
 
     @property
     def free(self):
-        return self.addr == 0
-    
+        return self.addr == 0 and not self.is_inline
+
     def __str__(self):
         return f'{self.addr} {self.name}'
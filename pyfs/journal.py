@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+from contextlib import contextmanager
+import logging
+import struct
+import zlib
+import pyfs #pylint: disable=unused-import
+
+from .errors import TransactionTooLarge
+
+logger = logging.getLogger("pyfs.journal")
+
+JOURNAL_MAGIC = b'PYFSJRNL'
+COMMIT_MAGIC = b'PYFSCMIT'
+
+# magic, sequence, number of logged blocks followed by their home addresses
+HEADER_STRUCT = struct.Struct('>8sQI')
+# magic, sequence, crc32 of the logged blocks
+COMMIT_STRUCT = struct.Struct('>8sQI')
+ADDR_STRUCT = struct.Struct('>I')
+
+class Journal: #pylint: disable=too-many-instance-attributes
+    '''Write-ahead journal kept in a contiguous run of blocks.
+
+    While active every block write is held in memory. Writes made inside a
+    transaction are only committed together, and pending writes are committed
+    as a group once group_blocks blocks are waiting or on sync, which waits
+    for an open transaction to end. A commit writes a header listing the home
+    addresses, the block images and a commit block carrying a checksum in one
+    sequential write, flushes, then writes the blocks to their home locations.
+    Mounting replays a batch whose commit block is intact and discards
+    anything else. A commit is never split: the journal moves to a larger run
+    when it can not hold one, and one too large for any journal is dropped
+    together with everything cached since the last commit.
+    '''
+    def __init__(self, fs: 'pyfs.PYFS', enabled: bool, blocks: int, group_blocks: int):
+        self.fs = fs
+        self.enabled = enabled
+        self.default_blocks = blocks
+        self.group_blocks = group_blocks
+
+        self.addr = 0
+        self.blocks = 0
+        self.sequence = 0
+
+        self.pending = {}
+        self.depth = 0
+        self.commits = 0
+        # a commit asked for inside a transaction, made once it ends
+        self.deferred = False
+
+    @property
+    def active(self) -> bool:
+        return self.enabled and self.addr != 0
+
+    @property
+    def max_capacity(self) -> int:
+        '''Number of blocks the header of a commit can list, whatever the size of the journal'''
+        return (self.fs.block_size - HEADER_STRUCT.size) // ADDR_STRUCT.size
+
+    @property
+    def capacity(self) -> int:
+        '''Number of blocks a single commit can hold'''
+        return min(self.blocks - 2, self.max_capacity)
+
+    def create(self) -> None:
+        blocks = self.default_blocks
+        addr = self.fs.allocator.allocate(blocks)
+        logger.info('Creating journal of %s blocks at %s', blocks, addr)
+
+        self.addr = 0
+        self.blocks = blocks
+        self.sequence = 0
+        self.fs.write_blocks({addr: self._header([])})
+
+        root = self.fs.root_block
+        root.journal_addr = addr
+        root.journal_blocks = blocks
+        self.fs.allocator.sync()
+        root.save()
+
+        # anything buffered before the journal existed goes out first
+        self.fs.flush_writes()
+        self.addr = addr
+
+    def load(self) -> int:
+        '''Pick up the journal from the root block and replay it, returns the number of replayed blocks'''
+        root = self.fs.root_block
+        self.addr = root.journal_addr
+        self.blocks = root.journal_blocks
+        self.pending = {}
+
+        if self.addr == 0:
+            return 0
+        return self.replay()
+
+    def _header(self, addrs) -> bytes:
+        header = bytearray(self.fs.block_size)
+        HEADER_STRUCT.pack_into(header, 0, JOURNAL_MAGIC, self.sequence, len(addrs))
+        for idx, addr in enumerate(addrs):
+            ADDR_STRUCT.pack_into(header, HEADER_STRUCT.size + idx * ADDR_STRUCT.size, addr)
+        return header
+
+    def replay(self) -> int:
+        header = self.fs.read_device(self.addr, 1)
+        magic, sequence, count = HEADER_STRUCT.unpack_from(header, 0)
+        if magic != JOURNAL_MAGIC:
+            logger.warning('Journal at %s has no valid header', self.addr)
+            self.sequence = 0
+            return 0
+
+        self.sequence = sequence
+        if count == 0:
+            return 0
+
+        valid = count <= self.capacity
+        if valid:
+            images = self.fs.read_device(self.addr + 1, count + 1)
+            commit = images[count * self.fs.block_size:]
+            images = images[:count * self.fs.block_size]
+
+            commit_magic, commit_sequence, crc = COMMIT_STRUCT.unpack_from(commit, 0)
+            valid = commit_magic == COMMIT_MAGIC and commit_sequence == sequence and zlib.crc32(images) == crc
+
+        if not valid:
+            logger.warning('Discarding incomplete journal transaction %s', sequence)
+            self.fs.write_blocks({self.addr: self._header([])})
+            self.fs.flush_device()
+            return 0
+
+        logger.info('Replaying journal transaction %s of %s blocks', sequence, count)
+        block_size = self.fs.block_size
+        blocks = {}
+        for idx in range(count):
+            addr = ADDR_STRUCT.unpack_from(header, HEADER_STRUCT.size + idx * ADDR_STRUCT.size)[0]
+            blocks[addr] = images[idx*block_size:(idx+1)*block_size]
+
+        self.fs.write_blocks(blocks)
+        self.fs.flush_device()
+        self.fs.write_blocks({self.addr: self._header([])})
+        return count
+
+    def write(self, addr: int, data: bytes) -> None:
+        self.pending[addr] = bytes(data)
+        if self.depth == 0 and len(self.pending) >= self.group_blocks:
+            self.commit()
+
+    def read(self, addr: int) -> bytes:
+        return self.pending.get(addr)
+
+    @contextmanager
+    def transaction(self):
+        self.depth += 1
+        try:
+            yield self
+        finally:
+            self.depth -= 1
+
+        if self.depth == 0 and (self.deferred or len(self.pending) >= self.group_blocks):
+            self.commit()
+
+    def commit(self) -> None:
+        if self.depth > 0:
+            # half a transaction is never committed
+            self.deferred = True
+            return
+
+        self.deferred = False
+        if not self.pending:
+            return
+
+        moved = False
+        try:
+            while len(self.pending) > self.capacity:
+                self._grow(len(self.pending))
+                moved = True
+        except TransactionTooLarge:
+            # nothing of it reached the device, go back to what the device holds
+            self.fs.discard_changes()
+            raise
+
+        self._commit_batch(sorted(self.pending), moved)
+        self.pending = {}
+
+    def _grow(self, count: int) -> None:
+        '''Move the journal to a new run that holds a commit of count blocks.
+
+        The new location and the freed old run are written by the commit that
+        needed them, so until it is checkpointed the root block on disk still
+        points at the old, empty journal.
+        '''
+        if count > self.max_capacity:
+            raise TransactionTooLarge(count, self.max_capacity)
+
+        # the allocator and root block writes land in pending without starting a commit of their own
+        self.depth += 1
+        try:
+            blocks = max(count + 2, self.blocks * 2)
+            addr = self.fs.allocator.allocate(blocks)
+            logger.info('Moving journal of %s blocks at %s to %s blocks at %s', self.blocks, self.addr, blocks, addr)
+
+            self.fs.allocator.free(self.addr, self.blocks)
+            self.addr = addr
+            self.blocks = blocks
+
+            root = self.fs.root_block
+            root.journal_addr = addr
+            root.journal_blocks = blocks
+            self.fs.allocator.sync()
+            root.save()
+        finally:
+            self.depth -= 1
+
+    def _commit_batch(self, addrs, moved: bool = False) -> None:
+        self.sequence += 1
+        self.commits += 1
+        logger.debug('Committing journal transaction %s of %s blocks', self.sequence, len(addrs))
+
+        images = [self.pending[addr] for addr in addrs]
+        commit = bytearray(self.fs.block_size)
+        COMMIT_STRUCT.pack_into(commit, 0, COMMIT_MAGIC, self.sequence, zlib.crc32(b''.join(images)))
+
+        log = {self.addr: self._header(addrs), self.addr + len(addrs) + 1: commit}
+        for idx, image in enumerate(images):
+            log[self.addr + idx + 1] = image
+
+        self.fs.write_blocks(log)
+        self.fs.flush_device()
+
+        # checkpoint to the home locations, after which the log is not needed
+        if moved:
+            # the root block goes first so a crash from here on replays from the new journal
+            self.fs.write_blocks({0: self.pending[0]})
+            self.fs.flush_device()
+        self.fs.write_blocks({addr: self.pending[addr] for addr in addrs})
+        self.fs.flush_device()
+        self.fs.write_blocks({self.addr: self._header([])})
+
+    def __repr__(self) -> str:
+        return f"Journal addr: {self.addr} blocks: {self.blocks} sequence: {self.sequence} pending: {len(self.pending)}"
@@ -1,18 +1,26 @@
 from __future__ import annotations
 
 import logging
+import struct
 import pyfs.pyfs#pylint: disable=unused-import
 
-from .constants import INODE_META_SIZE, BYTE_ORDER
+from .constants import INODE_META_SIZE
 
 logger = logging.getLogger("pyfs.node")
 
+# big endian unsigned layouts for header fields by their size in bytes
+FIELD_STRUCTS = {1: struct.Struct('>B'),
+                 2: struct.Struct('>H'),
+                 4: struct.Struct('>I'),
+                 8: struct.Struct('>Q'),
+                }
+
 class Node:
     def __init__(self, addr: int, data: bytes, fs: 'pyfs.pyfs.PYFS'):
         #self.meta = data[:INODE_META_SIZE]
-        logger.debug("Meta data for Node %s: %s", addr, data[:INODE_META_SIZE])
 
-        self._data = data
+        # mapped blocks are used as is, anything else gets a private mutable copy
+        self._data = data if isinstance(data, memoryview) else bytearray(data)
         self._children = None
         self.dirty = False
 
@@ -23,25 +31,25 @@ class Node:
     
     @property
     def meta(self) -> bytes:
-        return self._data[:INODE_META_SIZE]
+        return bytes(self._data[:INODE_META_SIZE])
     
     @meta.setter
     def meta(self, value):
-        self._data = value + self._data[INODE_META_SIZE:]
+        self._write_bytes(0, value)
+
+    def _write_bytes(self, start_pos, value):
+        self._data[start_pos:start_pos+len(value)] = value
 
     @property
     def flags(self) -> int:
-        return int.from_bytes(self.meta[:2], byteorder=BYTE_ORDER)
+        return FIELD_STRUCTS[2].unpack_from(self._data, 0)[0]
     
     @flags.setter
     def flags(self, value: int):
-        logger.debug('Node %s flags set to %s', self.addr, value)
-
         self.set_meta_bytes(value, 0, 2)
 
     def set_flags(self, flag, value :bool):
         self.dirty = True
-        logger.debug('node %s %s set to %s', self.addr, flag, value)
 
         if value:
             self.flags = self.flags | self.meta_flag_locs[flag]
@@ -53,10 +61,10 @@ class Node:
 
     def set_meta_bytes(self, value, start_pos, size):
         self.dirty = True
-        self.meta = self.meta[:start_pos] + value.to_bytes(size, byteorder=BYTE_ORDER) + self.meta[start_pos+size:]
+        FIELD_STRUCTS[size].pack_into(self._data, start_pos, value)
     
-    def get_meta_bytes(self, start_pos, size, ret_type=int):
-        return ret_type.from_bytes(self.meta[start_pos:start_pos+size], byteorder=BYTE_ORDER)
+    def get_meta_bytes(self, start_pos, size):
+        return FIELD_STRUCTS[size].unpack_from(self._data, start_pos)[0]
     
     def __repr__(self) -> str:
         return f"Node {self.addr}: Meta - {self.meta} Data - {self._data}"
@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+from io import BufferedRandom
+import logging
+import os
+from typing import NamedTuple
+import pyfs #pylint: disable=unused-import
+
+from .pyfs import PYFS
+from .inode import Inode
+from .file import PYFSFile
+from .inode_entry import NAME_SIZE
+from .constants import INODE_META_SIZE, DEFAULT_WRITE_BACK_BLOCKS, DEFAULT_BLOCK_SIZE
+
+logger = logging.getLogger("pyfs.pack")
+
+class _PlannedDir(NamedTuple):
+    host_path: str
+    dirs: list
+    files: list
+    addrs: list
+
+class _PlannedFile(NamedTuple):
+    host_path: str
+    size: int
+    addr: int = 0
+    blocks: int = 0
+
+def _plan(host_dir: str) -> 'list[_PlannedDir]':
+    '''Scan the host tree breadth first, returning every directory in that order'''
+    root = _PlannedDir(host_dir, [], [], [])
+    dirs = [root]
+
+    idx = 0
+    while idx < len(dirs):
+        current = dirs[idx]
+        idx += 1
+
+        with os.scandir(current.host_path) as scan:
+            for entry in sorted(scan, key=lambda a: a.name):
+                if len(entry.name.encode()) > NAME_SIZE:
+                    raise ValueError(f'Name is longer than {NAME_SIZE} bytes: {entry.path}')
+
+                if entry.is_dir(follow_symlinks=False):
+                    child = _PlannedDir(entry.path, [], [], [])
+                    current.dirs.append((entry.name, child))
+                    dirs.append(child)
+                elif entry.is_file(follow_symlinks=False):
+                    current.files.append((entry.name, _PlannedFile(entry.path, entry.stat(follow_symlinks=False).st_size)))
+                else:
+                    logger.warning('Skipping %s, only directories and regular files are packed', entry.path)
+
+    return dirs
+
+class _BlockWriter:
+    '''Collects finished blocks and writes them out in large sequential batches'''
+    def __init__(self, fs: PYFS, batch_blocks: int):
+        self.fs = fs
+        self.batch_blocks = batch_blocks
+        self.blocks = {}
+
+    def add(self, inode: Inode) -> None:
+        self.blocks[inode.addr] = inode.full_inode_data
+        if len(self.blocks) >= self.batch_blocks:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.blocks:
+            self.fs.write_blocks(self.blocks)
+            self.blocks = {}
+
+def pack(host_dir: str, block_dev: BufferedRandom, batch_blocks: int = DEFAULT_WRITE_BACK_BLOCKS,
+         block_size: int = DEFAULT_BLOCK_SIZE) -> PYFS:
+    '''Build a new filesystem on block_dev holding a copy of the host directory tree.
+
+    The whole tree is planned before anything is written so every block is
+    written exactly once. Directory blocks take one contiguous run in
+    breadth first order followed by every file's chain of data inodes, and
+    both are streamed out batch_blocks at a time.
+    '''
+    dirs = _plan(host_dir)
+
+    fs = PYFS(block_dev)
+    fs.create_fs(block_size)
+
+    per_block = (fs.block_size - INODE_META_SIZE) // INODE_META_SIZE
+    capacity = fs.block_size - INODE_META_SIZE
+    _layout(fs, dirs, per_block, capacity)
+
+    writer = _BlockWriter(fs, batch_blocks)
+    _write_dirs(fs, writer, dirs, per_block)
+    _write_files(fs, writer, dirs, capacity)
+    writer.flush()
+    fs.allocator.sync()
+    fs.sync()
+
+    # everything cached so far predates the blocks written above
+    fs.loaded_inodes.clear()
+    fs.dentries.clear()
+    fs.check_fs()
+    return fs
+
+def _layout(fs: PYFS, dirs: 'list[_PlannedDir]', per_block: int, capacity: int) -> None:
+    '''Allocate one run for the whole tree and give every planned directory and file its blocks in it'''
+    dir_blocks = [max(1, -(-(len(a.dirs) + len(a.files)) // per_block)) for a in dirs]
+    for planned in dirs:
+        planned.files[:] = [(name, a._replace(blocks=max(1, -(-a.size // capacity)))) for name, a in planned.files]
+    file_blocks = sum(a.blocks for planned in dirs for _, a in planned.files)
+
+    # the root directory already lives in inode 1
+    count = sum(dir_blocks) - 1 + file_blocks
+    logger.info('Packing %s directories and %s files into %s blocks', len(dirs),
+                sum(len(a.files) for a in dirs), count)
+
+    addr = fs.allocator.allocate(count) if count else 0
+    for planned, blocks in zip(dirs, dir_blocks):
+        if planned is dirs[0]:
+            planned.addrs.append(1)
+            blocks -= 1
+        planned.addrs.extend(range(addr, addr + blocks))
+        addr += blocks
+    for planned in dirs:
+        for idx, (name, planned_file) in enumerate(planned.files):
+            planned.files[idx] = (name, planned_file._replace(addr=addr))
+            addr += planned_file.blocks
+
+def _write_dirs(fs: PYFS, writer: _BlockWriter, dirs: 'list[_PlannedDir]', per_block: int) -> None:
+    '''Write the directory blocks in breadth first order, every parent comes before its children'''
+    parents = {id(dirs[0]): 0}
+    for planned in dirs:
+        for _, child in planned.dirs:
+            parents[id(child)] = planned.addrs[0]
+        _write_dir(fs, writer, planned, parents[id(planned)], per_block)
+
+def _write_files(fs: PYFS, writer: _BlockWriter, dirs: 'list[_PlannedDir]', capacity: int) -> None:
+    '''Copy the data of every planned file into its run of data inodes'''
+    for planned in dirs:
+        for _, planned_file in planned.files:
+            _write_file(fs, writer, planned_file, planned.addrs[0], capacity)
+
+def _write_dir(fs: PYFS, writer: _BlockWriter, planned: _PlannedDir, parent: int, per_block: int) -> None:
+    children = [(name, child.addrs[0], True) for name, child in planned.dirs]
+    children += [(name, child.addr, False) for name, child in planned.files]
+
+    for idx, addr in enumerate(planned.addrs):
+        block = Inode(addr, bytes(fs.block_size), fs)
+        block.is_dir = True
+        block.parent_inode_addr = parent if idx == 0 else planned.addrs[idx-1]
+        if idx + 1 < len(planned.addrs):
+            block.next_inode_addr = planned.addrs[idx+1]
+
+        for entry, (name, child_addr, is_dir) in zip(block.children, children[idx*per_block:(idx+1)*per_block]):
+            entry.addr = child_addr
+            entry.is_dir = is_dir
+            entry.name = name
+
+        writer.add(block)
+
+def _write_file(fs: PYFS, writer: _BlockWriter, planned: _PlannedFile, parent: int, capacity: int) -> None:
+    with open(planned.host_path, 'rb') as f:
+        for idx in range(planned.blocks):
+            addr = planned.addr + idx
+            size = min(capacity, planned.size - idx * capacity)
+            chunk = f.read(size)
+            if len(chunk) != size:
+                raise RuntimeError(f'{planned.host_path} changed while it was being packed')
+
+            block = Inode(addr, bytes(fs.block_size), fs)
+            block.contains_data = True
+            block.parent_inode_addr = parent if idx == 0 else addr - 1
+            if idx + 1 < planned.blocks:
+                block.next_inode_addr = addr + 1
+            block.write_data(0, chunk)
+            if idx == 0:
+                block.file_size = planned.size
+
+            writer.add(block)
+
+def unpack(fs: PYFS, host_dir: str, chunk_size: int = 1 << 20) -> None:
+    '''Copy the whole filesystem into host_dir, which is created if needed'''
+    if fs.root_inode is None:
+        fs.read_root_inode()
+
+    os.makedirs(host_dir, exist_ok=True)
+    queue = [(host_dir, fs.root_inode)]
+    while queue:
+        path, inode = queue.pop()
+        for entry in inode.ls():
+            child_path = os.path.join(path, entry.name)
+            if entry.is_inline:
+                with open(child_path, 'wb') as dst:
+                    dst.write(entry.inline_data)
+                continue
+
+            child = fs.read_inode(entry.addr)
+
+            if child.is_dir:
+                os.makedirs(child_path, exist_ok=True)
+                queue.append((child_path, child))
+                continue
+
+            with PYFSFile(child, 'rb') as src, open(child_path, 'wb') as dst:
+                while chunk := src.read(chunk_size):
+                    dst.write(chunk)
@@ -1,28 +1,309 @@
-from io import BufferedRandom
+from contextlib import contextmanager, nullcontext
+from io import BufferedRandom, UnsupportedOperation
 import logging
+import mmap
+import os
+import posixpath
+import threading
+import time
+import weakref
+from pathlib import PurePosixPath
+from typing import NamedTuple
 
 from .inode import Inode
-from .constants import DEFAULT_BLOCK_SIZE, BYTE_ORDER
+from .file import PYFSFile
+from .cache import BlockCache
+from .allocator import BlockAllocator
+from .root_node import RootNode, decode_block_size
+from .dentry_cache import DentryCache, NEGATIVE, INLINE
+from .journal import Journal
+from .extents import ExtentMap
+from .compression import CompressedMap, CODEC_IDS
+from .dedup import DedupIndex, DedupMap
+from .locks import RWLock, NULL_RWLOCK
+from .shared_index import SharedPathIndex
+from .stats import IOStats
+from .snapshot import SNAPSHOT_DIR, unshare
+from .compact import compact_dir, compact_tree
+from . import sparse
+from .errors import ReadOnlyFilesystem, InlineFile, InodeEntryExists
+from .constants import DEFAULT_BLOCK_SIZE, DEFAULT_CACHE_ENTRIES, DEFAULT_DENTRY_ENTRIES, \
+    DEFAULT_WRITE_BACK_BLOCKS, DEFAULT_JOURNAL_BLOCKS, DEFAULT_JOURNAL_GROUP_BLOCKS, BYTE_ORDER, \
+    MIN_BLOCK_SIZE, MAX_BLOCK_SIZE
 
 logger = logging.getLogger('pyfs')
 
-class PYFS:
-    def __init__(self, block_dev: BufferedRandom):
+class StatResult(NamedTuple):
+    addr: int
+    is_dir: bool
+    size: int
+    parent_addr: int
+
+class PYFS: #pylint: disable=too-many-instance-attributes,too-many-public-methods
+    #pylint: disable-next=too-many-arguments,too-many-positional-arguments,too-many-locals,too-many-statements
+    def __init__(self, block_dev: BufferedRandom, cache_entries: int = DEFAULT_CACHE_ENTRIES, cache_bytes: int = None,
+                 use_mmap: bool = False, dentry_entries: int = DEFAULT_DENTRY_ENTRIES,
+                 write_back: bool = False, write_back_blocks: int = DEFAULT_WRITE_BACK_BLOCKS,
+                 journal: bool = False, journal_blocks: int = DEFAULT_JOURNAL_BLOCKS,
+                 journal_group_blocks: int = DEFAULT_JOURNAL_GROUP_BLOCKS, thread_safe: bool = False,
+                 read_only: bool = False, shared_index: SharedPathIndex = None, extent_files: bool = False,
+                 trace=None, inline_files: bool = False, compression: str = None, dedup: bool = False):
         self.block_dev = block_dev
         self.block_size = DEFAULT_BLOCK_SIZE
 
+        # every device read, write and flush is counted and timed, trace is
+        # called as trace(op, offset=, size=, seconds=) when set
+        self.io_stats = IOStats()
+        self.trace = trace
+
+        # new files keep an extent map of raw data blocks instead of a chain of data inodes
+        self.extent_files = extent_files
+        # new files are compressed chunk by chunk with this codec, 'zlib' or 'lzma'
+        if compression is not None and compression not in CODEC_IDS:
+            raise ValueError(f'Unknown compression codec: {compression}')
+        self.compression = compression
+        # new files share identical data blocks with every other deduplicated file
+        if dedup and compression is not None:
+            raise ValueError('Compressed files can not be deduplicated')
+        self.dedup_files = dedup
+        # new files start out inline in their directory entry and only get an
+        # inode once they outgrow it
+        self.inline_files = inline_files
+
+        # a read only mount never writes, so several processes can map the same
+        # image and share one path index built by whoever mounted it first
+        self.read_only = read_only
+        self.shared_index = shared_index
+        if read_only and journal:
+            raise ValueError('A read only mount can not be journaled')
+        if shared_index is not None and not read_only:
+            raise ValueError('A shared path index is only valid for a read only mount')
+
+        # in thread safe mode shared structures are guarded by one reentrant lock,
+        # inodes get reader/writer locks and file backed devices use positional
+        # I/O so no thread depends on the shared file position
+        self.thread_safe = thread_safe
+        self.lock = threading.RLock() if thread_safe else nullcontext()
+        # inode locks live as long as some Inode of their block does
+        self._inode_locks = weakref.WeakValueDictionary()
+        self._device_lock = threading.Lock() if thread_safe else nullcontext()
+        self._stats_lock = threading.Lock() if thread_safe else nullcontext()
+        self._fd = None
+        if thread_safe and hasattr(os, 'pread'):
+            try:
+                self._fd = block_dev.fileno()
+                block_dev.flush()
+            except (AttributeError, UnsupportedOperation):
+                self._fd = None
+
+        # blocks waiting to be written when write back is enabled
+        self.write_back = write_back
+        self.write_back_blocks = write_back_blocks
+        self._pending = {}
+
+        self.use_mmap = use_mmap
+        self._map = None
+        self._map_view = None
+        if use_mmap and journal:
+            raise ValueError('mmap mode writes blocks in place and can not be journaled')
+        if use_mmap:
+            try:
+                block_dev.fileno()
+            except (AttributeError, UnsupportedOperation) as e:
+                raise ValueError('mmap mode needs a block device backed by a file') from e
+
         self.root_block = None
-        self.root_block_dirty = False
 
         self.root_inode = None
-        self.loaded_inodes = {}
+        self.loaded_inodes = BlockCache(cache_entries, cache_bytes)
+        self.allocator = BlockAllocator(self)
+        self.dentries = DentryCache(dentry_entries)
+        self.journal = Journal(self, journal, journal_blocks, journal_group_blocks)
+        self.dedup = DedupIndex(self)
     
+    def inode_lock(self, addr: int):
+        '''The reader/writer lock of the block at addr, shared by every Inode object built for it'''
+        if not self.thread_safe:
+            return NULL_RWLOCK
+        with self.lock:
+            lock = self._inode_locks.get(addr)
+            if lock is None:
+                lock = RWLock()
+                self._inode_locks[addr] = lock
+            return lock
+
+    def _record_io(self, op: str, offset: int, size: int, start: float) -> None:
+        seconds = time.perf_counter() - start
+        with self._stats_lock:
+            self.io_stats.record(op, size, seconds)
+        if self.trace is not None:
+            self.trace(op, offset=offset, size=size, seconds=seconds)
+
+    def _device_read(self, offset: int, size: int) -> bytes:
+        start = time.perf_counter()
+        if self._fd is not None:
+            data = os.pread(self._fd, size, offset)
+        else:
+            with self._device_lock:
+                self.block_dev.seek(offset, 0)
+                data = self.block_dev.read(size)
+
+        self._record_io('read', offset, len(data), start)
+        return data
+
+    def _device_write(self, offset: int, data) -> None:
+        start = time.perf_counter()
+        size = len(data)
+        if self._fd is not None:
+            view = memoryview(data)
+            pos = offset
+            while view:
+                written = os.pwrite(self._fd, view, pos)
+                view = view[written:]
+                pos += written
+        else:
+            with self._device_lock:
+                self.block_dev.seek(offset, 0)
+                self.block_dev.write(data)
+
+        self._record_io('write', offset, size, start)
+
+    def flush_device(self) -> None:
+        start = time.perf_counter()
+        self.block_dev.flush()
+        self._record_io('flush', 0, 0, start)
+
+    def stats(self) -> dict:
+        '''Device I/O, block cache, dentry cache and journal counters'''
+        with self._stats_lock:
+            io_stats = self.io_stats.to_dict(self.block_size)
+        return {'io': io_stats,
+                'cache': self.loaded_inodes.stats(),
+                'dentries': self.dentries.stats(),
+                'journal_commits': self.journal.commits,
+               }
+
+    def reset_stats(self) -> None:
+        with self._stats_lock:
+            self.io_stats.reset()
+        self.loaded_inodes.reset_stats()
+        self.dentries.reset_stats()
+
+    def _device_size(self) -> int:
+        if self._fd is not None:
+            return os.fstat(self._fd).st_size
+
+        with self._device_lock:
+            self.block_dev.seek(0, 2)
+            return self.block_dev.tell()
+
+    def _device_fileno(self) -> int:
+        '''File descriptor of a file backed device with its buffered writes flushed, None for in memory devices'''
+        try:
+            fd = self.block_dev.fileno()
+        except (AttributeError, UnsupportedOperation):
+            return None
+        self.block_dev.flush()
+        return fd
+
+    def resize_device(self, blocks: int, preallocate: bool = False) -> None:
+        '''Grow the device to hold blocks without writing them.
+
+        The new space is left as a hole in the image file, or reserved on disk
+        with posix_fallocate when preallocate is set. In memory devices grow as
+        they are written and read holes back as zeros.
+        '''
+        fd = self._device_fileno()
+        if fd is None:
+            return
+
+        logger.info('Growing the block device to %s blocks', blocks)
+        with self._device_lock:
+            if preallocate:
+                sparse.preallocate(fd, blocks * self.block_size)
+            else:
+                sparse.grow(fd, blocks * self.block_size)
+
+    def trim(self) -> int:
+        '''Punch holes over every run of free blocks so the image file releases their disk space.
+
+        Returns the number of blocks released, 0 where the platform can not punch holes.
+        '''
+        self._check_writable()
+        with self.lock:
+            # the holes must only cover blocks whose free state is on disk
+            self.allocator.sync()
+            self.sync()
+
+            fd = self._device_fileno()
+            if fd is None:
+                return 0
+
+            released = 0
+            for addr, count in self.allocator.free_runs():
+                if not sparse.punch_hole(fd, addr * self.block_size, count * self.block_size):
+                    break
+                released += count
+
+        logger.info('Released %s free blocks', released)
+        return released
+
+    def _map_device(self) -> None:
+        self.block_dev.flush()
+        size = os.fstat(self.block_dev.fileno()).st_size
+        size -= size % self.block_size
+
+        if size == 0 or (self._map is not None and len(self._map) == size):
+            return
+
+        # views handed out from an older mapping keep it alive and stay coherent
+        # with the new one as both share the same pages of the file
+        logger.debug('Mapping %s bytes of the block device', size)
+        access = mmap.ACCESS_READ if self.read_only else mmap.ACCESS_WRITE
+        self._map = mmap.mmap(self.block_dev.fileno(), size, access=access)
+        self._map_view = memoryview(self._map)
+
+    def _mapped_block(self, addr: int) -> memoryview:
+        end = (addr + 1) * self.block_size
+        if self._map is None or end > len(self._map):
+            with self.lock:
+                self._map_device()
+        if self._map is None or end > len(self._map):
+            return None
+        return self._map_view[addr * self.block_size:end]
+
+    def read_block(self, addr: int):
+        if self.use_mmap:
+            view = self._mapped_block(addr)
+            if view is not None:
+                return view
+
+        data = self.journal.read(addr) if self.journal.active else None
+        if data is not None:
+            return data
+
+        if addr in self._pending:
+            return self._pending[addr]
+
+        return self.read_device(addr, 1)
+
+    def read_blocks(self, addr: int, count: int) -> bytes:
+        '''Read count consecutive blocks, in a single device read when none of them are buffered'''
+        if self.use_mmap or (self.journal.active and self.journal.pending) or self._pending:
+            return b''.join(self.read_block(cur) for cur in range(addr, addr + count))
+        return self.read_device(addr, count)
+
+    def read_device(self, addr: int, count: int) -> bytes:
+        size = count * self.block_size
+        data = self._device_read(addr * self.block_size, size)
+        if len(data) < size:
+            # allocated blocks past the end of the device were never written
+            data += bytes(size - len(data))
+        return data
+
     def read_root(self) -> None:
         logger.info('Reading root block')
-        self.block_dev.seek(0, 0)
-        self.root_block = self.block_dev.read(self.block_size)
-        
-        self.root_block_dirty = False
+        self.root_block = RootNode(self.read_block(0), self)
 
     def read_root_inode(self) -> None:
         if self.root_block is None:
@@ -30,36 +311,64 @@ class PYFS:
         
         logger.info('Reading root inode')
         self.root_inode = self.read_inode(1)
+        if not self.loaded_inodes.pinned[1]:
+            self.loaded_inodes.pin(1)
     
     def read_inode(self, addr : int, force_read=False) -> Inode:
-        logger.debug('Loading inode with addr %s', addr)
+        with self.lock:
+            inode = None if force_read else self.loaded_inodes.get(addr)
+        if inode is not None:
+            return inode
 
-        if addr not in self.loaded_inodes or force_read:
-            logger.debug('inode %s not loaded, reading from backing storage', addr)
-            self.block_dev.seek(addr * self.block_size, 0)
-            self.loaded_inodes[addr] = Inode(addr, self.block_dev.read(self.block_size), self)
+        data = self.read_block(addr)
 
-        return self.loaded_inodes[addr]
+        with self.lock:
+            # another thread may have loaded it while this one was reading
+            inode = None if force_read else self.loaded_inodes.live(addr)
+            if inode is not None:
+                return inode
+            return self.loaded_inodes.put(Inode(addr, data, self))
 
-    def create_fs(self) -> None:
+    def _check_writable(self) -> None:
+        if self.read_only:
+            raise ReadOnlyFilesystem()
+
+    def create_fs(self, block_size: int = DEFAULT_BLOCK_SIZE, blocks: int = None, preallocate: bool = False) -> None:
+        '''Format the device with block_size byte blocks, a power of two from MIN_BLOCK_SIZE to MAX_BLOCK_SIZE.
+
+        When blocks is given the device is grown to that many blocks up front,
+        sparsely or preallocated, instead of one block at a time as they are used.
+        '''
         logger.info("Creating filesytem...")
+        self._check_writable()
+        if not self.valid_block_size(block_size):
+            raise ValueError(f'Block size must be a power of two from {MIN_BLOCK_SIZE} to {MAX_BLOCK_SIZE}: {block_size}')
 
-        self.block_size = DEFAULT_BLOCK_SIZE
+        self.block_size = block_size
+        self.loaded_inodes.clear()
+        self.dentries.clear()
+        if blocks is not None:
+            self.resize_device(blocks, preallocate)
 
         # Write root block
         logger.debug('Writing Root Block...')
-        self.block_dev.seek(0, 0)
-        self.block_dev.write(self.block_size.to_bytes(2, byteorder=BYTE_ORDER))
-        self.block_dev.write(bytes(self.block_size-2))
+        self.root_block = RootNode(bytes(self.block_size), self)
+        self.root_block.block_size = self.block_size
+        self.allocator.format(2)
+        self.dedup.reset()
+        self.journal.addr = 0
+        self.root_block.save()
 
         # Write root inode
         logger.debug('Writing Root Inode...')
-        self.block_dev.seek(1 * self.block_size, 0)
-        tmp = Inode(1, bytes(self.block_size), self)
+        tmp = self.init_inode(1)
         tmp.is_dir = True
-        self.block_dev.write(tmp.full_inode_data)
+        tmp.save()
 
-        self.block_dev.flush()
+        if self.journal.enabled:
+            self.journal.create()
+
+        self.sync()
 
         logger.debug('Reading root Inode after creating filesystem...')
         self.read_root_inode()
@@ -67,47 +376,414 @@ class PYFS:
     def check_fs(self) -> bool:
         logger.debug("Reading root node block size")
 
-        self.block_dev.seek(0, 0)
-        self.block_size = int.from_bytes(self.block_dev.read(2), byteorder=BYTE_ORDER)
+        self.sync()
+        self.block_size = decode_block_size(int.from_bytes(self._device_read(0, 2), byteorder=BYTE_ORDER))
 
-        if self.block_size < DEFAULT_BLOCK_SIZE:
+        if not self.valid_block_size(self.block_size):
             logger.warning("Block size is not valid: %s", self.block_size)
             return False
         
         logger.info("Block size is %s", self.block_size)
 
+        self.dentries.clear()
+        self.read_root()
+        if self.read_only:
+            # nothing is replayed or allocated, the image is seen as of its last checkpoint
+            self.read_root_inode()
+            return True
+
+        if self.journal.load():
+            # replayed blocks may be newer than anything already loaded
+            self.loaded_inodes.clear()
+            self.read_root()
+
+        self.allocator.load()
+        self.dedup.load()
+        if self.journal.enabled and not self.journal.active:
+            self.journal.create()
         self.read_root_inode()
 
         return True
-    
-    def create_inode(self) -> Inode:
-        self.block_dev.seek(0, 2)
-        loc = self.block_dev.tell() // self.block_size
 
-        self.block_dev.write(bytes(self.block_size))
+    @staticmethod
+    def valid_block_size(block_size: int) -> bool:
+        return MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE and block_size & (block_size - 1) == 0
+
+    def device_blocks(self) -> int:
+        self.flush_writes()
+        return self._device_size() // self.block_size
+
+    def init_inode(self, addr: int) -> Inode:
+        '''Start an empty inode at addr, it is only written to the device when it is saved'''
+        with self.lock:
+            self.loaded_inodes.discard(addr)
+
+            data = self._mapped_new_block(addr) if self.use_mmap else None
+            if data is None:
+                data = bytes(self.block_size)
+
+            inode = Inode(addr, data, self)
+            inode.dirty = True
+            return self.loaded_inodes.put(inode)
+
+    def _mapped_new_block(self, addr: int) -> memoryview:
+        end = addr + 1
+        if self._device_size() < end * self.block_size:
+            # space past the end of the image is a hole and already reads as zeros
+            self.resize_device(end)
+            return self._mapped_block(addr)
+
+        view = self._mapped_block(addr)
+        if view is not None:
+            view[:] = bytes(self.block_size)
+        return view
+
+    def create_inode(self, near: int = None) -> Inode:
+        self._check_writable()
+        with self.lock:
+            inode = self.init_inode(self.allocator.allocate(near=near))
+            self.allocator.sync()
+            return inode
+
+    def free_inode_chain(self, addr: int) -> None:
+        '''Free the inode at addr and every inode linked from it through next_inode_addr'''
+        self._check_writable()
+        with self.lock:
+            while addr != 0:
+                inode = self.read_inode(addr)
+                next_addr = inode.next_inode_addr
 
-        self.loaded_inodes[loc] = Inode(loc, bytes(self.block_size), self)
-        return self.loaded_inodes[loc]
+                if inode.is_dir:
+                    self.dentries.invalidate_dir(addr)
+                if inode.has_extents:
+                    for start, length in ExtentMap.read_table(inode):
+                        self.allocator.free(start, length)
+                elif inode.is_compressed:
+                    for start, blocks, _ in CompressedMap.read_table(inode):
+                        if blocks:
+                            self.allocator.free(start, blocks)
+                elif inode.is_deduped:
+                    for block in DedupMap.read_table(inode):
+                        if block:
+                            self.dedup.release(block)
+
+                self.loaded_inodes.discard(addr)
+                self.allocator.free(addr)
+                addr = next_addr
+
+            self.allocator.sync()
+            self.dedup.sync()
     
     def save_all(self) -> None:
         logger.info('Saving all loaded inodes')
-        for addr, inode in self.loaded_inodes.items():
-            if inode.dirty:
-                logger.debug('inode %s is dirty', addr)
-                inode.save()
-
-        if self.root_block_dirty:
-            logger.info('Root block is dirty')
-            self.write_block(0, self.root_block)
-            
-    
+        with self.lock:
+            for inode in self.loaded_inodes.values():
+                if inode.dirty:
+                    inode.save()
+
+            if self.root_block is not None and self.root_block.dirty:
+                logger.info('Root block is dirty')
+                self.root_block.save()
+
+            self.sync()
+
+    def discard_changes(self) -> None:
+        '''Drop every block write not yet on the device and reload the cached state from it'''
+        logger.warning('Discarding changes not written to the device')
+        with self.lock:
+            for inode in self.loaded_inodes.values():
+                inode.dirty = False
+            self._pending = {}
+            self.loaded_inodes.clear()
+            self.dentries.clear()
+
+            self.read_root()
+            self.journal.load()
+            self.allocator.load()
+            self.dedup.load()
+            self.read_root_inode()
+
+    @contextmanager
+    def transaction(self):
+        '''Group the block writes made inside it into a single journal commit'''
+        # the journal has one open transaction at a time, so other threads wait for it
+        with self.lock, self.journal.transaction() as journal:
+            yield journal
+
+    def sync(self) -> None:
+        '''Write out any buffered blocks and flush the block device'''
+        with self.lock:
+            self.flush_writes()
+            if self.journal.active:
+                self.journal.commit()
+            self.flush_device()
+
+        if self._map is not None and not self.read_only:
+            self._map.flush()
+
+    def flush_writes(self) -> None:
+        if not self._pending:
+            return
+
+        logger.debug('Flushing %s buffered blocks', len(self._pending))
+        self.write_blocks(self._pending)
+        self._pending = {}
+
+    def write_blocks(self, blocks: dict) -> None:
+        '''Write {addr: data} straight to the block device, merging adjacent blocks into single writes'''
+        self._check_writable()
+        addrs = sorted(blocks)
+
+        start = 0
+        for idx in range(1, len(addrs) + 1):
+            if idx == len(addrs) or addrs[idx] != addrs[idx-1] + 1:
+                self._device_write(addrs[start] * self.block_size, b''.join(blocks[addr] for addr in addrs[start:idx]))
+                start = idx
+
     def write_block(self, addr : int, data : bytes) -> None:
-        logger.debug('Writing block %s to address %s', addr, addr * self.block_size)
-        self.block_dev.seek(addr * self.block_size, 0)
-        self.block_dev.write(data)
-        self.block_dev.flush()
+        self._check_writable()
+        if self.use_mmap:
+            view = self._mapped_block(addr)
+            if view is not None:
+                view[:] = data
+                return
+
+        if self.journal.active or self.write_back:
+            with self.lock:
+                if self.journal.active:
+                    self.journal.write(addr, data)
+                    return
+
+                self._pending[addr] = bytes(data)
+                if len(self._pending) >= self.write_back_blocks:
+                    self.flush_writes()
+                return
+
+        self._device_write(addr * self.block_size, data)
+        self.flush_device()
+
+    def write_run(self, addr: int, data) -> None:
+        '''Write whole blocks of data to consecutive addresses starting at addr'''
+        if self.use_mmap or self.journal.active or self.write_back:
+            view = memoryview(data)
+            for idx in range(len(data) // self.block_size):
+                self.write_block(addr + idx, view[idx*self.block_size:(idx+1)*self.block_size])
+            return
+
+        self._check_writable()
+        self._device_write(addr * self.block_size, data)
+        self.flush_device()
 
     def write_inode(self, inode: Inode) -> None:
-        logger.debug("Writing Inode %s", inode.addr)
         self.write_block(inode.addr, inode.full_inode_data)
         
+
+    def _lookup_entry(self, parent_addr: int, name: str):
+        with self.lock:
+            value = self.dentries.lookup(parent_addr, name)
+        if value is None:
+            entry = self.read_inode(parent_addr).find_entry(name)
+            if entry is None:
+                value = NEGATIVE
+            elif entry.is_inline:
+                value = INLINE
+            else:
+                value = (entry.addr, bool(entry.is_dir))
+            with self.lock:
+                self.dentries.add(parent_addr, name, value)
+        return value
+
+    def resolve(self, path, write: bool = False) -> Inode:
+        '''Return the Inode at an absolute path, raising FileNotFoundError if it does not exist
+        and InlineFile if it is a file stored in its directory entry.
+
+        With write every inode along the path is made private first, so the
+        returned inode can be changed without changing a clone or snapshot.'''
+        if self.root_inode is None:
+            self.read_root_inode()
+
+        if write:
+            return self._resolve_private(path)
+
+        if self.shared_index is not None:
+            found = self.shared_index.lookup(path)
+            if found is not None:
+                return self.read_inode(found[0])
+
+        # directories along the way are only read on a dentry cache miss
+        # .. goes back along the path, a shared inode has no single parent to follow
+        addr, is_dir = self.root_inode.addr, True
+        parents = []
+        inline = None
+        for name in PurePosixPath('/', path).parts[1:]:
+            if name == '.':
+                continue
+            if not is_dir:
+                raise NotADirectoryError(path)
+
+            if name == '..':
+                addr = parents.pop() if parents else addr
+                continue
+
+            parent = addr
+            parents.append(parent)
+            addr, is_dir = self._lookup_entry(parent, name)
+            if is_dir is None:
+                addr = 0
+                inline = InlineFile(parent, name)
+            elif addr == 0:
+                raise FileNotFoundError(path)
+
+        if addr == 0:
+            raise inline
+
+        return self.read_inode(addr)
+
+    def _resolve_private(self, path) -> Inode:
+        self._check_writable()
+        names = PurePosixPath('/', path).parts[1:]
+
+        inode = self.root_inode
+        parents = []
+        for idx, name in enumerate(names):
+            if name == '.':
+                continue
+            if not inode.is_dir:
+                raise NotADirectoryError(path)
+
+            if name == '..':
+                inode = parents.pop() if parents else inode
+                continue
+
+            entry = inode.find_entry(name)
+            if entry is None:
+                raise FileNotFoundError(path)
+            if entry.is_inline:
+                if any(rest != '.' for rest in names[idx+1:]):
+                    raise NotADirectoryError(path)
+                raise InlineFile(inode.addr, name)
+
+            parents.append(inode)
+            inode = unshare(inode, name)
+
+        return inode
+
+    def clone(self, src, dst) -> None:
+        '''Make dst a copy of the file or directory at src without copying anything.
+
+        dst references the inode of src, which is shared until either path is
+        changed and then copied one inode at a time along the changed path.
+        '''
+        self._check_writable()
+        src = PurePosixPath(posixpath.normpath(PurePosixPath('/', src)))
+        dst = PurePosixPath(posixpath.normpath(PurePosixPath('/', dst)))
+        if src == dst or src in dst.parents:
+            raise ValueError(f'Can not clone {src} into itself')
+
+        parent = self.resolve(dst.parent, write=True)
+        try:
+            inode = self.resolve(src)
+        except InlineFile as e:
+            parent.create_inline_entry(dst.name, self.read_inode(e.parent).find_entry(e.name).inline_data)
+            return
+        parent.link(dst.name, inode)
+
+    def snapshot(self, name: str) -> None:
+        '''Keep the current tree as /.snapshots/name.
+
+        The snapshot shares every entry of the root directory, so it costs one
+        directory now and a copy of each inode later changed on either side.
+        '''
+        self._check_writable()
+        if self.root_inode is None:
+            self.read_root_inode()
+
+        try:
+            self.root_inode.make_dir(SNAPSHOT_DIR)
+        except InodeEntryExists:
+            pass
+        snapshots = self.resolve(SNAPSHOT_DIR, write=True)
+
+        with self.root_inode.lock.read(), snapshots.lock.write():
+            snapshots.check_if_exists(name)
+            with self.transaction():
+                snapshots.make_dir(name)
+                snap = self.read_inode(snapshots.find_entry(name).addr)
+                for entry in self.root_inode.ls(show_hidden=True):
+                    if entry.name == SNAPSHOT_DIR:
+                        continue
+                    if entry.is_inline:
+                        snap.create_inline_entry(entry.name, entry.inline_data)
+                    else:
+                        snap.link(entry.name, self.read_inode(entry.addr))
+
+        logger.info('Took snapshot %s', name)
+
+    def snapshots(self) -> 'list[str]':
+        try:
+            return sorted(entry.name for entry in self.resolve(SNAPSHOT_DIR).ls())
+        except FileNotFoundError:
+            return []
+
+    def delete_snapshot(self, name: str) -> None:
+        self.remove_tree(PurePosixPath('/', SNAPSHOT_DIR, name))
+
+    def remove_tree(self, path) -> None:
+        '''Remove path and everything below it, a subtree still shared elsewhere only loses a reference'''
+        path = PurePosixPath('/', path)
+        if path.name == '':
+            raise ValueError('Can not remove the root directory')
+        self._remove_tree(self.resolve(path.parent, write=True), path.name)
+
+    def _remove_tree(self, parent: Inode, name: str) -> None:
+        entry = parent.find_entry(name)
+        if entry is None:
+            raise FileNotFoundError(name)
+
+        if entry.is_dir and not entry.is_inline:
+            child = self.read_inode(entry.addr)
+            if not child.shared:
+                for sub in child.ls(show_hidden=True):
+                    self._remove_tree(child, sub.name)
+        parent.unlink(name)
+
+    def compact(self, path='/', recursive: bool = False) -> int:
+        '''Pack the entries of the directory at path into the fewest blocks, with recursive
+        every directory below it as well. Returns the number of blocks freed'''
+        self._check_writable()
+        inode = self.resolve(path)
+        freed = compact_tree(inode) if recursive else compact_dir(inode)
+        logger.info('Compacting %s freed %s blocks', path, freed)
+        return freed
+
+    def stat(self, path) -> StatResult:
+        try:
+            inode = self.resolve(path)
+        except InlineFile as e:
+            return StatResult(0, False, len(self.read_inode(e.parent).find_entry(e.name).inline_data), e.parent)
+        return StatResult(inode.addr, inode.is_dir, 0 if inode.is_dir else inode.file_size, inode.parent_inode_addr)
+
+    def open(self, path, mode: str = 'rb') -> PYFSFile:
+        if mode not in PYFSFile.MODES:
+            raise ValueError(f'Invalid mode: {mode}')
+        if mode != 'rb':
+            self._check_writable()
+
+        path = PurePosixPath('/') / path
+
+        try:
+            inode = self.resolve(path, write=mode != 'rb')
+        except InlineFile as e:
+            return PYFSFile(None, mode, parent=self.read_inode(e.parent), name=e.name)
+        except FileNotFoundError:
+            if mode in ('rb', 'r+b'):
+                raise
+
+            parent = self.resolve(path.parent, write=True)
+            parent.make_file(path.name)
+            entry = parent.find_entry(path.name)
+            if entry.is_inline:
+                return PYFSFile(None, mode, parent=parent, name=path.name)
+            inode = self.read_inode(entry.addr)
+
+        return PYFSFile(inode, mode)
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import logging
+import pyfs #pylint: disable=unused-import
+
+from .node import Node
+
+logger = logging.getLogger("pyfs.node")
+
+def encode_block_size(block_size: int) -> int:
+    # 64 KB and up do not fit the 2 byte field and are stored as their log2
+    return block_size if block_size < 1 << 16 else block_size.bit_length() - 1
+
+def decode_block_size(value: int) -> int:
+    return 1 << value if 0 < value < 32 else value
+
+class RootNode(Node):
+    '''Block 0 of the filesystem.
+
+    The block size is stored in the first two bytes, which is where check_fs
+    has always read it from. Sizes that do not fit are stored as their log2,
+    which no valid block size is equal to.
+    '''
+    def __init__(self, data: bytes, fs: 'pyfs.PYFS'):
+        super().__init__(0, data, fs)
+
+    @property
+    def block_size(self) -> int:
+        return decode_block_size(self.get_meta_bytes(0, 2))
+
+    @block_size.setter
+    def block_size(self, value: int):
+        self.set_meta_bytes(encode_block_size(value), 0, 2)
+
+    @property
+    def end_page(self) -> int:
+        return self.get_meta_bytes(4, 4)
+
+    @end_page.setter
+    def end_page(self, value: int):
+        self.set_meta_bytes(value, 4, 4)
+
+    @property
+    def bitmap_addr(self) -> int:
+        return self.get_meta_bytes(8, 4)
+
+    @bitmap_addr.setter
+    def bitmap_addr(self, value: int):
+        self.set_meta_bytes(value, 8, 4)
+
+    @property
+    def journal_addr(self) -> int:
+        return self.get_meta_bytes(12, 4)
+
+    @journal_addr.setter
+    def journal_addr(self, value: int):
+        self.set_meta_bytes(value, 12, 4)
+
+    @property
+    def journal_blocks(self) -> int:
+        return self.get_meta_bytes(16, 4)
+
+    @journal_blocks.setter
+    def journal_blocks(self, value: int):
+        self.set_meta_bytes(value, 16, 4)
+
+    @property
+    def dedup_addr(self) -> int:
+        return self.get_meta_bytes(20, 4)
+
+    @dedup_addr.setter
+    def dedup_addr(self, value: int):
+        self.set_meta_bytes(value, 20, 4)
+
+    @property
+    def full_block_data(self) -> bytes:
+        return self._data
+
+    def save(self):
+        self.fs.write_block(0, self._data)
+        self.dirty = False
+
+    def __repr__(self) -> str:
+        return f"RootNode: block_size: {self.block_size} end_page: {self.end_page} bitmap: {self.bitmap_addr}"
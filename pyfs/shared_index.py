@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+from collections import deque
+import hashlib
+import logging
+from multiprocessing import shared_memory
+from pathlib import PurePosixPath
+import struct
+import pyfs #pylint: disable=unused-import
+
+logger = logging.getLogger("pyfs.shared_index")
+
+INDEX_MAGIC = b'PYFSPIDX'
+
+# magic, number of slots, number of used slots
+HEADER_STRUCT = struct.Struct('>8sII')
+# digest of the path, inode addr, is_dir
+SLOT_STRUCT = struct.Struct('>16sIB3x')
+
+class SharedPathIndex:
+    '''Read only path -> (addr, is_dir) table in shared memory.
+
+    The table is an open addressing hash table keyed by a 128 bit digest of
+    the absolute path, so it has no pointers and any process can probe it in
+    place after attaching by name. A slot with addr 0 is empty as address 0
+    is never a valid inode. It is built once from a mounted image and only
+    stays valid while that image is not modified. Inline files are left
+    out and found through their directory.
+    '''
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self.shm = shm
+        self.owner = owner
+        self._buf = shm.buf
+
+        magic, self.slots, self.used = HEADER_STRUCT.unpack_from(self._buf, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f'Shared memory {shm.name} does not hold a path index')
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @classmethod
+    def create(cls, entries: int, name: str = None) -> SharedPathIndex:
+        # keep the load factor at or below a half so probe sequences stay short
+        slots = 16
+        while slots < entries * 2:
+            slots *= 2
+
+        shm = shared_memory.SharedMemory(name=name, create=True, size=HEADER_STRUCT.size + slots * SLOT_STRUCT.size)
+        shm.buf[:] = bytes(shm.size)
+        HEADER_STRUCT.pack_into(shm.buf, 0, INDEX_MAGIC, slots, 0)
+        return cls(shm, True)
+
+    @classmethod
+    def attach(cls, name: str) -> SharedPathIndex:
+        return cls(shared_memory.SharedMemory(name=name), False)
+
+    @classmethod
+    def build(cls, fs: 'pyfs.PYFS', name: str = None) -> SharedPathIndex:
+        '''Walk every directory reachable from the root inode and index every path'''
+        if fs.root_inode is None:
+            fs.read_root_inode()
+
+        paths = [('/', fs.root_inode.addr, True)]
+        queue = deque([('/', fs.root_inode)])
+        while queue:
+            path, inode = queue.popleft()
+            for entry in inode.ls():
+                # inline files have no inode to point at, they are resolved through their directory
+                if entry.is_inline:
+                    continue
+                child = f'{path.rstrip("/")}/{entry.name}'
+                paths.append((child, entry.addr, bool(entry.is_dir)))
+                if entry.is_dir:
+                    queue.append((child, fs.read_inode(entry.addr)))
+
+        index = cls.create(len(paths), name)
+        for path, addr, is_dir in paths:
+            index.add(path, addr, is_dir)
+
+        logger.info('Indexed %s paths in shared memory %s', len(paths), index.name)
+        return index
+
+    @staticmethod
+    def _key(path) -> bytes:
+        return hashlib.blake2b(str(PurePosixPath('/', path)).encode(), digest_size=16).digest()
+
+    def _probe(self, key: bytes):
+        slot = int.from_bytes(key[:8], 'big') & (self.slots - 1)
+        while True:
+            offset = HEADER_STRUCT.size + slot * SLOT_STRUCT.size
+            digest, addr, is_dir = SLOT_STRUCT.unpack_from(self._buf, offset)
+            if addr == 0 or digest == key:
+                return offset, addr, is_dir
+            slot = (slot + 1) & (self.slots - 1)
+
+    def add(self, path, addr: int, is_dir: bool) -> None:
+        key = self._key(path)
+        offset, old, _ = self._probe(key)
+        if old == 0:
+            if (self.used + 1) * 2 > self.slots:
+                raise ValueError('Shared path index is full')
+            self.used += 1
+            HEADER_STRUCT.pack_into(self._buf, 0, INDEX_MAGIC, self.slots, self.used)
+
+        SLOT_STRUCT.pack_into(self._buf, offset, key, addr, is_dir)
+
+    def lookup(self, path):
+        '''Returns (addr, is_dir) or None when the path is not indexed'''
+        _, addr, is_dir = self._probe(self._key(path))
+        if addr == 0:
+            return None
+        return addr, bool(is_dir)
+
+    def close(self) -> None:
+        self._buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __len__(self) -> int:
+        return self.used
+
+    def __enter__(self) -> SharedPathIndex:
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __repr__(self) -> str:
+        return f"SharedPathIndex name: {self.name} slots: {self.slots} used: {self.used}"
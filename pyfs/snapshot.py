@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import logging
+import pyfs #pylint: disable=unused-import
+
+from .compression import CHUNK_STRUCT
+from .dedup import BLOCK_STRUCT
+from .extents import EXTENT_STRUCT, load_table, save_table
+
+logger = logging.getLogger("pyfs.snapshot")
+
+# directory under the root holding the snapshots, it is left out of new snapshots
+SNAPSHOT_DIR = '.snapshots'
+
+def copy_run(fs: 'pyfs.PYFS', start: int, count: int) -> int:
+    '''Copy count raw blocks from start to a newly allocated run and return its first block'''
+    addr = fs.allocator.allocate(count, near=start)
+    fs.write_run(addr, fs.read_blocks(start, count))
+    return addr
+
+def copy_inode(inode: 'pyfs.Inode', parent_addr: int) -> 'pyfs.Inode':
+    '''Make a private copy of a shared inode and everything it owns.
+
+    The inode chain is copied block by block. The entries of a copied
+    directory are shared with the original by counting one more reference to
+    every child, so copying a directory costs one directory and not a tree.
+    Raw data runs of extent and compressed files are copied, the data blocks
+    of a deduplicated file are ref counted and only gain a reference.
+    '''
+    fs = inode.fs
+    blocks = []
+    addr = inode.addr
+    while addr != 0:
+        block = fs.read_inode(addr)
+        blocks.append(block)
+        addr = block.next_inode_addr
+
+    start = fs.allocator.allocate(len(blocks), near=parent_addr)
+    for idx, block in enumerate(blocks):
+        tmp = fs.init_inode(start + idx)
+        tmp.full_inode_data[:] = block.full_inode_data
+        tmp.parent_inode_addr = parent_addr if idx == 0 else start + idx - 1
+        tmp.next_inode_addr = start + idx + 1 if idx + 1 < len(blocks) else 0
+        tmp.ref_count = 0
+        tmp.save()
+
+    copy = fs.read_inode(start)
+    logger.debug('Copied shared inode %s of %s blocks to %s', inode.addr, len(blocks), copy.addr)
+
+    if copy.is_dir:
+        for entry in copy.ls(show_hidden=True):
+            if entry.is_inline:
+                continue
+            child = fs.read_inode(entry.addr)
+            child.ref_count = max(child.ref_count, 1) + 1
+            child.save()
+    elif copy.has_extents:
+        table = [(copy_run(fs, run, length), length) for run, length in load_table(copy, EXTENT_STRUCT)]
+        save_table(copy, EXTENT_STRUCT, table)
+    elif copy.is_compressed:
+        table = [(copy_run(fs, run, count) if count else 0, count, stored)
+                 for run, count, stored in load_table(copy, CHUNK_STRUCT)]
+        save_table(copy, CHUNK_STRUCT, table)
+    elif copy.is_deduped:
+        table = [(fs.dedup.share(block) if block else 0,) for block, in load_table(copy, BLOCK_STRUCT)]
+        save_table(copy, BLOCK_STRUCT, table)
+        fs.dedup.sync()
+
+    fs.allocator.sync()
+    return copy
+
+def unshare(parent: 'pyfs.Inode', name: str) -> 'pyfs.Inode':
+    '''Return the inode of entry name in the private directory parent, copying it first if it is shared'''
+    fs = parent.fs
+    with parent.lock.write(), fs.transaction():
+        entry = parent.find_entry(name)
+        inode = fs.read_inode(entry.addr)
+        if not inode.shared:
+            return inode
+
+        copy = copy_inode(inode, parent.addr)
+        parent.repoint_entry(name, copy.addr)
+
+        inode.ref_count -= 1
+        if inode.parent_inode_addr == parent.addr:
+            inode.parent_inode_addr = 0
+        inode.save()
+        return copy
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import functools
+import logging
+import os
+
+logger = logging.getLogger("pyfs.sparse")
+
+# from linux/falloc.h
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+
+@functools.lru_cache(maxsize=None)
+def _libc_fallocate():
+    '''fallocate(2) from the C library, or None where it does not exist'''
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        func = getattr(libc, 'fallocate64', None) or libc.fallocate
+    except (OSError, AttributeError, TypeError):
+        return None
+
+    func.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64)
+    func.restype = ctypes.c_int
+    return func
+
+def grow(fd: int, size: int) -> None:
+    '''Extend the file to size bytes without writing, the new space is a hole that reads as zeros'''
+    if os.fstat(fd).st_size < size:
+        os.ftruncate(fd, size)
+
+def preallocate(fd: int, size: int) -> bool:
+    '''Reserve disk space for the first size bytes of the file, growing it if needed.
+
+    Returns False when the platform or filesystem can not preallocate, the file
+    is then only grown sparsely.
+    '''
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return True
+        except OSError as e:
+            logger.info('posix_fallocate is not supported here: %s', e)
+
+    grow(fd, size)
+    return False
+
+def punch_hole(fd: int, offset: int, length: int) -> bool:
+    '''Release the disk space of a byte range, which then reads as zeros. Returns False when not supported'''
+    func = _libc_fallocate()
+    if func is None:
+        return False
+
+    if func(fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, offset, length) != 0:
+        logger.info('Hole punching is not supported here: %s', os.strerror(ctypes.get_errno()))
+        return False
+    return True
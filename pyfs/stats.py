@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+class Histogram:
+    '''Latency histogram with power of two buckets in microseconds.
+
+    Bucket i counts samples under 2**i microseconds that did not fit in the
+    bucket before it, the last bucket takes everything slower.
+    '''
+    __slots__ = ('counts', 'total', 'max')
+
+    BUCKETS = 32
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.counts[min(int(seconds * 1000000).bit_length(), self.BUCKETS - 1)] += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def to_dict(self) -> dict:
+        count = sum(self.counts)
+        return {'count': count,
+                'total': self.total,
+                'mean': self.total / count if count else 0.0,
+                'max': self.max,
+                'buckets_us': {1 << idx: value for idx, value in enumerate(self.counts) if value},
+               }
+
+class IOStats:
+    '''Counters and latency histograms of the I/O a PYFS issues to its block device'''
+    OPS = ('read', 'write', 'flush')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.ops = dict.fromkeys(self.OPS, 0)
+        self.bytes = dict.fromkeys(self.OPS, 0)
+        self.latency = {op: Histogram() for op in self.OPS}
+
+    def record(self, op: str, size: int, seconds: float) -> None:
+        self.ops[op] += 1
+        self.bytes[op] += size
+        self.latency[op].add(seconds)
+
+    def to_dict(self, block_size: int) -> dict:
+        return {'reads': self.ops['read'],
+                'writes': self.ops['write'],
+                'flushes': self.ops['flush'],
+                'bytes_read': self.bytes['read'],
+                'bytes_written': self.bytes['write'],
+                'blocks_read': self.bytes['read'] // block_size,
+                'blocks_written': self.bytes['write'] // block_size,
+                'latency': {op: histogram.to_dict() for op, histogram in self.latency.items()},
+               }
@@ -0,0 +1,101 @@
+import unittest
+import io
+import logging
+
+from pyfs import PYFS, InodeEntryNotFound, DirectoryNotEmpty
+from pyfs.constants import DEFAULT_BLOCK_SIZE, INODE_META_SIZE
+
+from tests.test_common import log_test_case
+
+logging.basicConfig(filename="test_pyfs.log", level=logging.WARNING)
+
+class TestBlockAllocator(unittest.TestCase):
+    @log_test_case
+    def setUp(self):
+        self.fs = io.BytesIO()
+        self.pyfs = PYFS(self.fs)
+        self.pyfs.create_fs()
+        self.allocator = self.pyfs.allocator
+
+    @log_test_case
+    def test_allocate_and_free(self):
+        addrs = [self.allocator.allocate() for _ in range(6)]
+        self.assertEqual(len(set(addrs)), 6)
+        self.assertTrue(all(self.allocator.is_allocated(a) for a in addrs))
+
+        self.allocator.free(addrs[1])
+        self.allocator.free(addrs[3])
+        self.assertFalse(self.allocator.is_allocated(addrs[1]))
+
+        #first free block after the hint is handed out
+        self.assertEqual(self.allocator.allocate(near=addrs[2]), addrs[3])
+        self.assertEqual(self.allocator.allocate(near=addrs[2]), addrs[1])
+
+        self.assertRaises(ValueError, self.allocator.free, addrs[1] + 100)
+        self.assertRaises(ValueError, self.allocator.free, 1)
+
+    @log_test_case
+    def test_contiguous_run(self):
+        addrs = [self.allocator.allocate() for _ in range(20)]
+        for addr in addrs[2:4] + addrs[6:12]:
+            self.allocator.free(addr)
+
+        self.assertEqual(self.allocator.allocate(4), addrs[6])
+        self.assertEqual(self.allocator.allocate(3), self.allocator.end_page - 3)
+
+    @log_test_case
+    def test_persisted(self):
+        addrs = [self.pyfs.create_inode().addr for _ in range(40)]
+        for addr in addrs[::3]:
+            self.pyfs.free_inode_chain(addr)
+
+        new_fs = PYFS(self.fs)
+        self.assertTrue(new_fs.check_fs())
+        self.assertEqual(new_fs.allocator.end_page, self.allocator.end_page)
+        self.assertEqual(new_fs.allocator.bitmap, self.allocator.bitmap)
+        self.assertEqual(new_fs.create_inode().addr, addrs[0])
+
+    @log_test_case
+    def test_image_without_bitmap(self):
+        self.pyfs.root_inode.make_dir('etc')
+        self.fs.seek(8, 0)
+        self.fs.write(bytes(4))
+
+        new_fs = PYFS(self.fs)
+        self.assertTrue(new_fs.check_fs())
+        for addr in range(self.fs.getbuffer().nbytes // DEFAULT_BLOCK_SIZE):
+            self.assertTrue(new_fs.allocator.is_allocated(addr))
+        self.assertEqual([a.name for a in new_fs.root_inode.ls()], ['etc'])
+
+    @log_test_case
+    def test_unlink_reuses_blocks(self):
+        root = self.pyfs.root_inode
+        with self.pyfs.open('/big', 'wb') as f:
+            f.write(bytes(5 * (DEFAULT_BLOCK_SIZE - INODE_META_SIZE)))
+        end_page = self.allocator.end_page
+
+        root.unlink('big')
+        self.assertIsNone(root.find_entry('big'))
+        self.assertEqual(self.allocator.free_count(), 5)
+
+        with self.pyfs.open('/big2', 'wb') as f:
+            f.write(bytes(5 * (DEFAULT_BLOCK_SIZE - INODE_META_SIZE)))
+        self.assertEqual(self.allocator.end_page, end_page)
+
+        with self.pyfs.open('/big2', 'wb') as f:
+            f.write(b'small')
+        self.assertEqual(self.allocator.free_count(), 4)
+
+    @log_test_case
+    def test_unlink_errors(self):
+        root = self.pyfs.root_inode
+        root.make_dir('etc')
+        self.pyfs.read_inode(root.find_entry('etc').addr).make_file('passwd')
+
+        self.assertRaises(InodeEntryNotFound, root.unlink, 'missing')
+        self.assertRaises(DirectoryNotEmpty, root.unlink, 'etc')
+
+        etc = self.pyfs.read_inode(root.find_entry('etc').addr)
+        etc.unlink('passwd')
+        root.unlink('etc')
+        self.assertEqual(root.ls(), [])
@@ -0,0 +1,62 @@
+import asyncio
+import unittest
+import io
+import logging
+
+from pyfs import PYFS, AsyncPYFS
+
+from tests.test_common import log_test_case, set_up_test_directories
+
+logging.basicConfig(filename="test_pyfs.log", level=logging.WARNING)
+
+class TestAsyncPYFS(unittest.IsolatedAsyncioTestCase):
+    @log_test_case
+    def setUp(self):
+        self.fs = io.BytesIO()
+        self.pyfs = PYFS(self.fs)
+        self.pyfs.create_fs()
+        set_up_test_directories(self.pyfs)
+        self.afs = AsyncPYFS(self.pyfs)
+
+    async def asyncTearDown(self):
+        await self.afs.close()
+
+    async def test_operations(self):
+        await self.afs.mkdir('/etc/ssh')
+        self.assertEqual(await self.afs.write('/etc/ssh/config', b'x' * 10000), 10000)
+        await self.afs.write('/etc/ssh/config', b'abc', offset=2)
+
+        self.assertEqual(await self.afs.read('/etc/ssh/config', 5), b'xxabc')
+        self.assertEqual(len(await self.afs.read('/etc/ssh/config')), 10000)
+        self.assertEqual([a.name for a in await self.afs.ls('/etc/ssh')], ['config'])
+        self.assertEqual((await self.afs.stat('/etc/ssh/config')).size, 10000)
+
+        with self.assertRaises(FileNotFoundError):
+            await self.afs.read('/etc/missing')
+
+        #inodes are shared with the sync api
+        self.assertIs(await self.afs.resolve('/etc/ssh'), self.pyfs.resolve('/etc/ssh'))
+
+    async def test_changes_after_snapshot(self):
+        self.pyfs.snapshot('before')
+
+        await self.afs.mkdir('/etc/new')
+        await self.afs.write('/home/nkroft/notes', b'written')
+        await self.afs.write('/home/nkroft/notes', b'W', offset=0)
+
+        self.assertEqual(await self.afs.read('/home/nkroft/notes'), b'Written')
+        self.assertEqual([a.name for a in await self.afs.ls('/.snapshots/before/home/nkroft')], [])
+        with self.assertRaises(FileNotFoundError):
+            await self.afs.resolve('/.snapshots/before/etc/new')
+
+    async def test_concurrent_reads_share_io(self):
+        addr = self.pyfs.resolve('/home').addr
+        self.pyfs.loaded_inodes.discard(addr)
+        self.pyfs.reset_stats()
+
+        inodes = await asyncio.gather(*[self.afs.read_inode(addr) for _ in range(10)])
+        self.assertEqual(self.pyfs.stats()['io']['reads'], 1)
+        self.assertTrue(all(inode is inodes[0] for inode in inodes))
+
+        paths = await asyncio.gather(*[self.afs.resolve('/home/nkroft') for _ in range(10)])
+        self.assertTrue(all(inode is paths[0] for inode in paths))
@@ -0,0 +1,48 @@
+import unittest
+import io
+import json
+import logging
+import os
+import tempfile
+from contextlib import redirect_stdout, redirect_stderr
+
+from benchmarks.bench_pyfs import BENCHMARKS, compare, main, run_benchmark
+
+logging.basicConfig(filename="test_pyfs.log", level=logging.WARNING)
+
+class TestBenchmarks(unittest.TestCase):
+    def test_every_benchmark_runs(self):
+        for name in BENCHMARKS:
+            result = run_benchmark(name, 'bytesio', repeat=1)
+            self.assertEqual(result['name'], name)
+            self.assertGreater(result['ops'], 0)
+            self.assertGreater(result['seconds'], 0)
+
+    def test_output_and_compare(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'results.json')
+            with redirect_stdout(io.StringIO()) as out:
+                self.assertEqual(main(['find_entry_large_dir', '--backend', 'disk', '--repeat', '1', '--output', output]), 0)
+            self.assertEqual(json.loads(out.getvalue())['backend'], 'disk')
+
+            with open(output) as f:
+                baseline = json.load(f)
+            baseline[0]['seconds'] /= 100
+            with open(output, 'w') as f:
+                json.dump(baseline, f)
+
+            with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()) as err:
+                self.assertEqual(main(['find_entry_large_dir', '--backend', 'disk', '--repeat', '1', '--compare', output]), 1)
+            self.assertIn('REGRESSION find_entry_large_dir', err.getvalue())
+
+    def test_compare_matches_options(self):
+        result = {'name': 'read', 'backend': 'bytesio', 'scale': 1, 'options': {'journal': True}, 'seconds': 2.0}
+        baseline = [dict(result, options={'journal': False}, seconds=1.0)]
+
+        #a run with other options has no baseline and is not a regression
+        with redirect_stderr(io.StringIO()) as err:
+            self.assertEqual(compare([result], baseline, 0.2), [])
+        self.assertIn('NO BASELINE read', err.getvalue())
+
+        baseline.append(dict(result, seconds=1.0))
+        self.assertEqual(compare([result], baseline, 0.2), [('read', 'bytesio', 1.0, 2.0)])
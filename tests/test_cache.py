@@ -0,0 +1,104 @@
+import unittest
+import io
+import logging
+
+from pyfs import PYFS
+from pyfs.constants import DEFAULT_BLOCK_SIZE
+
+from tests.test_common import log_test_case, set_up_test_directories
+
+logging.basicConfig(filename="test_pyfs.log", level=logging.WARNING)
+
+class TestBlockCache(unittest.TestCase):
+    @log_test_case
+    def setUp(self):
+        self.fs = io.BytesIO()
+        self.pyfs = PYFS(self.fs, cache_entries=4)
+        self.pyfs.create_fs()
+        self.cache = self.pyfs.loaded_inodes
+
+    @log_test_case
+    def test_lru_eviction(self):
+        inodes = [self.pyfs.create_inode() for _ in range(3)]
+        self.assertEqual(len(self.cache), 4)
+        self.assertIn(1, self.cache)
+
+        #root and bitmap inodes are pinned so the oldest created inode is evicted
+        self.assertNotIn(inodes[0].addr, self.cache)
+        self.assertEqual(self.cache.evictions, 1)
+
+        #touch inodes[1] so inodes[2] becomes the least recently used
+        self.pyfs.read_inode(inodes[1].addr)
+        self.pyfs.create_inode()
+        self.assertIn(inodes[1].addr, self.cache)
+        self.assertNotIn(inodes[2].addr, self.cache)
+
+    @log_test_case
+    def test_write_back_on_eviction(self):
+        inode = self.pyfs.create_inode()
+        inode.data = b'written back'
+        self.assertTrue(inode.dirty)
+
+        for _ in range(4):
+            self.pyfs.create_inode()
+        self.assertNotIn(inode.addr, self.cache)
+
+        self.assertEqual(self.pyfs.read_inode(inode.addr).data, b'written back')
+
+    @log_test_case
+    def test_counters(self):
+        #root and bitmap inodes are pinned, leaving room for two more
+        addrs = [self.pyfs.create_inode().addr for _ in range(3)]
+        self.cache.reset_stats()
+
+        self.pyfs.read_inode(addrs[2])
+        self.pyfs.read_inode(addrs[0])
+
+        stats = self.cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['entries'], 4)
+        self.assertEqual(stats['bytes'], 4 * DEFAULT_BLOCK_SIZE)
+        self.assertNotIn(addrs[1], self.cache)
+
+    @log_test_case
+    def test_byte_limit(self):
+        pyfs = PYFS(io.BytesIO(), cache_entries=None, cache_bytes=3 * DEFAULT_BLOCK_SIZE)
+        pyfs.create_fs()
+        for _ in range(10):
+            pyfs.create_inode()
+        self.assertEqual(pyfs.loaded_inodes.size_bytes, 3 * DEFAULT_BLOCK_SIZE)
+
+    @log_test_case
+    def test_directories_survive_small_cache(self):
+        set_up_test_directories(self.pyfs)
+
+        bin_inode = self.pyfs.read_inode(self.pyfs.root_inode.find_entry('bin').addr)
+        self.assertCountEqual([a.name for a in bin_inode.ls()], [f'tst{idx}' for idx in range(33)])
+
+        new_fs = PYFS(self.fs)
+        self.assertTrue(new_fs.check_fs())
+        self.assertCountEqual([a.name for a in new_fs.root_inode.ls()], ['etc', 'bin', 'home'])
+
+    @log_test_case
+    def test_held_inode_stays_single(self):
+        pyfs = PYFS(self.fs, cache_entries=8)
+        pyfs.create_fs()
+        pyfs.root_inode.make_dir('a')
+        held = pyfs.resolve('/a')
+
+        #push the held inode out of the cache
+        for _ in range(20):
+            pyfs.create_inode()
+        self.assertNotIn(held.addr, pyfs.loaded_inodes)
+
+        again = pyfs.resolve('/a')
+        self.assertIs(again, held)
+        held.make_dir('late1')
+        again.make_dir('late2')
+        pyfs.save_all()
+
+        new_fs = PYFS(self.fs)
+        self.assertTrue(new_fs.check_fs())
+        self.assertCountEqual([a.name for a in new_fs.resolve('/a').ls()], ['late1', 'late2'])
@@ -1,7 +1,32 @@
+from collections import Counter
+import io
 import logging
 
 from pyfs import PYFS, InodeEntryExists, Inode
 
+class CountingBytesIO(io.BytesIO):
+    '''In-memory block device counting the read and write calls made on it.
+
+    Given a block size it also counts how often every block was written.
+    '''
+    def __init__(self, initial=b'', block_size: int = None):
+        super().__init__(initial)
+        self.block_size = block_size
+        self.reads = 0
+        self.writes = 0
+        self.block_writes = Counter()
+
+    def read(self, *args):
+        self.reads += 1
+        return super().read(*args)
+
+    def write(self, data):
+        self.writes += 1
+        if self.block_size:
+            start = self.tell() // self.block_size
+            self.block_writes.update(range(start, start + len(data) // self.block_size))
+        return super().write(data)
+
 def create_dir_if_not_exists(inode: Inode, name):
     try:
         inode.make_dir(name)
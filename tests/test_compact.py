@@ -0,0 +1,87 @@
+import unittest
+import logging
+import io
+
+from pyfs import PYFS
+
+from tests.test_common import log_test_case, set_up_test_directories
+
+logging.basicConfig(filename="test_pyfs.log", level=logging.WARNING)
+
+class TestPYFSCompact(unittest.TestCase):
+    @log_test_case
+    def setUp(self):
+        self.fs = io.BytesIO()
+        self.pyfs = PYFS(self.fs)
+        self.pyfs.create_fs()
+        set_up_test_directories(self.pyfs)
+
+        #grow /home/big to 4 blocks while other directories take the blocks next to it
+        home = self.pyfs.resolve('/home')
+        home.make_dir('big')
+        self.big = self.pyfs.resolve('/home/big')
+        for idx in range(100):
+            self.big.make_file(f'f{idx}')
+            if idx % 31 == 0:
+                home.make_dir(f'other{idx}')
+
+    def chain(self, inode) -> list:
+        return inode.index.blocks
+
+    @log_test_case
+    def test_compact_dir(self):
+        for idx in range(100):
+            if idx % 10:
+                self.big.unlink(f'f{idx}')
+        self.assertEqual(len(self.chain(self.big)), 4)
+
+        used = self.pyfs.allocator.free_count()
+        self.assertEqual(self.pyfs.compact('/home/big'), 3)
+        self.assertEqual(self.pyfs.allocator.free_count(), used + 3)
+
+        self.assertEqual(self.chain(self.big), [self.big.addr])
+        self.assertEqual([entry.name for entry in self.big.ls()], [f'f{idx}' for idx in range(0, 100, 10)])
+        self.assertEqual(self.pyfs.resolve('/home/big/f90').parent_inode_addr, self.big.addr)
+
+        #nothing left to do the second time
+        self.assertEqual(self.pyfs.compact('/home/big'), 0)
+
+        self.pyfs.save_all()
+        new_fs = PYFS(self.fs)
+        self.assertTrue(new_fs.check_fs())
+        self.assertEqual(len(new_fs.resolve('/home/big').ls()), 10)
+
+    @log_test_case
+    def test_continuation_blocks_relocated(self):
+        for idx in range(0, 100, 2):
+            self.big.unlink(f'f{idx}')
+        chain = self.chain(self.big)
+        self.assertNotEqual(chain[1:], list(range(chain[1], chain[1] + len(chain) - 1)))
+
+        self.pyfs.compact('/home/big')
+        chain = self.chain(self.big)
+        self.assertEqual(len(chain), 2)
+        self.assertEqual(self.pyfs.read_inode(chain[1]).parent_inode_addr, self.big.addr)
+        self.assertEqual(len(self.big.ls()), 50)
+
+        #new entries go after the packed ones
+        self.big.make_file('new')
+        self.assertEqual(self.big.ls()[-1].name, 'new')
+        self.assertIsNotNone(self.pyfs.resolve('/home/big/f99'))
+
+    @log_test_case
+    def test_compact_tree(self):
+        for idx in range(100):
+            self.big.unlink(f'f{idx}')
+        bin_inode = self.pyfs.resolve('/bin')
+        for idx in range(33):
+            bin_inode.unlink(f'tst{idx}')
+
+        self.assertEqual(self.pyfs.compact('/', recursive=True), 3 + 1)
+        self.assertEqual(self.chain(self.big), [self.big.addr])
+        self.assertEqual(self.chain(bin_inode), [bin_inode.addr])
+        self.assertEqual(self.pyfs.compact('/', recursive=True), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,472 @@
+import unittest
+import io
+import logging
+
+from pyfs import PYFS
+from pyfs.constants import DEFAULT_BLOCK_SIZE, INODE_META_SIZE
+
+from tests.test_common import log_test_case
+
+logging.basicConfig(filename="test_pyfs.log", level=logging.WARNING)
+
+CAPACITY = DEFAULT_BLOCK_SIZE - INODE_META_SIZE
+
+class TestPYFSFile(unittest.TestCase):
+    @log_test_case
+    def setUp(self):
+        self.fs = io.BytesIO()
+        self.pyfs = PYFS(self.fs)
+        self.pyfs.create_fs()
+        self.payload = bytes(i % 251 for i in range(CAPACITY * 5 + 17))
+
+    @log_test_case
+    def test_write_read_large_file(self):
+        with self.pyfs.open('/big', 'wb') as f:
+            self.assertEqual(f.write(self.payload), len(self.payload))
+            self.assertEqual(f.tell(), len(self.payload))
+
+        with self.pyfs.open('/big', 'rb') as f:
+            self.assertEqual(f.read(), self.payload)
+
+        #reload from the backing storage with a fresh filesystem
+        new_fs = PYFS(self.fs)
+        self.assertTrue(new_fs.check_fs())
+        with new_fs.open('big', 'rb') as f:
+            self.assertEqual(f.read(), self.payload)
+
+    @log_test_case
+    def test_chunked_write_and_seek(self):
+        with self.pyfs.open('/big', 'wb') as f:
+            for idx in range(0, len(self.payload), 1000):
+                f.write(self.payload[idx:idx+1000])
+
+        with self.pyfs.open('/big', 'rb') as f:
+            f.seek(CAPACITY * 3 - 5)
+            self.assertEqual(f.read(10), self.payload[CAPACITY*3-5:CAPACITY*3+5])
+            self.assertEqual(f.seek(-7, io.SEEK_END), len(self.payload) - 7)
+            self.assertEqual(f.read(), self.payload[-7:])
+
+            f.seek(10)
+            buf = bytearray(CAPACITY)
+            self.assertEqual(f.readinto(buf), CAPACITY)
+            self.assertEqual(bytes(buf), self.payload[10:10+CAPACITY])
+
+    @log_test_case
+    def test_append_and_overwrite(self):
+        with self.pyfs.open('/big', 'wb') as f:
+            f.write(self.payload[:CAPACITY + 3])
+        with self.pyfs.open('/big', 'ab') as f:
+            f.write(self.payload[CAPACITY + 3:])
+        with self.pyfs.open('/big', 'r+b') as f:
+            f.seek(CAPACITY - 2)
+            f.write(b'abcd')
+
+        expected = self.payload[:CAPACITY-2] + b'abcd' + self.payload[CAPACITY+2:]
+        with self.pyfs.open('/big', 'rb') as f:
+            self.assertEqual(f.read(), expected)
+
+    @log_test_case
+    def test_truncate_on_write(self):
+        with self.pyfs.open('/big', 'wb') as f:
+            f.write(self.payload)
+        with self.pyfs.open('/big', 'wb') as f:
+            f.write(b'small')
+        with self.pyfs.open('/big', 'rb') as f:
+            self.assertEqual(f.read(), b'small')
+
+        inode = self.pyfs.read_inode(self.pyfs.root_inode.find_entry('big').addr)
+        self.assertEqual(inode.next_inode_addr, 0)
+        self.assertEqual(inode.data, b'small')
+
+    @log_test_case
+    def test_open_errors(self):
+        self.assertRaises(FileNotFoundError, self.pyfs.open, '/missing', 'rb')
+        self.assertRaises(FileNotFoundError, self.pyfs.open, '/missing/file', 'wb')
+
+        self.pyfs.root_inode.make_dir('etc')
+        self.assertRaises(IsADirectoryError, self.pyfs.open, '/etc', 'rb')
+        self.assertRaises(ValueError, self.pyfs.open, '/etc/file', 'w')
+        self.assertIsNone(self.pyfs.read_inode(self.pyfs.root_inode.find_entry('etc').addr).find_entry('file'))
+
+    @log_test_case
+    def test_file_from_before_file_size(self):
+        #older images wrote single block files through Inode.data and left the file size bytes at 0
+        self.pyfs.root_inode.make_file('old')
+        inode = self.pyfs.resolve('/old')
+        inode.data = b'written the old way'
+        inode.set_meta_bytes(0, 14, 8)
+        inode.save()
+        self.pyfs.save_all()
+
+        new_fs = PYFS(self.fs)
+        self.assertEqual(new_fs.stat('/old').size, 19)
+        with new_fs.open('/old', 'rb') as f:
+            self.assertEqual(f.read(), b'written the old way')
+        with new_fs.open('/old', 'ab') as f:
+            f.write(b' and appended')
+        with new_fs.open('/old', 'rb') as f:
+            self.assertEqual(f.read(), b'written the old way and appended')
+
+class TestPYFSExtentFile(unittest.TestCase):
+    @log_test_case
+    def setUp(self):
+        self.fs = io.BytesIO()
+        self.pyfs = PYFS(self.fs, extent_files=True)
+        self.pyfs.create_fs()
+        self.payload = bytes(i % 251 for i in range(DEFAULT_BLOCK_SIZE * 40 + 17))
+
+    @log_test_case
+    def test_write_read_and_reload(self):
+        with self.pyfs.open('/big', 'wb') as f:
+            for idx in range(0, len(self.payload), 1000):
+                f.write(self.payload[idx:idx+1000])
+
+        inode = self.pyfs.resolve('/big')
+        self.assertTrue(inode.has_extents)
+        self.assertEqual(inode.next_inode_addr, 0)
+
+        new_fs = PYFS(self.fs)
+        self.assertTrue(new_fs.check_fs())
+        with new_fs.open('/big', 'rb') as f:
+            self.assertEqual(f.read(), self.payload)
+
+    @log_test_case
+    def test_seek_reads_one_run(self):
+        with self.pyfs.open('/big', 'wb') as f:
+            f.write(self.payload)
+
+        with self.pyfs.open('/big', 'rb') as f:
+            f.seek(DEFAULT_BLOCK_SIZE * 35 - 5)
+            self.pyfs.reset_stats()
+            self.assertEqual(f.read(DEFAULT_BLOCK_SIZE * 2), self.payload[DEFAULT_BLOCK_SIZE*35-5:DEFAULT_BLOCK_SIZE*37-5])
+
+            # the data blocks were allocated as one run, so this is a single device read
+            self.assertEqual(self.pyfs.stats()['io']['reads'], 1)
+
+    @log_test_case
+    def test_holes_and_truncate(self):
+        with self.pyfs.open('/big', 'wb') as f:
+            f.write(b'x' * 100)
+            f.truncate(50)
+            f.seek(DEFAULT_BLOCK_SIZE + 10)
+            f.write(b'end')
+
+        with self.pyfs.open('/big', 'rb') as f:
+            self.assertEqual(f.read(), b'x' * 50 + bytes(DEFAULT_BLOCK_SIZE - 40) + b'end')
+
+    @log_test_case
+    def test_two_handles_append(self):
+        with self.pyfs.open('/big', 'wb') as f:
+            f.write(b'start')
+
+        first = self.pyfs.open('/big', 'r+b')
+        second = self.pyfs.open('/big', 'r+b')
+        expected = b'start'
+        for idx in range(20):
+            for handle, fill in ((first, b'a'), (second, b'b')):
+                data = fill * (DEFAULT_BLOCK_SIZE + idx)
+                handle.seek(len(expected))
+                handle.write(data)
+                handle.flush()
+                expected += data
+        first.close()
+        second.close()
+
+        self.pyfs.save_all()
+        new_fs = PYFS(self.fs)
+        self.assertTrue(new_fs.check_fs())
+        with new_fs.open('/big', 'rb') as f:
+            self.assertEqual(f.read(), expected)
+
+    @log_test_case
+    def test_indirect_extents_and_unlink(self):
+        self.pyfs.root_inode.make_dir('etc')
+        allocator = self.pyfs.allocator
+        used = allocator.end_page - allocator.free_count()
+
+        # growing two files in turn fragments both into one extent per block
+        with self.pyfs.open('/a', 'wb') as a, self.pyfs.open('/b', 'wb') as b:
+            for idx in range(600):
+                a.write(idx.to_bytes(2, 'big') * (DEFAULT_BLOCK_SIZE // 2))
+                b.write(b'b' * DEFAULT_BLOCK_SIZE)
+
+        inode = self.pyfs.resolve('/a')
+        self.assertNotEqual(inode.next_inode_addr, 0)
+        with self.pyfs.open('/a', 'rb') as f:
+            f.seek(DEFAULT_BLOCK_SIZE * 550)
+            self.assertEqual(f.read(2), (550).to_bytes(2, 'big'))
+
+        self.pyfs.root_inode.unlink('a')
+        self.pyfs.root_inode.unlink('b')
+        self.assertEqual(allocator.end_page - allocator.free_count(), used)
+
+class TestPYFSInlineFile(unittest.TestCase):
+    @log_test_case
+    def setUp(self):
+        self.fs = io.BytesIO()
+        self.pyfs = PYFS(self.fs, inline_files=True)
+        self.pyfs.create_fs()
+
+    @log_test_case
+    def test_small_file_takes_no_block(self):
+        allocator = self.pyfs.allocator
+        free = allocator.free_count()
+
+        with self.pyfs.open('/motd', 'wb') as f:
+            f.write(b'hello ')
+            f.write(b'world')
+
+        self.assertEqual(allocator.free_count(), free)
+        self.assertTrue(self.pyfs.root_inode.find_entry('motd').is_inline)
+        self.assertEqual(self.pyfs.stat('/motd').size, 11)
+
+        new_fs = PYFS(self.fs)
+        self.assertTrue(new_fs.check_fs())
+        with new_fs.open('/motd', 'rb') as f:
+            self.assertEqual(f.read(), b'hello world')
+        with new_fs.open('/motd', 'r+b') as f:
+            f.seek(6)
+            f.write(b'there')
+            f.seek(0)
+            self.assertEqual(f.read(), b'hello there')
+        with new_fs.open('/motd', 'ab') as f:
+            self.assertEqual(f.tell(), 11)
+            f.write(b'!')
+        with new_fs.open('/motd', 'rb') as f:
+            self.assertEqual(f.read(), b'hello there!')
+
+        self.assertRaises(NotADirectoryError, new_fs.resolve, '/motd/a')
+
+    @log_test_case
+    def test_name_without_room_for_data(self):
+        #122 and 121 byte names leave no room for the length byte, those files get an inode
+        for name in ('n' * 122, 'm' * 121):
+            with self.pyfs.open(f'/{name}', 'wb') as f:
+                f.write(b'data')
+            self.assertFalse(self.pyfs.root_inode.find_entry(name).is_inline)
+
+        #a failed inline entry leaves nothing behind
+        with self.assertRaises(ValueError):
+            self.pyfs.root_inode.create_inline_entry('o' * 120, b'x')
+        self.assertIsNone(self.pyfs.root_inode.find_entry('o' * 120))
+        self.pyfs.root_inode.create_inline_entry('o' * 120)
+
+        self.pyfs.save_all()
+        new_fs = PYFS(self.fs)
+        self.assertTrue(new_fs.check_fs())
+        self.assertCountEqual([a.name for a in new_fs.root_inode.ls()], ['n' * 122, 'm' * 121, 'o' * 120])
+        with new_fs.open('/' + 'n' * 122, 'rb') as f:
+            self.assertEqual(f.read(), b'data')
+
+    @log_test_case
+    def test_promoted_when_it_grows(self):
+        payload = bytes(i % 251 for i in range(CAPACITY + 500))
+        with self.pyfs.open('/grow', 'wb') as f:
+            f.write(payload[:100])
+            f.write(payload[100:])
+            f.seek(10)
+            f.write(b'abc')
+
+        entry = self.pyfs.root_inode.find_entry('grow')
+        self.assertFalse(entry.is_inline)
+        self.assertEqual(self.pyfs.resolve('/grow').addr, entry.addr)
+
+        new_fs = PYFS(self.fs)
+        with new_fs.open('/grow', 'rb') as f:
+            self.assertEqual(f.read(), payload[:10] + b'abc' + payload[13:])
+
+    @log_test_case
+    def test_truncate_and_unlink(self):
+        with self.pyfs.open('/t', 'wb') as f:
+            f.write(b'0123456789')
+            f.truncate(4)
+            f.truncate(300)
+
+        entry = self.pyfs.root_inode.find_entry('t')
+        self.assertFalse(entry.is_inline)
+        with self.pyfs.open('/t', 'rb') as f:
+            self.assertEqual(f.read(), b'0123' + bytes(296))
+
+        with self.pyfs.open('/small', 'wb') as f:
+            f.write(b'x')
+        free = self.pyfs.allocator.free_count()
+        self.pyfs.root_inode.unlink('small')
+        self.assertEqual(self.pyfs.allocator.free_count(), free)
+        self.assertRaises(FileNotFoundError, self.pyfs.open, '/small')
+
+class TestPYFSCompressedFile(unittest.TestCase):
+    @log_test_case
+    def setUp(self):
+        self.fs = io.BytesIO()
+        self.pyfs = PYFS(self.fs, compression='zlib')
+        self.pyfs.create_fs()
+        self.text = b''.join(b'line %d of a text file\n' % idx for idx in range(50000))
+
+    @log_test_case
+    def test_write_read_and_reload(self):
+        self.pyfs.root_inode.make_dir('etc')
+        allocator = self.pyfs.allocator
+        used = allocator.end_page - allocator.free_count()
+        with self.pyfs.open('/text', 'wb') as f:
+            for idx in range(0, len(self.text), 1000):
+                f.write(self.text[idx:idx+1000])
+
+        inode = self.pyfs.resolve('/text')
+        self.assertTrue(inode.is_compressed)
+        blocks = allocator.end_page - allocator.free_count() - used
+        self.assertLess(blocks * DEFAULT_BLOCK_SIZE, len(self.text) // 4)
+
+        new_fs = PYFS(self.fs)
+        self.assertTrue(new_fs.check_fs())
+        with new_fs.open('/text', 'rb') as f:
+            f.seek(300000)
+            self.assertEqual(f.read(100), self.text[300000:300100])
+            f.seek(0)
+            self.assertEqual(f.read(), self.text)
+
+        new_fs.root_inode.unlink('text')
+        self.assertEqual(new_fs.allocator.end_page - new_fs.allocator.free_count(), used)
+
+    @log_test_case
+    def test_overwrite_holes_and_truncate(self):
+        noise = bytes((idx * 7919) % 251 for idx in range(200000))
+        with self.pyfs.open('/mixed', 'wb') as f:
+            f.write(noise)
+            f.seek(500000)
+            f.write(b'end')
+            f.seek(1000)
+            f.write(b'middle')
+            f.truncate(500001)
+
+        expected = noise[:1000] + b'middle' + noise[1006:] + bytes(300000) + b'e'
+        with self.pyfs.open('/mixed', 'r+b') as f:
+            self.assertEqual(f.read(), expected)
+            f.seek(10)
+            f.write(b'x')
+            f.seek(0)
+            self.assertEqual(f.read(11), expected[:10] + b'x')
+
+    @log_test_case
+    def test_two_handles(self):
+        with self.pyfs.open('/text', 'wb') as f:
+            f.write(self.text)
+
+        first = self.pyfs.open('/text', 'r+b')
+        second = self.pyfs.open('/text', 'r+b')
+        expected = bytearray(self.text)
+        for idx in range(8):
+            for handle, fill in ((first, b'a'), (second, b'b')):
+                #incompressible data makes the chunks grow and move
+                data = fill * 1000 + bytes((n * 7919) % 251 for n in range(DEFAULT_BLOCK_SIZE * 3 + idx))
+                pos = (idx * 70001) % len(expected)
+                handle.seek(pos)
+                handle.write(data)
+                handle.flush()
+                expected[pos:pos+len(data)] = data
+
+        #a chunk the other handle read before is read again
+        first.seek(0)
+        self.assertEqual(first.read(), bytes(expected))
+        first.close()
+        second.close()
+
+        self.pyfs.save_all()
+        new_fs = PYFS(self.fs)
+        self.assertTrue(new_fs.check_fs())
+        with new_fs.open('/text', 'rb') as f:
+            self.assertEqual(f.read(), bytes(expected))
+
+    @log_test_case
+    def test_lzma(self):
+        pyfs = PYFS(self.fs, compression='lzma')
+        pyfs.create_fs()
+        with pyfs.open('/text', 'wb') as f:
+            f.write(self.text)
+        with pyfs.open('/text', 'rb') as f:
+            self.assertEqual(f.read(), self.text)
+
+        self.assertRaises(ValueError, PYFS, self.fs, compression='zstd')
+
+class TestPYFSDedupFile(unittest.TestCase):
+    @log_test_case
+    def setUp(self):
+        self.fs = io.BytesIO()
+        self.pyfs = PYFS(self.fs, dedup=True)
+        self.pyfs.create_fs()
+        self.pyfs.root_inode.make_dir('etc')
+        self.payload = bytes((idx * 7919) % 251 for idx in range(CAPACITY * 10 + 17))
+
+    def used(self) -> int:
+        return self.pyfs.allocator.end_page - self.pyfs.allocator.free_count()
+
+    @log_test_case
+    def test_identical_files_share_blocks(self):
+        with self.pyfs.open('/etc/a', 'wb') as f:
+            f.write(self.payload)
+        used = self.used()
+
+        with self.pyfs.open('/etc/b', 'wb') as f:
+            f.write(self.payload)
+
+        #the second copy only costs its main inode
+        self.assertEqual(self.used(), used + 1)
+        self.assertEqual(len(self.pyfs.dedup), 11)
+
+        new_fs = PYFS(self.fs)
+        self.assertTrue(new_fs.check_fs())
+        self.assertEqual(len(new_fs.dedup), 11)
+        with new_fs.open('/etc/b', 'rb') as f:
+            self.assertEqual(f.read(), self.payload)
+
+    @log_test_case
+    def test_two_handles(self):
+        with self.pyfs.open('/etc/a', 'wb') as f:
+            f.write(self.payload)
+
+        first = self.pyfs.open('/etc/a', 'r+b')
+        second = self.pyfs.open('/etc/a', 'r+b')
+        expected = bytearray(self.payload)
+        for idx in range(10):
+            for handle, fill in ((first, b'a'), (second, b'b')):
+                data = fill * (CAPACITY + idx * 13)
+                pos = (idx * 3001) % len(expected)
+                handle.seek(pos)
+                handle.write(data)
+                handle.flush()
+                expected[pos:pos+len(data)] = data
+        first.seek(0)
+        self.assertEqual(first.read(), bytes(expected))
+        first.close()
+        second.close()
+
+        self.pyfs.save_all()
+        new_fs = PYFS(self.fs)
+        self.assertTrue(new_fs.check_fs())
+        with new_fs.open('/etc/a', 'rb') as f:
+            self.assertEqual(f.read(), bytes(expected))
+
+    @log_test_case
+    def test_shared_block_freed_with_last_reference(self):
+        base = self.used()
+        for name in ('a', 'b'):
+            with self.pyfs.open(f'/etc/{name}', 'wb') as f:
+                f.write(self.payload)
+
+        #changing one copy leaves the other untouched
+        with self.pyfs.open('/etc/a', 'r+b') as f:
+            f.seek(CAPACITY + 5)
+            f.write(b'changed')
+        with self.pyfs.open('/etc/b', 'rb') as f:
+            self.assertEqual(f.read(), self.payload)
+        with self.pyfs.open('/etc/a', 'rb') as f:
+            self.assertEqual(f.read(CAPACITY + 12)[-7:], b'changed')
+
+        etc = self.pyfs.resolve('/etc')
+        etc.unlink('a')
+        with self.pyfs.open('/etc/b', 'rb') as f:
+            self.assertEqual(f.read(), self.payload)
+
+        etc.unlink('b')
+        self.assertEqual(len(self.pyfs.dedup), 0)
+        #only the dedup index block stays
+        self.assertEqual(self.used(), base + 1)
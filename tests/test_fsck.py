@@ -0,0 +1,175 @@
+import unittest
+import logging
+import os
+import tempfile
+
+from pyfs import PYFS
+from pyfs.fsck import fsck
+
+from tests.test_common import log_test_case, set_up_test_directories
+
+logging.basicConfig(filename="test_pyfs.log", level=logging.WARNING)
+
+class TestFsck(unittest.TestCase):
+    @log_test_case
+    def setUp(self):
+        fd, self.image = tempfile.mkstemp()
+        os.close(fd)
+
+        self.f = open(self.image, 'r+b')
+        self.pyfs = PYFS(self.f, journal=True)
+        self.pyfs.create_fs()
+        set_up_test_directories(self.pyfs)
+        with self.pyfs.open('/etc/chain', 'wb') as f:
+            f.write(b'chain' * 2000)
+        self.pyfs.extent_files = True
+        with self.pyfs.open('/etc/extents', 'wb') as f:
+            f.write(b'extent' * 2000)
+        self.pyfs.save_all()
+
+    def tearDown(self):
+        self.f.close()
+        os.unlink(self.image)
+
+    def addr(self, path):
+        return self.pyfs.resolve(path).addr
+
+    @log_test_case
+    def test_clean(self):
+        for workers in (1, 3):
+            report = fsck(self.image, workers=workers)
+            self.assertTrue(report.clean, report)
+            self.assertEqual(report.directories, 1 + 3 + 3 + 3 + 33)
+            self.assertEqual(report.files, 2)
+
+    @log_test_case
+    def test_large_blocks(self):
+        with open(self.image, 'w+b') as f:
+            pyfs = PYFS(f)
+            pyfs.create_fs(128 * 1024)
+            set_up_test_directories(pyfs)
+            with pyfs.open('/etc/big', 'wb') as big:
+                big.write(b'big' * 100000)
+            pyfs.save_all()
+
+        report = fsck(self.image, workers=1)
+        self.assertTrue(report.clean, report)
+        self.assertEqual(report.files, 1)
+
+    @log_test_case
+    def test_compressed(self):
+        self.pyfs.compression = 'zlib'
+        with self.pyfs.open('/etc/packed', 'wb') as f:
+            f.write(b'packed' * 100000)
+        self.pyfs.save_all()
+
+        report = fsck(self.image, workers=2)
+        self.assertTrue(report.clean, report)
+        self.assertEqual(report.files, 3)
+
+    @log_test_case
+    def test_dedup(self):
+        self.pyfs.extent_files = False
+        self.pyfs.dedup_files = True
+        for name in ('a', 'b'):
+            with self.pyfs.open(f'/etc/{name}', 'wb') as f:
+                f.write(b'same' * 10000)
+        self.pyfs.save_all()
+
+        report = fsck(self.image, workers=2)
+        self.assertTrue(report.clean, report)
+        self.assertEqual(report.files, 4)
+
+        #a shared block referenced fewer times than its ref count says
+        addr = self.pyfs.dedup.lookup(next(iter(self.pyfs.dedup.slots)))
+        block = self.pyfs.read_inode(addr)
+        refs = block.ref_count
+        block.ref_count = refs + 1
+        self.pyfs.save_all()
+        self.assertIn(f'Shared data block {addr} has ref count {refs + 1} but {refs} references', fsck(self.image, workers=1).errors)
+
+    @log_test_case
+    def test_snapshot(self):
+        self.pyfs.extent_files = False
+        self.pyfs.dedup_files = True
+        with self.pyfs.open('/etc/shared', 'wb') as f:
+            f.write(b'same' * 10000)
+        self.pyfs.snapshot('before')
+        for path in ('/etc/shared', '/etc/extents', '/etc/chain'):
+            with self.pyfs.open(path, 'r+b') as f:
+                f.write(b'changed')
+        self.pyfs.resolve('/home', write=True).unlink('nkroft')
+        self.pyfs.clone('/bin', '/home/bin')
+        self.pyfs.save_all()
+
+        report = fsck(self.image, workers=2)
+        self.assertTrue(report.clean, report)
+        self.assertEqual(report.files, 6)
+
+        self.pyfs.delete_snapshot('before')
+        self.pyfs.save_all()
+        self.assertTrue(fsck(self.image, workers=1).clean)
+
+        #a second entry for an inode that does not count it is a cross link
+        bin_addr = self.addr('/bin')
+        inode = self.pyfs.read_inode(bin_addr)
+        inode.ref_count = 1
+        self.pyfs.save_all()
+        self.assertEqual(len(fsck(self.image, workers=1).cross_links), 1)
+
+    @log_test_case
+    def test_compact(self):
+        bin_inode = self.pyfs.resolve('/bin')
+        for idx in range(0, 33, 2):
+            bin_inode.unlink(f'tst{idx}')
+        self.assertEqual(self.pyfs.compact('/', recursive=True), 1)
+        self.pyfs.save_all()
+
+        report = fsck(self.image, workers=2)
+        self.assertTrue(report.clean, report)
+        self.assertEqual(report.directories, 1 + 3 + 3 + 3 + 16)
+
+    @log_test_case
+    def test_orphan(self):
+        addr = self.pyfs.allocator.allocate()
+        self.pyfs.allocator.sync()
+        self.pyfs.sync()
+
+        report = fsck(self.image, workers=2)
+        self.assertEqual(report.orphans, [addr])
+        self.assertFalse(report.errors)
+
+    @log_test_case
+    def test_cross_link(self):
+        etc = self.pyfs.resolve('/etc')
+        sys_addr = self.addr('/etc/sys')
+        etc.find_entry('sys').addr = self.addr('/home/nkroft')
+        etc.dirty = True
+        self.pyfs.save_all()
+
+        report = fsck(self.image, workers=2)
+        self.assertEqual([a[0] for a in report.cross_links], [self.addr('/home/nkroft')])
+        # the old sys directory is now unreachable
+        self.assertEqual(report.orphans, [sys_addr])
+
+    @log_test_case
+    def test_cycle(self):
+        bin_dir = self.pyfs.resolve('/bin')
+        last = self.pyfs.read_inode(bin_dir.next_inode_addr)
+        last.next_inode_addr = bin_dir.addr
+        last.save()
+        self.pyfs.sync()
+
+        report = fsck(self.image, workers=2)
+        self.assertEqual(report.cycles, [('/bin', bin_dir.addr)])
+
+    @log_test_case
+    def test_bad_entry(self):
+        home = self.pyfs.resolve('/home')
+        home.find_entry('swalker').is_dir = False
+        home.dirty = True
+        self.pyfs.save_all()
+
+        report = fsck(self.image, workers=1)
+        self.assertEqual(len(report.errors), 1)
+        self.assertIn('/home/swalker', report.errors[0])
@@ -0,0 +1,58 @@
+import unittest
+import io
+import logging
+
+from pyfs import PYFS, InodeEntryExists
+
+from tests.test_common import log_test_case
+
+logging.basicConfig(filename="test_pyfs.log", level=logging.WARNING)
+
+class TestInode(unittest.TestCase):
+    @log_test_case
+    def setUp(self):
+        self.fs = io.BytesIO()
+        self.pyfs = PYFS(self.fs)
+        self.pyfs.create_fs()
+        self.root = self.pyfs.root_inode
+
+    @log_test_case
+    def test_index_large_directory(self):
+        names = [f'file{idx}' for idx in range(100)]
+        for name in names:
+            self.root.make_file(name)
+
+        self.assertEqual(len(self.root.index.blocks), 4)
+        self.assertCountEqual([a.name for a in self.root.ls()], names)
+        for name in names:
+            self.assertEqual(self.root.find_entry(name).name, name)
+        self.assertIsNone(self.root.find_entry('missing'))
+        self.assertRaises(InodeEntryExists, self.root.make_file, 'file99')
+
+        #a fresh mount builds the same index from the blocks
+        new_fs = PYFS(self.fs)
+        self.assertTrue(new_fs.check_fs())
+        self.assertEqual(new_fs.root_inode.index.entries, self.root.index.entries)
+
+    @log_test_case
+    def test_index_reuses_free_slots(self):
+        for idx in range(40):
+            self.root.make_file(f'file{idx}')
+
+        location = self.root.index.entries['file3']
+        self.root.unlink('file3')
+        self.assertIsNone(self.root.find_entry('file3'))
+
+        self.root.make_dir('new')
+        self.assertEqual(self.root.index.entries['new'], location)
+        self.assertTrue(self.root.find_entry('new').is_dir)
+
+    @log_test_case
+    def test_hidden_entries(self):
+        self.root.make_file('secret')
+        self.root.find_entry('secret').is_hidden = True
+
+        self.assertIsNone(self.root.find_entry('secret'))
+        self.assertEqual(self.root.ls(), [])
+        self.assertEqual([a.name for a in self.root.ls(show_hidden=True)], ['secret'])
+        self.assertRaises(InodeEntryExists, self.root.make_file, 'secret')
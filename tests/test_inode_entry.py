@@ -0,0 +1,86 @@
+import unittest
+import io
+import logging
+
+from pyfs import PYFS, InodeEntry
+from pyfs.constants import INODE_META_SIZE
+
+from tests.test_common import log_test_case
+
+logging.basicConfig(filename="test_pyfs.log", level=logging.WARNING)
+
+class TestInodeEntry(unittest.TestCase):
+    @log_test_case
+    def setUp(self):
+        self.fs = io.BytesIO()
+        self.pyfs = PYFS(self.fs)
+        self.pyfs.create_fs()
+
+    @log_test_case
+    def test_fields(self):
+        entry = InodeEntry(bytes(INODE_META_SIZE))
+        self.assertTrue(entry.free)
+
+        entry.addr = 0x01020304
+        entry.permissions = 7
+        entry.is_dir = True
+        entry.name = 'etc'
+
+        self.assertEqual(entry.addr, 0x01020304)
+        self.assertEqual(entry.permissions, 7)
+        self.assertTrue(entry.is_dir)
+        self.assertFalse(entry.is_hidden)
+        self.assertEqual(entry.name, 'etc')
+        self.assertEqual(len(entry.data), INODE_META_SIZE)
+        self.assertEqual(entry.data[:6], b'\x80\x07\x01\x02\x03\x04')
+
+        entry.name = 'e'
+        self.assertEqual(entry.name, 'e')
+        self.assertRaises(ValueError, setattr, entry, 'name', 'a' * 123)
+
+    @log_test_case
+    def test_inline_data(self):
+        entry = InodeEntry(bytes(INODE_META_SIZE))
+        entry.is_inline = True
+        entry.name = 'motd'
+        self.assertFalse(entry.free)
+        self.assertEqual(entry.inline_capacity, 122 - 4 - 2)
+
+        entry.inline_data = b'hello\0world'
+        self.assertEqual(entry.name, 'motd')
+        self.assertEqual(entry.inline_data, b'hello\0world')
+        self.assertEqual(entry.addr, 0)
+
+        entry.inline_data = b'x' * entry.inline_capacity
+        self.assertEqual(entry.inline_data, b'x' * 116)
+        self.assertRaises(ValueError, setattr, entry, 'inline_data', b'x' * 117)
+
+    @log_test_case
+    def test_edits_parent_block(self):
+        root = self.pyfs.root_inode
+        entry = root.children[2]
+        entry.addr = 5
+        entry.name = 'direct'
+
+        offset = 3 * INODE_META_SIZE
+        self.assertEqual(root.full_inode_data[offset+2:offset+6], b'\x00\x00\x00\x05')
+        self.assertEqual(root.find_entry('direct').addr, 5)
+
+    @log_test_case
+    def test_view_over_parent(self):
+        root = self.pyfs.root_inode
+        self.assertFalse(hasattr(root.children[0], '__dict__'))
+
+        root.make_dir('etc')
+        entry = root.find_entry('etc')
+        self.assertIs(entry.name, entry.name)
+
+        #rewriting the raw entry drops the cached name
+        raw = bytearray(entry.data)
+        raw[6:9] = b'usr'
+        entry.data = raw
+        self.assertEqual(entry.name, 'usr')
+
+        #raw edits bypass the directory index so it has to be rebuilt
+        root.invalidate_index()
+        self.assertEqual(root.find_entry('usr').addr, entry.addr)
@@ -0,0 +1,165 @@
+import unittest
+import io
+import logging
+
+from pyfs import PYFS, TransactionTooLarge
+from pyfs.constants import DEFAULT_JOURNAL_BLOCKS
+from pyfs.journal import COMMIT_STRUCT
+
+from tests.test_common import log_test_case, set_up_test_directories
+
+logging.basicConfig(filename="test_pyfs.log", level=logging.WARNING)
+
+class SnapshotBytesIO(io.BytesIO):
+    '''Keeps a copy of the image every time it is flushed'''
+    def __init__(self, initial=b''):
+        super().__init__(initial)
+        self.snapshots = []
+
+    def flush(self):
+        super().flush()
+        self.snapshots.append(self.getvalue())
+
+class TestJournal(unittest.TestCase):
+    @log_test_case
+    def setUp(self):
+        self.fs = SnapshotBytesIO()
+        self.pyfs = PYFS(self.fs, journal=True)
+        self.pyfs.create_fs()
+        self.journal = self.pyfs.journal
+
+    @log_test_case
+    def test_created(self):
+        self.assertTrue(self.journal.active)
+        self.assertEqual(self.pyfs.root_block.journal_addr, self.journal.addr)
+        for addr in range(self.journal.addr, self.journal.addr + self.journal.blocks):
+            self.assertTrue(self.pyfs.allocator.is_allocated(addr))
+
+        #an existing image gets a journal when mounted with one
+        plain = io.BytesIO()
+        PYFS(plain).create_fs()
+        pyfs = PYFS(plain, journal=True)
+        self.assertTrue(pyfs.check_fs())
+        self.assertTrue(pyfs.journal.active)
+
+    @log_test_case
+    def test_group_commit(self):
+        self.fs.snapshots = []
+        set_up_test_directories(self.pyfs)
+
+        #the whole batch of directories is committed by save_all
+        self.assertEqual(self.journal.commits, 1)
+        self.assertLessEqual(len(self.fs.snapshots), 3)
+
+        new_fs = PYFS(self.fs)
+        self.assertTrue(new_fs.check_fs())
+        self.assertCountEqual([a.name for a in new_fs.resolve('/home').ls()], ['nkroft', 'swalker', 'mandrew'])
+
+    def _crash_during_commit(self):
+        self.pyfs.sync()
+        self.fs.snapshots = []
+        self.pyfs.root_inode.make_dir('etc')
+        self.pyfs.sync()
+
+        #first flush of the commit has the log on disk but not the home blocks
+        return bytearray(self.fs.snapshots[0])
+
+    @log_test_case
+    def test_replay(self):
+        image = self._crash_during_commit()
+
+        pyfs = PYFS(io.BytesIO(image))
+        self.assertTrue(pyfs.check_fs())
+        self.assertEqual([a.name for a in pyfs.root_inode.ls()], ['etc'])
+        self.assertTrue(pyfs.resolve('/etc').is_dir)
+
+        #replay clears the log
+        self.assertEqual(pyfs.journal.replay(), 0)
+
+    @log_test_case
+    def test_discard_incomplete(self):
+        image = self._crash_during_commit()
+
+        #break the checksum of the commit block
+        block_size = self.pyfs.block_size
+        for addr in range(self.journal.addr + 1, self.journal.addr + self.journal.blocks):
+            offset = addr * block_size
+            if image[offset:offset+8] == b'PYFSCMIT':
+                image[offset+COMMIT_STRUCT.size-1] ^= 0xff
+                break
+
+        pyfs = PYFS(io.BytesIO(image))
+        self.assertTrue(pyfs.check_fs())
+        self.assertEqual(pyfs.root_inode.ls(), [])
+
+    @log_test_case
+    def test_large_transaction_not_split(self):
+        fs = SnapshotBytesIO()
+        pyfs = PYFS(fs, journal=True, journal_blocks=8)
+        pyfs.create_fs()
+        old_addr = pyfs.journal.addr
+        fs.snapshots = []
+
+        with pyfs.transaction():
+            for idx in range(20):
+                pyfs.root_inode.make_dir(f'dir{idx}')
+        pyfs.save_all()
+
+        #the journal moved to a run big enough for the whole transaction
+        self.assertEqual(pyfs.journal.commits, 1)
+        self.assertNotEqual(pyfs.journal.addr, old_addr)
+        self.assertGreater(pyfs.journal.capacity, 20)
+        self.assertEqual(pyfs.root_block.journal_addr, pyfs.journal.addr)
+
+        #a crash at any flush leaves either none or all of the directories
+        for image in fs.snapshots:
+            crashed = PYFS(io.BytesIO(image))
+            self.assertTrue(crashed.check_fs())
+            self.assertIn(len(crashed.root_inode.ls()), (0, 20))
+        self.assertEqual(len(crashed.root_inode.ls()), 20)
+
+        with self.assertRaises(TransactionTooLarge):
+            with self.pyfs.transaction():
+                self.pyfs.root_inode.make_dir('dropped')
+                for idx in range(self.journal.max_capacity + 1):
+                    self.journal.write(self.journal.addr + self.journal.blocks + idx, bytes(self.pyfs.block_size))
+
+        #the transaction is dropped and the mount still works
+        self.assertEqual(self.journal.pending, {})
+        self.assertEqual(self.pyfs.root_inode.ls(), [])
+        self.pyfs.root_inode.make_dir('etc')
+        self.pyfs.sync()
+        self.assertTrue(PYFS(self.fs).check_fs())
+        self.assertEqual([a.name for a in PYFS(self.fs).resolve('/').ls()], ['etc'])
+
+    @log_test_case
+    def test_sync_waits_for_transaction(self):
+        commits = self.journal.commits
+        with self.pyfs.transaction():
+            self.pyfs.root_inode.make_dir('a')
+            self.pyfs.sync()
+            self.assertEqual(self.journal.commits, commits)
+            self.pyfs.root_inode.make_dir('b')
+
+        #the sync is made once the transaction ends, as one commit
+        self.assertEqual(self.journal.commits, commits + 1)
+        self.assertEqual(self.journal.pending, {})
+        self.assertCountEqual([a.name for a in PYFS(self.fs).resolve('/').ls()], ['a', 'b'])
+
+    @log_test_case
+    def test_large_write(self):
+        payload = bytes((idx * 7919) % 251 for idx in range(8 << 20))
+        with self.pyfs.open('/big', 'wb') as f:
+            self.assertEqual(f.write(payload), len(payload))
+
+        #the write was committed in pieces that fit the journal
+        self.assertEqual(self.journal.blocks, DEFAULT_JOURNAL_BLOCKS)
+        self.assertGreater(self.journal.commits, 1)
+
+        self.pyfs.root_inode.make_dir('etc')
+        self.pyfs.sync()
+        new_fs = PYFS(self.fs)
+        self.assertTrue(new_fs.check_fs())
+        self.assertCountEqual([a.name for a in new_fs.root_inode.ls()], ['big', 'etc'])
+        with new_fs.open('/big', 'rb') as f:
+            self.assertEqual(f.read(), payload)
@@ -0,0 +1,66 @@
+import unittest
+import io
+import logging
+import os
+import tempfile
+
+from pyfs import PYFS
+from pyfs.pack import pack, unpack
+
+from tests.test_common import CountingBytesIO, log_test_case
+
+logging.basicConfig(filename="test_pyfs.log", level=logging.WARNING)
+
+class TestPack(unittest.TestCase):
+    @log_test_case
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.host = os.path.join(self.tmp.name, 'host')
+
+        os.makedirs(os.path.join(self.host, 'etc', 'ssh'))
+        os.makedirs(os.path.join(self.host, 'empty'))
+        for idx in range(70):
+            with open(os.path.join(self.host, 'etc', f'conf{idx}'), 'wb') as f:
+                f.write(f'option {idx}\n'.encode())
+        with open(os.path.join(self.host, 'etc', 'ssh', 'big'), 'wb') as f:
+            f.write(bytes(range(256)) * 100)
+        open(os.path.join(self.host, 'zero'), 'wb').close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    @log_test_case
+    def test_round_trip(self):
+        dev = io.BytesIO()
+        fs = pack(self.host, dev)
+
+        self.assertCountEqual([a.name for a in fs.root_inode.ls()], ['etc', 'empty', 'zero'])
+        self.assertEqual(len(fs.resolve('/etc').ls()), 71)
+        with fs.open('/etc/ssh/big') as f:
+            self.assertEqual(f.read(), bytes(range(256)) * 100)
+        with fs.open('/etc/conf69') as f:
+            self.assertEqual(f.read(), b'option 69\n')
+
+        # the image is usable by a fresh mount, including allocating more blocks
+        fs = PYFS(dev)
+        self.assertTrue(fs.check_fs())
+        fs.resolve('/empty').make_dir('new')
+        self.assertIsNotNone(fs.resolve('/empty/new'))
+
+        out = os.path.join(self.tmp.name, 'out')
+        unpack(fs, out)
+        with open(os.path.join(out, 'etc', 'ssh', 'big'), 'rb') as f:
+            self.assertEqual(f.read(), bytes(range(256)) * 100)
+        self.assertEqual(os.path.getsize(os.path.join(out, 'zero')), 0)
+        self.assertEqual(len(os.listdir(os.path.join(out, 'etc'))), 71)
+
+    @log_test_case
+    def test_blocks_written_once(self):
+        dev = CountingBytesIO(block_size=4096)
+        fs = pack(self.host, dev)
+
+        # everything after create_fs lands in a single run written once
+        planned = range(2, fs.allocator.bitmap_addrs[0])
+        # etc, etc/ssh and empty, 70 small files, zero and 7 blocks of big
+        self.assertEqual(len(planned), 3 + 1 + 1 + 70 + 1 + 7)
+        self.assertTrue(all(dev.block_writes[addr] == 1 for addr in planned))
@@ -1,11 +1,13 @@
 import unittest
 import io
 import logging
+import os
+import tempfile
 
 from pyfs import PYFS
-from pyfs.constants import DEFAULT_BLOCK_SIZE, BYTE_ORDER
+from pyfs.constants import DEFAULT_BLOCK_SIZE, BYTE_ORDER, INODE_META_SIZE, KB, MB
 
-from tests.test_common import log_with_debug, log_test_case
+from tests.test_common import log_with_debug, log_test_case, set_up_test_directories
 
 logging.basicConfig(filename="test_pyfs.log", level=logging.WARNING)
 
@@ -88,3 +90,287 @@ class TestPYFS(unittest.TestCase):
     def test_write_inode(self):
         self.assertFalse(True)
     
+
+class TestPYFSBlockSize(unittest.TestCase):
+    @log_test_case
+    def test_invalid_sizes(self):
+        pyfs = PYFS(io.BytesIO())
+        for block_size in (2 * KB, 48 * KB, 2 * MB):
+            self.assertRaises(ValueError, pyfs.create_fs, block_size)
+
+    @log_test_case
+    def test_sizes(self):
+        for block_size in (16 * KB, 64 * KB, 1 * MB):
+            fs = io.BytesIO()
+            pyfs = PYFS(fs)
+            pyfs.create_fs(block_size)
+            set_up_test_directories(pyfs)
+
+            # a single directory block now holds every entry
+            bin_inode = pyfs.resolve('/bin')
+            self.assertEqual(len(bin_inode.children), block_size // INODE_META_SIZE - 1)
+            self.assertEqual(bin_inode.next_inode_addr, 0)
+
+            payload = bytes(i % 251 for i in range(block_size * 2 + 7))
+            with pyfs.open('/home/big', 'wb') as f:
+                f.write(payload)
+            self.assertEqual(pyfs.resolve('/home/big').data_size, block_size - INODE_META_SIZE)
+            pyfs.save_all()
+
+            new_fs = PYFS(fs)
+            self.assertTrue(new_fs.check_fs())
+            self.assertEqual(new_fs.block_size, block_size)
+            self.assertEqual(len(new_fs.root_inode.ls()), 3)
+            with new_fs.open('/home/big', 'rb') as f:
+                self.assertEqual(f.read(), payload)
+
+class TestPYFSSparse(unittest.TestCase):
+    @log_test_case
+    def setUp(self):
+        self.fs = tempfile.TemporaryFile()
+
+    def tearDown(self):
+        self.fs.close()
+
+    def disk_blocks(self) -> int:
+        return os.fstat(self.fs.fileno()).st_blocks * 512 // DEFAULT_BLOCK_SIZE
+
+    @log_test_case
+    def test_sparse_create(self):
+        pyfs = PYFS(self.fs)
+        pyfs.create_fs(blocks=1 << 18)
+
+        #a 1 GB image only takes the blocks that were written
+        self.assertEqual(os.fstat(self.fs.fileno()).st_size, (1 << 18) * DEFAULT_BLOCK_SIZE)
+        self.assertLess(self.disk_blocks(), 16)
+
+        set_up_test_directories(pyfs)
+        new_fs = PYFS(self.fs)
+        self.assertTrue(new_fs.check_fs())
+        self.assertEqual(len(new_fs.resolve('/bin').ls()), 33)
+
+    @log_test_case
+    def test_preallocate(self):
+        PYFS(self.fs).create_fs(blocks=64, preallocate=True)
+        self.assertEqual(os.fstat(self.fs.fileno()).st_size, 64 * DEFAULT_BLOCK_SIZE)
+
+    @log_test_case
+    def test_new_inodes_are_not_written(self):
+        pyfs = PYFS(self.fs)
+        pyfs.create_fs()
+        pyfs.reset_stats()
+
+        inode = pyfs.init_inode(40)
+        self.assertTrue(inode.dirty)
+        self.assertEqual(pyfs.stats()['io']['writes'], 0)
+
+        #blocks past the end of the image read back as zeros
+        self.assertEqual(bytes(pyfs.read_device(40, 2)), bytes(2 * DEFAULT_BLOCK_SIZE))
+
+    @log_test_case
+    def test_trim(self):
+        pyfs = PYFS(self.fs)
+        pyfs.create_fs()
+        pyfs.root_inode.make_dir('etc')
+        with pyfs.open('/etc/big', 'wb') as f:
+            f.write(b'x' * 200 * DEFAULT_BLOCK_SIZE)
+        pyfs.save_all()
+        used = self.disk_blocks()
+
+        pyfs.resolve('/etc').unlink('big')
+        released = pyfs.trim()
+        if released == 0:
+            self.skipTest('Hole punching is not supported here')
+
+        self.assertEqual(released, pyfs.allocator.free_count())
+        self.assertLessEqual(self.disk_blocks(), used - 200)
+        self.assertTrue(PYFS(self.fs).check_fs())
+
+class TestPYFSMmap(unittest.TestCase):
+    @log_test_case
+    def setUp(self):
+        self.fs = tempfile.TemporaryFile()
+        self.pyfs = PYFS(self.fs, use_mmap=True)
+        self.pyfs.create_fs()
+
+    def tearDown(self):
+        self.fs.close()
+
+    @log_test_case
+    def test_requires_file(self):
+        self.assertRaises(ValueError, PYFS, io.BytesIO(), use_mmap=True)
+
+    @log_test_case
+    def test_blocks_are_mapped(self):
+        self.assertIsInstance(self.pyfs.root_inode.full_inode_data, memoryview)
+
+        inode = self.pyfs.create_inode()
+        self.assertIsInstance(inode.full_inode_data, memoryview)
+
+        #field writes land directly in the image without a save
+        inode.parent_inode_addr = 1
+        self.fs.seek(inode.addr * DEFAULT_BLOCK_SIZE + 2, 0)
+        self.assertEqual(int.from_bytes(self.fs.read(4), byteorder=BYTE_ORDER), 1)
+
+    @log_test_case
+    def test_reload(self):
+        set_up_test_directories(self.pyfs)
+        with self.pyfs.open('/etc/big', 'wb') as f:
+            f.write(bytes(range(256)) * 100)
+
+        new_fs = PYFS(self.fs)
+        self.assertTrue(new_fs.check_fs())
+        self.assertCountEqual([a.name for a in new_fs.root_inode.ls()], ['etc', 'bin', 'home'])
+        with new_fs.open('/etc/big', 'rb') as f:
+            self.assertEqual(f.read(), bytes(range(256)) * 100)
+
+class TestPYFSResolve(unittest.TestCase):
+    @log_test_case
+    def setUp(self):
+        self.fs = io.BytesIO()
+        self.pyfs = PYFS(self.fs)
+        self.pyfs.create_fs()
+        set_up_test_directories(self.pyfs)
+
+    @log_test_case
+    def test_resolve(self):
+        etc = self.pyfs.read_inode(self.pyfs.root_inode.find_entry('etc').addr)
+        self.assertIs(self.pyfs.resolve('/'), self.pyfs.root_inode)
+        self.assertIs(self.pyfs.resolve('/etc'), etc)
+        self.assertIs(self.pyfs.resolve('etc/./X11/..'), etc)
+        self.assertEqual(self.pyfs.resolve('/bin/tst32').addr, self.pyfs.read_inode(self.pyfs.root_inode.find_entry('bin').addr).find_entry('tst32').addr)
+
+        self.assertRaises(FileNotFoundError, self.pyfs.resolve, '/etc/missing')
+        self.assertRaises(FileNotFoundError, self.pyfs.resolve, '/missing/etc')
+
+        with self.pyfs.open('/etc/passwd', 'wb') as f:
+            f.write(b'root')
+        self.assertRaises(NotADirectoryError, self.pyfs.resolve, '/etc/passwd/x')
+
+        stat = self.pyfs.stat('/etc/passwd')
+        self.assertFalse(stat.is_dir)
+        self.assertEqual(stat.size, 4)
+        self.assertEqual(stat.parent_addr, etc.addr)
+
+    @log_test_case
+    def test_dentry_cache(self):
+        self.pyfs.resolve('/home/nkroft')
+        self.pyfs.loaded_inodes.reset_stats()
+
+        #warm lookups only load the final inode
+        self.pyfs.resolve('/home/nkroft')
+        self.assertEqual(self.pyfs.loaded_inodes.hits + self.pyfs.loaded_inodes.misses, 1)
+
+    @log_test_case
+    def test_dentry_invalidation(self):
+        self.assertRaises(FileNotFoundError, self.pyfs.resolve, '/home/new')
+        home = self.pyfs.resolve('/home')
+        home.make_dir('new')
+        self.assertTrue(self.pyfs.resolve('/home/new').is_dir)
+
+        home.unlink('new')
+        self.assertRaises(FileNotFoundError, self.pyfs.resolve, '/home/new')
+
+        #a directory created where a removed one lived must not see stale entries
+        self.pyfs.resolve('/home/swalker')
+        swalker = self.pyfs.resolve('/home/swalker')
+        swalker.make_dir('docs')
+        self.pyfs.resolve('/home/swalker/docs')
+        swalker.unlink('docs')
+        home.unlink('swalker')
+        home.make_dir('other')
+        self.assertRaises(FileNotFoundError, self.pyfs.resolve, '/home/other/docs')
+
+class TestPYFSWriteBack(unittest.TestCase):
+    @log_test_case
+    def setUp(self):
+        self.fs = io.BytesIO()
+        self.pyfs = PYFS(self.fs, write_back=True)
+        self.pyfs.create_fs()
+
+    @log_test_case
+    def test_deferred_and_coalesced(self):
+        size = self.fs.getbuffer().nbytes
+        self.pyfs.reset_stats()
+        set_up_test_directories(self.pyfs)
+
+        #save_all in set_up_test_directories is the only flush
+        self.assertEqual(self.pyfs.stats()['io']['writes'], 1)
+        self.assertGreater(self.fs.getbuffer().nbytes, size)
+
+        new_fs = PYFS(self.fs)
+        self.assertTrue(new_fs.check_fs())
+        self.assertCountEqual([a.name for a in new_fs.resolve('/bin').ls()], [f'tst{idx}' for idx in range(33)])
+
+    @log_test_case
+    def test_reads_see_buffered_blocks(self):
+        self.pyfs.reset_stats()
+        self.pyfs.root_inode.make_dir('etc')
+        addr = self.pyfs.root_inode.find_entry('etc').addr
+        self.assertEqual(self.pyfs.stats()['io']['writes'], 0)
+
+        self.assertTrue(self.pyfs.read_inode(addr, force_read=True).is_dir)
+        self.pyfs.sync()
+        self.assertTrue(PYFS(self.fs).check_fs())
+
+    @log_test_case
+    def test_threshold(self):
+        self.pyfs.write_back_blocks = 4
+        self.pyfs.reset_stats()
+        for _ in range(4):
+            self.pyfs.create_inode().save()
+        self.assertGreater(self.pyfs.stats()['io']['writes'], 0)
+
+    @log_test_case
+    def test_adjacent_blocks_merged(self):
+        self.pyfs.reset_stats()
+        addrs = [self.pyfs.create_inode().addr for _ in range(8)]
+        self.pyfs.save_all()
+
+        #root block plus one write for the run of new inodes and the bitmap
+        self.assertEqual(self.pyfs.stats()['io']['writes'], 2)
+        self.assertEqual(max(addrs) - min(addrs), 8)
+
+class TestPYFSStats(unittest.TestCase):
+    @log_test_case
+    def setUp(self):
+        self.events = []
+        self.fs = io.BytesIO()
+        self.pyfs = PYFS(self.fs, trace=lambda op, **fields: self.events.append((op, fields)))
+        self.pyfs.create_fs()
+        set_up_test_directories(self.pyfs)
+
+    @log_test_case
+    def test_counters(self):
+        self.pyfs.reset_stats()
+        self.events.clear()
+
+        self.pyfs.loaded_inodes.clear()
+        self.pyfs.read_root_inode()
+        self.pyfs.resolve('/etc/sys')
+        self.pyfs.resolve('/etc/sys')
+        self.pyfs.sync()
+
+        stats = self.pyfs.stats()
+        self.assertEqual(stats['io']['reads'], 3)
+        self.assertEqual(stats['io']['blocks_read'], 3)
+        self.assertEqual(stats['io']['bytes_read'], 3 * DEFAULT_BLOCK_SIZE)
+        self.assertEqual(stats['io']['writes'], 0)
+        self.assertEqual(stats['io']['flushes'], 1)
+        self.assertEqual(stats['io']['latency']['read']['count'], 3)
+        self.assertEqual(sum(stats['io']['latency']['read']['buckets_us'].values()), 3)
+        self.assertEqual(stats['dentries']['hits'], 2)
+
+        self.assertEqual([op for op, _ in self.events], ['read', 'read', 'read', 'flush'])
+        self.assertEqual(self.events[0][1]['offset'], DEFAULT_BLOCK_SIZE)
+        self.assertEqual(self.events[0][1]['size'], DEFAULT_BLOCK_SIZE)
+
+    @log_test_case
+    def test_writes(self):
+        self.pyfs.reset_stats()
+        self.pyfs.root_inode.make_dir('tmp')
+
+        stats = self.pyfs.stats()
+        self.assertGreater(stats['io']['writes'], 0)
+        self.assertEqual(stats['io']['bytes_written'], stats['io']['writes'] * DEFAULT_BLOCK_SIZE)
+        self.assertEqual(stats['io']['flushes'], stats['io']['writes'])
@@ -0,0 +1,83 @@
+import unittest
+import logging
+import multiprocessing
+import os
+import tempfile
+
+from pyfs import PYFS, SharedPathIndex, ReadOnlyFilesystem
+
+from tests.test_common import log_test_case, set_up_test_directories
+
+logging.basicConfig(filename="test_pyfs.log", level=logging.WARNING)
+
+PATHS = ['/', '/etc/sys', '/home/nkroft', '/bin/tst32', '/etc/big']
+
+def resolve_in_worker(args):
+    image, index_name = args
+    index = SharedPathIndex.attach(index_name)
+    try:
+        with open(image, 'rb') as f:
+            fs = PYFS(f, read_only=True, use_mmap=True, shared_index=index)
+            fs.check_fs()
+            addrs = [fs.resolve(path).addr for path in PATHS]
+            with fs.open('/etc/big') as data:
+                content = data.read()
+            return addrs, content, {addr for addr, _ in fs.loaded_inodes.items()}
+    finally:
+        index.close()
+
+class TestSharedPathIndex(unittest.TestCase):
+    @log_test_case
+    def setUp(self):
+        fd, self.image = tempfile.mkstemp()
+        os.close(fd)
+
+        with open(self.image, 'r+b') as f:
+            fs = PYFS(f)
+            fs.create_fs()
+            set_up_test_directories(fs)
+            with fs.open('/etc/big', 'wb') as data:
+                data.write(b'pyfs' * 5000)
+            fs.save_all()
+
+        self.f = open(self.image, 'rb')
+        self.pyfs = PYFS(self.f, read_only=True, use_mmap=True)
+        self.assertTrue(self.pyfs.check_fs())
+
+    def tearDown(self):
+        self.f.close()
+        os.unlink(self.image)
+
+    @log_test_case
+    def test_read_only(self):
+        self.assertRaises(ReadOnlyFilesystem, self.pyfs.root_inode.make_dir, 'tmp')
+        self.assertRaises(ReadOnlyFilesystem, self.pyfs.open, '/etc/big', 'r+b')
+        self.assertRaises(ValueError, PYFS, self.f, read_only=True, journal=True)
+
+        with self.pyfs.open('/etc/big') as f:
+            self.assertEqual(f.read(8), b'pyfspyfs')
+
+    @log_test_case
+    def test_lookup(self):
+        with SharedPathIndex.build(self.pyfs) as index:
+            self.assertEqual(len(index), 44)
+            self.assertEqual(index.lookup('/etc/sys'), (self.pyfs.resolve('/etc/sys').addr, True))
+            self.assertEqual(index.lookup('/etc/./big'), (self.pyfs.resolve('/etc/big').addr, False))
+            self.assertIsNone(index.lookup('/etc/missing'))
+
+            self.assertRaises(ValueError, PYFS, self.f, shared_index=index)
+
+    @log_test_case
+    def test_workers(self):
+        expected = [self.pyfs.resolve(path).addr for path in PATHS]
+        parents = {self.pyfs.resolve(path).addr for path in ('/etc', '/home', '/bin')}
+
+        with SharedPathIndex.build(self.pyfs) as index:
+            with multiprocessing.Pool(2) as pool:
+                results = pool.map(resolve_in_worker, [(self.image, index.name)] * 4)
+
+        for addrs, content, loaded in results:
+            self.assertEqual(addrs, expected)
+            self.assertEqual(content, b'pyfs' * 5000)
+            # directories along the paths are never read by the workers
+            self.assertFalse(loaded & parents)
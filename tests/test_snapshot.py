@@ -0,0 +1,137 @@
+import unittest
+import logging
+import io
+
+from pyfs import PYFS, SharedInode, InodeEntryExists
+from pyfs.constants import DEFAULT_BLOCK_SIZE, INODE_META_SIZE
+
+from tests.test_common import log_test_case, set_up_test_directories
+
+logging.basicConfig(filename="test_pyfs.log", level=logging.WARNING)
+
+CAPACITY = DEFAULT_BLOCK_SIZE - INODE_META_SIZE
+
+class TestPYFSSnapshot(unittest.TestCase):
+    @log_test_case
+    def setUp(self):
+        self.fs = io.BytesIO()
+        self.pyfs = PYFS(self.fs)
+        self.pyfs.create_fs()
+        set_up_test_directories(self.pyfs)
+        self.payload = bytes((idx * 7919) % 251 for idx in range(CAPACITY * 3 + 17))
+        with self.pyfs.open('/etc/X11/xorg.conf', 'wb') as f:
+            f.write(self.payload)
+
+    def used(self) -> int:
+        return self.pyfs.allocator.end_page - self.pyfs.allocator.free_count()
+
+    def read(self, path) -> bytes:
+        with self.pyfs.open(path, 'rb') as f:
+            return f.read()
+
+    @log_test_case
+    def test_snapshot_costs_one_directory(self):
+        self.pyfs.snapshot('first')
+        used = self.used()
+        self.pyfs.snapshot('second')
+
+        self.assertEqual(self.used(), used + 1)
+        self.assertEqual(self.pyfs.snapshots(), ['first', 'second'])
+        self.assertEqual(self.read('/.snapshots/second/etc/X11/xorg.conf'), self.payload)
+        self.assertEqual(self.pyfs.resolve('/.snapshots/first/etc').addr, self.pyfs.resolve('/etc').addr)
+
+        #snapshots are not taken of other snapshots
+        self.assertIsNone(self.pyfs.resolve('/.snapshots/second').find_entry('.snapshots'))
+        with self.assertRaises(InodeEntryExists):
+            self.pyfs.snapshot('first')
+
+    @log_test_case
+    def test_changes_copy_the_path(self):
+        self.pyfs.snapshot('before')
+        used = self.used()
+
+        with self.pyfs.open('/etc/X11/xorg.conf', 'r+b') as f:
+            f.write(b'changed')
+
+        #etc, X11 and the 4 block file were copied, nothing else
+        self.assertEqual(self.used(), used + 6)
+        self.assertEqual(self.read('/.snapshots/before/etc/X11/xorg.conf'), self.payload)
+        self.assertEqual(self.read('/etc/X11/xorg.conf'), b'changed' + self.payload[7:])
+        self.assertEqual(self.pyfs.resolve('/etc/network').addr, self.pyfs.resolve('/.snapshots/before/etc/network').addr)
+        self.assertNotEqual(self.pyfs.resolve('/etc').addr, self.pyfs.resolve('/.snapshots/before/etc').addr)
+
+        #the copied path is private, changing it again copies nothing
+        used = self.used()
+        self.pyfs.resolve('/etc/X11', write=True).make_dir('fonts')
+        self.assertEqual(self.used(), used + 1)
+        self.assertIsNone(self.pyfs.resolve('/.snapshots/before/etc/X11').find_entry('fonts'))
+
+    @log_test_case
+    def test_shared_inode_not_changed_in_place(self):
+        self.pyfs.snapshot('before')
+        with self.assertRaises(SharedInode):
+            self.pyfs.resolve('/etc').make_dir('new')
+        with self.assertRaises(SharedInode):
+            self.pyfs.resolve('/home').unlink('nkroft')
+
+        self.pyfs.resolve('/etc', write=True).make_dir('new')
+        self.assertIsNotNone(self.pyfs.resolve('/etc/new'))
+        with self.assertRaises(FileNotFoundError):
+            self.pyfs.resolve('/.snapshots/before/etc/new')
+
+    @log_test_case
+    def test_clone(self):
+        self.pyfs.clone('/etc', '/home/etc')
+        self.assertEqual(self.pyfs.resolve('/etc').ref_count, 2)
+        self.assertEqual(self.read('/home/etc/X11/xorg.conf'), self.payload)
+
+        with self.pyfs.open('/home/etc/X11/xorg.conf', 'wb') as f:
+            f.write(b'mine')
+        self.assertEqual(self.read('/home/etc/X11/xorg.conf'), b'mine')
+        self.assertEqual(self.read('/etc/X11/xorg.conf'), self.payload)
+
+        #.. follows the path taken, not the parent the inode was created under
+        self.assertEqual(self.pyfs.resolve('/home/etc/sys/../..').addr, self.pyfs.resolve('/home').addr)
+
+        with self.assertRaises(ValueError):
+            self.pyfs.clone('/etc', '/etc/sys/etc')
+
+    @log_test_case
+    def test_delete_snapshot(self):
+        base = self.used()
+        self.pyfs.snapshot('before')
+        with self.pyfs.open('/etc/X11/xorg.conf', 'wb') as f:
+            f.write(b'changed')
+        self.pyfs.resolve('/home', write=True).unlink('swalker')
+
+        self.pyfs.delete_snapshot('before')
+        self.assertEqual(self.pyfs.snapshots(), [])
+        self.assertEqual(self.pyfs.resolve('/bin').ref_count, 1)
+
+        #the old file and swalker went with the snapshot, .snapshots is kept
+        self.assertEqual(self.used(), base + 1 - 3 - 1)
+        self.assertEqual(self.read('/etc/X11/xorg.conf'), b'changed')
+
+        #unshared inodes can be changed in place again
+        self.pyfs.resolve('/bin').make_dir('new')
+
+    @log_test_case
+    def test_persisted(self):
+        self.pyfs.extent_files = True
+        with self.pyfs.open('/home/extents', 'wb') as f:
+            f.write(self.payload)
+        self.pyfs.snapshot('before')
+        with self.pyfs.open('/home/extents', 'r+b') as f:
+            f.write(b'changed')
+        self.pyfs.save_all()
+
+        new_fs = PYFS(self.fs)
+        self.assertTrue(new_fs.check_fs())
+        with new_fs.open('/.snapshots/before/home/extents', 'rb') as f:
+            self.assertEqual(f.read(), self.payload)
+        with new_fs.open('/home/extents', 'rb') as f:
+            self.assertEqual(f.read(), b'changed' + self.payload[7:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import unittest
+import io
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pyfs import PYFS, InodeEntryExists
+from pyfs.locks import RWLock
+
+from tests.test_common import log_test_case, set_up_test_directories
+
+logging.basicConfig(filename="test_pyfs.log", level=logging.WARNING)
+
+class TestRWLock(unittest.TestCase):
+    def test_shared_readers(self):
+        lock = RWLock()
+        inside = threading.Barrier(2, timeout=5)
+
+        def reader():
+            with lock.read():
+                inside.wait()
+
+        threads = [threading.Thread(target=reader) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_writer_excludes_readers(self):
+        lock = RWLock()
+        events = []
+
+        def reader():
+            with lock.read():
+                events.append('read')
+
+        with lock.write():
+            thread = threading.Thread(target=reader)
+            thread.start()
+            thread.join(0.1)
+            self.assertEqual(events, [])
+
+            # a writer may take either side again
+            with lock.write(), lock.read():
+                pass
+
+        thread.join(5)
+        self.assertEqual(events, ['read'])
+
+    def test_no_upgrade(self):
+        lock = RWLock()
+        with lock.read():
+            with self.assertRaises(RuntimeError):
+                lock.acquire_write()
+
+class ThreadSafeMixin:
+    WORKERS = 8
+
+    def test_concurrent_resolve(self):
+        paths = ['/etc/sys', '/home/nkroft', '/bin/tst5', '/bin/tst32', '/etc/X11'] * 20
+        expected = [self.pyfs.resolve(path).addr for path in paths]
+        self.pyfs.dentries.clear()
+        self.pyfs.loaded_inodes.clear()
+        self.pyfs.read_root_inode()
+
+        with ThreadPoolExecutor(self.WORKERS) as pool:
+            found = list(pool.map(lambda path: self.pyfs.resolve(path).addr, paths))
+        self.assertEqual(found, expected)
+
+    def test_concurrent_make_dir(self):
+        home = self.pyfs.resolve('/home')
+
+        def make(idx):
+            # every name is created twice, only one of them may win
+            try:
+                home.make_dir(f'user{idx // 2}')
+                return 1
+            except InodeEntryExists:
+                return 0
+
+        with ThreadPoolExecutor(self.WORKERS) as pool:
+            created = sum(pool.map(make, range(160)))
+        self.pyfs.save_all()
+
+        self.assertEqual(created, 80)
+        names = [a.name for a in home.ls()]
+        self.assertEqual(len(names), len(set(names)))
+
+        fs = PYFS(self.fs)
+        self.assertTrue(fs.check_fs())
+        self.assertEqual(len(fs.resolve('/home').ls()), 83)
+        addrs = [a.addr for a in fs.resolve('/home').ls()]
+        self.assertEqual(len(addrs), len(set(addrs)))
+
+    def test_concurrent_files(self):
+        def write(idx):
+            with self.pyfs.open(f'/etc/file{idx}', 'wb') as f:
+                f.write(bytes([idx]) * 10000)
+
+        with ThreadPoolExecutor(self.WORKERS) as pool:
+            list(pool.map(write, range(16)))
+        self.pyfs.save_all()
+
+        for idx in range(16):
+            with self.pyfs.open(f'/etc/file{idx}') as f:
+                self.assertEqual(f.read(), bytes([idx]) * 10000)
+
+class TestThreadSafeBytesIO(ThreadSafeMixin, unittest.TestCase):
+    @log_test_case
+    def setUp(self):
+        self.fs = io.BytesIO()
+        self.pyfs = PYFS(self.fs, thread_safe=True)
+        self.pyfs.create_fs()
+        set_up_test_directories(self.pyfs)
+
+class TestThreadSafeFile(ThreadSafeMixin, unittest.TestCase):
+    @log_test_case
+    def setUp(self):
+        self.fs = tempfile.TemporaryFile()
+        self.pyfs = PYFS(self.fs, thread_safe=True, write_back=True)
+        self.pyfs.create_fs()
+        set_up_test_directories(self.pyfs)
+
+    def tearDown(self):
+        self.fs.close()
+
+class TestThreadSafeJournal(ThreadSafeMixin, unittest.TestCase):
+    @log_test_case
+    def setUp(self):
+        self.fs = tempfile.TemporaryFile()
+        self.pyfs = PYFS(self.fs, thread_safe=True, journal=True, cache_entries=16)
+        self.pyfs.create_fs()
+        set_up_test_directories(self.pyfs)
+
+    def tearDown(self):
+        self.fs.close()
+
+class TestThreadSafeSmallCache(ThreadSafeMixin, unittest.TestCase):
+    WORKERS = 16
+
+    @log_test_case
+    def setUp(self):
+        self.fs = io.BytesIO()
+        self.pyfs = PYFS(self.fs, thread_safe=True, cache_entries=32)
+        self.pyfs.create_fs()
+        set_up_test_directories(self.pyfs)
+
+    def test_lock_belongs_to_block(self):
+        etc = self.pyfs.resolve('/etc')
+        self.assertIs(self.pyfs.read_inode(etc.addr, force_read=True).lock, etc.lock)
+
+    def test_working_set_larger_than_cache(self):
+        # the shared directories outgrow the cache, so inodes other threads hold keep being evicted
+        def work(idx):
+            self.pyfs.resolve('/etc').make_dir(f'dir{idx}')
+            for sub in range(20):
+                self.pyfs.resolve(f'/etc/dir{idx}').make_dir(f'sub{sub}')
+                with self.pyfs.open(f'/home/file{idx}_{sub}', 'wb') as f:
+                    f.write(bytes([idx]) * 100)
+
+        with ThreadPoolExecutor(self.WORKERS) as pool:
+            list(pool.map(work, range(16)))
+        self.pyfs.save_all()
+
+        fs = PYFS(self.fs)
+        self.assertTrue(fs.check_fs())
+        self.assertEqual(len(fs.resolve('/home').ls()), 3 + 16 * 20)
+        for idx in range(16):
+            self.assertEqual(len(fs.resolve(f'/etc/dir{idx}').ls()), 20)
+            with fs.open(f'/home/file{idx}_19') as f:
+                self.assertEqual(f.read(), bytes([idx]) * 100)